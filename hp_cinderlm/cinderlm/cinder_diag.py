@@ -19,13 +19,13 @@ from __future__ import print_function
 
 import argparse
 import json
-import os
-import re
 import socket
 import sys
 import time
 import yaml
 
+from cinderlm.proc_table import ProcessTable
+
 PROC_DIR = '/proc'
 
 # This python module implements a single cinder service check to
@@ -61,6 +61,10 @@ def create_arguments(parser):
     client_args.add_argument('--cinder-services', dest='cinder_services',
                              default=False, action='store_true',
                              help='Do a process count of cinder services')
+    client_args.add_argument('--process-stats', dest='process_stats',
+                             default=False, action='store_true',
+                             help='Also report the memory and cpu use of '
+                                  'the cinder services')
 
 
 def metric(name, value, dimensions, timestamp):
@@ -86,34 +90,42 @@ def metric(name, value, dimensions, timestamp):
     return metric
 
 
-def _check_process(name):
-    found = 0
-    pid_re = re.compile("^\d+")
-    for sub_directory in [d for d in os.listdir(PROC_DIR) if pid_re.match(d)]:
-        if (os.path.exists(os.path.join(PROC_DIR, sub_directory, "cmdline"))):
-            cmdline = os.path.join(PROC_DIR, sub_directory, "cmdline")
-            try:
-                if name in open(cmdline, "r").read():
-                    found += 1
-            except IOError:
-                continue
-    return found
+def check_process(name, processes=None):
+    if processes is None:
+        processes = ProcessTable.load(PROC_DIR)
+    return processes.count(name)
 
 
-def check_process(name):
-    return _check_process(name)
+def stats_metrics(subservice, processes, timestamp):
+    """Memory and cpu use of the processes of a subservice"""
+    stats = processes.stats(processes.pids(subservice))
+    dimensions = {'service': MODULE_SERVICE_NAME,
+                  'hostname': socket.gethostname(),
+                  'component': subservice}
+    return [{'metric': MODULE_METRIC_NAME + '.rss_bytes',
+             'value': stats.rss_bytes,
+             'dimensions': dimensions,
+             'timestamp': timestamp},
+            {'metric': MODULE_METRIC_NAME + '.cpu_seconds',
+             'value': round(stats.cpu_seconds, 2),
+             'dimensions': dict(dimensions),
+             'timestamp': timestamp}]
 
 
-def check_cinder_processes():
+def check_cinder_processes(process_stats=False):
     results = []
+    # One pass of /proc for all the subservices
+    processes = ProcessTable.load(PROC_DIR)
     for subservice in SUBSERVICES:
-        val = check_process(subservice)
+        val = check_process(subservice, processes)
         c = metric(MODULE_METRIC_NAME, val,
                    {'service': MODULE_SERVICE_NAME,
                     'hostname': socket.gethostname(),
                     'component': subservice},
                    time.time())
         results.append(c)
+        if process_stats and val:
+            results.extend(stats_metrics(subservice, processes, time.time()))
 
     return results
 
@@ -124,7 +136,7 @@ def main():
 
     results = []
     if args.cinder_services:
-        results = check_cinder_processes()
+        results = check_cinder_processes(args.process_stats)
     if args.json:
         print(json.dumps(results, sort_keys=True, indent=4))
     else:
@@ -0,0 +1,190 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Snapshot of the process table, read from /proc in a single pass.
+
+The cmdline of each process is read once and the processes are indexed by
+command name: the base name of the program run and, when that is an
+interpreter such as python, of the script it runs. So both
+"/usr/bin/python /usr/bin/cinder-volume --config-file /etc/cinder/cinder.conf"
+and "/usr/bin/cinder-volume ..." are found as cinder-volume.
+
+Memory and cpu use are read from /proc/<pid>/stat only when asked for.
+
+This is a copy of swiftlm.utils.proc_table, since cinderlm does not depend
+on swiftlm. The swiftlm tests fail if the code of the copies differs, change
+both.
+"""
+
+from collections import namedtuple
+import os
+
+PROC_DIR = '/proc'
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = 100
+    PAGE_SIZE = 4096
+
+# Options of python whose value is the following argument, besides -c and
+# -m (the module run with -m is indexed as the script)
+PYTHON_VALUE_OPTIONS = frozenset(['-Q', '-W', '-X'])
+
+# Fields of /proc/<pid>/stat, counting from the state field that follows
+# the parenthesised command
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_RSS = 21
+
+# Total resident memory (bytes) and cpu time (user plus system seconds) of
+# a group of processes
+ProcessStats = namedtuple('ProcessStats', ['rss_bytes', 'cpu_seconds'])
+
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return None
+
+
+def command_names(cmdline):
+    """
+    The names a process is indexed by
+
+    :param cmdline: contents of /proc/<pid>/cmdline
+    :return: list of command names, empty for a kernel thread
+    """
+    args = [arg for arg in cmdline.split('\0') if arg]
+    if len(args) == 1 and ' ' in args[0]:
+        # A process that has rewritten its command line
+        args = args[0].split()
+    if not args or args[0].startswith('-'):
+        return []
+    names = [os.path.basename(args[0])]
+    rest = args[1:]
+    if names[0].startswith('python'):
+        # Skip the interpreter options, e.g. "python -u <script>"
+        while rest and rest[0].startswith('-'):
+            option = rest.pop(0)
+            if option == '-c':
+                # A command rather than a script
+                return names
+            if option == '-m':
+                break
+            if option in PYTHON_VALUE_OPTIONS:
+                rest = rest[1:]
+    if rest and not rest[0].startswith('-'):
+        names.append(os.path.basename(rest[0]))
+    return names
+
+
+def read_stat(proc_dir, pid):
+    """
+    Read the resident memory and cpu time of a process
+
+    :return: ProcessStats or None if the process has gone
+    """
+    stat = read_file(os.path.join(proc_dir, str(pid), 'stat'))
+    if not stat or ')' not in stat:
+        return None
+    # The command may contain spaces and parentheses
+    fields = stat[stat.rindex(')') + 2:].split()
+    try:
+        ticks = int(fields[STAT_UTIME]) + int(fields[STAT_STIME])
+        rss = int(fields[STAT_RSS])
+    except (IndexError, ValueError):
+        return None
+    return ProcessStats(rss * PAGE_SIZE, float(ticks) / CLOCK_TICKS)
+
+
+class ProcessTable(object):
+    """
+    The processes running when the table was loaded
+
+    cmdlines is a dict of pid: command line (arguments separated by spaces)
+    and index a dict of command name: list of pids.
+    """
+
+    def __init__(self, cmdlines, index, proc_dir=PROC_DIR):
+        self.cmdlines = cmdlines
+        self.index = index
+        self.proc_dir = proc_dir
+
+    @classmethod
+    def load(cls, proc_dir=PROC_DIR):
+        """
+        Read the command line of every process
+
+        :return: a ProcessTable, empty if proc_dir cannot be read
+        """
+        cmdlines = {}
+        index = {}
+        try:
+            entries = os.listdir(proc_dir)
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            cmdline = read_file(os.path.join(proc_dir, entry, 'cmdline'))
+            if not cmdline:
+                # The process has exited, or is a kernel thread
+                continue
+            pid = int(entry)
+            cmdlines[pid] = cmdline.replace('\0', ' ').strip()
+            for name in set(command_names(cmdline)):
+                index.setdefault(name, []).append(pid)
+        for pids in index.values():
+            pids.sort()
+        return cls(cmdlines, index, proc_dir)
+
+    def __len__(self):
+        return len(self.cmdlines)
+
+    def pids(self, name):
+        """
+        The pids of the processes running a command
+
+        :param name: a command name, such as cinder-volume
+        :return: sorted list of pids
+        """
+        return list(self.index.get(name, []))
+
+    def count(self, name):
+        return len(self.index.get(name, []))
+
+    def is_running(self, name):
+        return name in self.index
+
+    def stats(self, pids):
+        """
+        The total resident memory and cpu time of processes. Processes that
+        have exited since the table was loaded are left out.
+
+        :return: ProcessStats
+        """
+        rss_bytes = 0
+        cpu_seconds = 0.0
+        for pid in pids:
+            stat = read_stat(self.proc_dir, pid)
+            if stat is not None:
+                rss_bytes += stat.rss_bytes
+                cpu_seconds += stat.cpu_seconds
+        return ProcessStats(rss_bytes, cpu_seconds)
@@ -58,7 +58,9 @@ setup(
             'connectivity = swiftlm.systems.connectivity:main',
             'drive-audit = swiftlm.swift.drive_audit:main',
             'file-ownership = swiftlm.swift.file_ownership:main',
+            'file-ownership-deep = swiftlm.swift.file_ownership:deep_audit_main',
             'swift-services = swiftlm.swift.swift_services:main',
+            'swift-process-stats = swiftlm.swift.swift_services:process_stats_main',
             'network-interface = swiftlm.generic_hardware.network_interface:main',
             'replication = swiftlm.swift.replication:main',
             'hpssacli = swiftlm.hp_hardware.hpssacli:main',
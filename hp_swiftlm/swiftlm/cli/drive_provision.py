@@ -43,11 +43,13 @@ import socket
 import subprocess
 import threading
 import json
-import signal
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 from random import randint
 from swiftlm.utils.drivedata import Drive, LogicalVol, DISK_MOUNT, LVM_MOUNT, \
     SwiftlmInvalidConfig
+from swiftlm.utils import drive_inventory as inventory
 
 # TODO - Will need to convert most if not all of the output messages to log
 # entries when logging is setup
@@ -55,13 +57,24 @@ from swiftlm.utils.drivedata import Drive, LogicalVol, DISK_MOUNT, LVM_MOUNT, \
 host_file = "/etc/hosts"
 conf_file = "/etc/swift/hlm_storage.conf"
 thread_timeout = 1800
+parted_timeout = 20
+parted_jobs = 16
+provision_jobs = 8
 
 supported_file_systems = ["xfs"]
 disk_model_file = "/etc/swift/disk_models.yml"
 
 
-class TimeoutError(Exception):
-        pass
+class ProvisionError(Exception):
+    pass
+
+
+# Output of "parted <drive> print" for each drive probed during this run
+parted_cache = {}
+
+# Devices of the node read from sysfs and udev (loaded by main()). Devices
+# that are not in it are probed with parted, blockdev etc.
+drive_inventory = inventory.DriveInventory([])
 
 
 # TODO - Will need to use config processor / HLM input to
@@ -109,14 +122,130 @@ def get_ip_label(ip):
     return ip_label
 
 
+def run_parted(drive, timeout=parted_timeout):
+    """
+    Run "parted <drive> print", killing it if it takes more than timeout
+    seconds
+
+    Only the parted process of this drive is killed, so probes of other
+    drives are not affected by a hung drive. The result is cached for the
+    rest of the run.
+
+    :param drive: drive to probe
+    :param timeout: seconds to wait for parted
+    :return: (status, output) of parted, status is None if parted timed out
+    """
+    if drive in parted_cache:
+        return parted_cache[drive]
+
+    child = subprocess.Popen(['/sbin/parted', drive, 'print'],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = []
+    reader = threading.Thread(
+        target=lambda: output.append(child.communicate()[0]))
+    reader.daemon = True
+    reader.start()
+    reader.join(timeout)
+
+    if reader.is_alive():
+        # A drive can hang parted so that it does not die straight away
+        # when killed, so give up on it rather than wait
+        try:
+            child.kill()
+        except OSError:
+            pass
+        reader.join(1)
+        status, output = None, ''
+    else:
+        status, output = child.returncode, output[0]
+        if output.endswith('\n'):
+            output = output[:-1]
+
+    parted_cache[drive] = (status, output)
+    return status, output
+
+
+def probe_drives(drives, timeout=parted_timeout, jobs=parted_jobs):
+    """
+    Run parted on drives in parallel and cache the results (see run_parted)
+
+    :param drives: list of drives
+    :param timeout: seconds to wait for parted on each drive
+    :param jobs: maximum number of parted processes run at once
+    """
+    drives = [drive for drive in drives if drive not in parted_cache]
+    if not drives:
+        return
+
+    pool = ThreadPool(min(jobs, len(drives)))
+    try:
+        pool.map(lambda drive: run_parted(drive, timeout), drives)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def inventory_device(device_path):
+    """
+    Returns the inventory entry of a device if udev has data for it, None if
+    the device must be probed instead
+    """
+    device = drive_inventory.find(device_path)
+    if device is not None and device.udev:
+        return device
+    return None
+
+
+def inventory_partitions(drive):
+    """
+    Returns the partitions of a drive from the inventory, as parted would
+    list them: a filesystem on the whole drive is partition 1
+
+    :return: list of (partition number, BlockDevice), None if the drive is
+             not in the inventory
+    """
+    device = inventory_device(drive)
+    if device is None:
+        return None
+
+    if not device.partitions:
+        if device.fs_type:
+            return [(1, device)]
+        return []
+
+    return [(part.number, part) for part in device.partitions]
+
+
+def is_boot_partition(part, boot_label):
+    """
+    Check if an inventory partition is named or flagged as a boot partition
+    """
+    return (boot_label in (part.part_name or "") or
+            boot_label in part.flags())
+
+
+def get_partition_label_no(part, ip_label):
+    """
+    Returns the swift disk number of an inventory partition that has already
+    been labelled (named with its swift label), "-1" if it has not
+    """
+    name = part.part_name or ""
+    if name.startswith(ip_label + "h"):
+        return name[len(ip_label) + 1:]
+    return "-1"
+
+
 def get_drive_partitions(parted_d):
     """
-    Returns all partition of a given drives
+    Returns all partition of a given drives, as the lines of the partition
+    table shown by "parted <drive> print"
     """
-    status, output = commands.getstatusoutput('/sbin/parted ' + parted_d +
-                                              ' print')
+    status, output = run_parted(parted_d)
 
-    if status == 0:
+    if status is None:
+        print("Error reading %s - parted is hanging for device" % (parted_d))
+        sys.exit(1)
+    elif status == 0:
         if "unrecognised disk label" in output:
             return []
         else:
@@ -189,14 +318,17 @@ def check_data_matches(cp_input_list, all_drives):
 
                 part_match = False
 
-                partitions = get_drive_partitions(drive)
-
-                for part in partitions:
-                    if part:
-                        part = ' '.join(part.split())
+                inventoried = inventory_partitions(drive)
+                if inventoried is not None:
+                    part_match = any(str(number) == partition
+                                     for number, _ in inventoried)
+                else:
+                    for part in get_drive_partitions(drive):
+                        if part:
+                            part = ' '.join(part.split())
 
-                        if part[0] == partition:
-                            part_match = True
+                            if part[0] == partition:
+                                part_match = True
 
                 if not part_match:
                     print ("%s%s is targeted for swift use but device %s does "
@@ -212,28 +344,15 @@ def check_data_matches(cp_input_list, all_drives):
     return data_conflict
 
 
-def handler(signum, frame):
-    """
-    Handler that is called if the parted command is > 10 seconds. This will
-    then kill the parted command.
-    """
-    pid_out = commands.getoutput('ps -A')
-
-    for line in pid_out.splitlines():
-        if 'parted' in line:
-            pid = int(line.split(None, 1)[0])
-            os.kill(pid, signal.SIGKILL)
-
-    raise TimeoutError("Parted command is hanging for device")
-
-
 def find_parted_drives(drives):
     """
     Find partitioned devices
 
     This goes through each device on he node. If there is no partition present
     it will be added to a list for later partitioning. Output is divided into
-    partitioned and unpartitioned drives
+    partitioned and unpartitioned drives. Drives that are not in the
+    inventory are probed in parallel (see probe_drives) and a drive where
+    parted hangs is in neither list.
 
     : param drives: list of all drives
     : return partitioned_drives: list of partitioned drives
@@ -242,29 +361,28 @@ def find_parted_drives(drives):
     partitioned_drives = []
     unpartitioned_drives = []
 
-    signal.signal(signal.SIGALRM, handler)
+    probe_drives([drive for drive in drives if not inventory_device(drive)])
 
     for drive in drives:
 
-        status = -1
-        signal.alarm(20)
+        device = inventory_device(drive)
+        if device is not None:
+            if device.has_label:
+                partitioned_drives.append(drive)
+            else:
+                unpartitioned_drives.append(drive)
+            continue
 
-        try:
-            status, output = commands.getstatusoutput('/sbin/parted ' +
-                                                      drive + ' print')
-        except TimeoutError as exc:
-            print("%s %s - killing command" % (exc, drive))
+        status, output = run_parted(drive)
 
-        if status == 0 and "Error" not in output:
+        if status is None:
+            print("Parted command is hanging for device %s - killed command"
+                  % (drive))
+        elif status == 0 and "Error" not in output:
             partitioned_drives.append(drive)
-        elif status == -1:
-            continue
         else:
             unpartitioned_drives.append(drive)
 
-    # Disable the alarm
-    signal.alarm(0)
-
     return partitioned_drives, unpartitioned_drives
 
 
@@ -309,6 +427,14 @@ def separate_labelled_devices(ip_label, parted_drives, supported_file_systems,
     unlabelled_partitions = []
 
     for a_drive in parted_drives:
+        inventoried = inventory_partitions(a_drive)
+        if inventoried is not None:
+            separate_inventory_partitions(
+                a_drive, inventoried, ip_label, supported_file_systems,
+                boot_label, unlabelled_drives, raw_drives, dsk_label_list,
+                unlabelled_partitions)
+            continue
+
         drive_partitions = get_drive_partitions(a_drive)
 
         # Regular drive (one partition)
@@ -353,6 +479,48 @@ def separate_labelled_devices(ip_label, parted_drives, supported_file_systems,
     return unlabelled_drives, raw_drives, dsk_label_list, unlabelled_partitions
 
 
+def separate_inventory_partitions(a_drive, partitions, ip_label,
+                                  supported_file_systems, boot_label,
+                                  unlabelled_drives, raw_drives,
+                                  dsk_label_list, unlabelled_partitions):
+    """
+    Sort a drive found in the inventory into the lists of
+    separate_labelled_devices, using the number, filesystem and name of its
+    partitions
+
+    :param partitions: the partitions of the drive (see inventory_partitions)
+    """
+    # Regular drive (one partition)
+    if len(partitions) == 1:
+        _, part = partitions[0]
+        if ip_label in (part.part_name or ""):
+            # Keep a record of the disk numbers
+            number = get_partition_label_no(part, ip_label)
+            if number != "-1":
+                dsk_label_list.append([str(int(number)), a_drive + "1"])
+        elif part.fs_type in supported_file_systems:
+            unlabelled_drives.append(a_drive)
+        elif not is_boot_partition(part, boot_label):
+            raw_drives.append(a_drive)
+
+    # Raw drive (no partitions)
+    elif not partitions:
+        raw_drives.append(a_drive)
+
+    # Drive with multiple partitions
+    else:
+        for number, part in partitions:
+            if is_boot_partition(part, boot_label):
+                continue
+            if ip_label not in (part.part_name or ""):
+                unlabelled_partitions.append(a_drive + str(number))
+            else:
+                label_no = get_partition_label_no(part, ip_label)
+                if label_no != "-1":
+                    dsk_label_list.append([str(int(label_no)),
+                                          a_drive + str(number)])
+
+
 def create_volume_fs(cp_input_list, disk_label_list, iplabel):
     """
     Create xfs filesystems for any volumes that don't have one. Also, add
@@ -381,9 +549,16 @@ def create_volume_fs(cp_input_list, disk_label_list, iplabel):
         # Only interested in logical volumes
         if "lvm" in swift_name:
 
-            lvm_l_stat, lvm_l_out = \
-                commands.getstatusoutput("/usr/sbin/xfs_admin -l " +
-                                         full_vol)
+            volume = inventory_device(full_vol)
+            if volume is None:
+                lvm_l_stat, lvm_l_out = \
+                    commands.getstatusoutput("/usr/sbin/xfs_admin -l " +
+                                             full_vol)
+            elif volume.fs_type == "xfs":
+                lvm_l_stat = 0
+                lvm_l_out = 'label = "%s"' % (volume.fs_label or "")
+            else:
+                lvm_l_stat, lvm_l_out = 1, ""
 
             # Create an xfs filesystem if there is not already one present
             if lvm_l_stat != 0:
@@ -432,12 +607,215 @@ def create_volume_fs(cp_input_list, disk_label_list, iplabel):
     return blank_volumes, disk_label_list
 
 
-def format_drives(blank_drives, unparted_drives, fs, cp_input_list):
+class DriveTask(object):
+    """
+    The steps to provision a device, run one after the other
+
+    A step is a function that raises ProvisionError if it fails, in which
+    case the remaining steps are not run.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.steps = []
+        self.done = []
+        self.failed = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def run(self):
+        start = time.time()
+        for name, func, args in self.steps:
+            step_start = time.time()
+            try:
+                func(*args)
+            except ProvisionError as exc:
+                self.failed = name
+                self.error = str(exc)
+                break
+            self.done.append((name, time.time() - step_start))
+        self.elapsed = time.time() - start
+        return self
+
+    def report(self):
+        for name, elapsed in self.done:
+            print("%s: %s done (%.1fs)" % (self.device, name, elapsed))
+        if self.failed:
+            print("%s: %s failed - %s" % (self.device, self.failed,
+                                          self.error))
+
+    def result(self, status=None):
+        if status is None:
+            status = "failed" if self.failed else "ok"
+        return {"device": self.device,
+                "status": status,
+                "steps": [name for name, _, _ in self.steps],
+                "done": [name for name, _ in self.done],
+                "failed": self.failed,
+                "error": self.error,
+                "seconds": round(self.elapsed, 1)}
+
+
+class ProvisionTasks(object):
+    """
+    The steps to provision the devices of the node
+
+    Steps are added to the task of a device in the order they must run
+    (partition, mkfs, label, mount). The tasks of different devices run
+    concurrently, up to a limit.
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self.by_device = {}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, device, name, func, *args):
+        task = self.by_device.get(device)
+        if task is None:
+            task = self.by_device[device] = DriveTask(device)
+            self.tasks.append(task)
+        task.steps.append((name, func, args))
+
+    def run(self, jobs=provision_jobs, timeout=thread_timeout):
+        """
+        Run the tasks, reporting the status of each device as its task
+        completes
+
+        :param jobs: maximum number of tasks run at once
+        :param timeout: seconds to wait for the next task to complete, after
+                        which any task not completed is reported as timed
+                        out. Tasks that have not started are not run. A
+                        thread cannot be interrupted, so a command run by a
+                        task that was running (e.g. mkfs) may still be
+                        running when this returns.
+        :return: list of results (see DriveTask.result) in the order the
+                 devices were added
+        """
+        if not self.tasks:
+            return []
+
+        completed = set()
+        pool = ThreadPool(max(1, min(jobs, len(self.tasks))))
+        results = pool.imap_unordered(lambda task: task.run(), self.tasks)
+        try:
+            for _ in self.tasks:
+                task = results.next(timeout)
+                task.report()
+                completed.add(task.device)
+        except multiprocessing.TimeoutError:
+            print("Timed out after %ss waiting for %s" % (
+                timeout, ", ".join(task.device for task in self.tasks
+                                   if task.device not in completed)))
+            # Discard the queued tasks. The workers are daemon threads, the
+            # running tasks are abandoned rather than waited for.
+            pool.terminate()
+        else:
+            pool.close()
+            pool.join()
+
+        return [task.result() if task.device in completed
+                else task.result("timeout") for task in self.tasks]
+
+
+def print_summary(results):
+    """
+    Print the summary of the results of ProvisionTasks.run()
+
+    :return: the number of devices that failed or timed out
+    """
+    failures = 0
+    print("Provisioning summary:")
+    for result in results:
+        if result["status"] != "ok":
+            failures += 1
+        print("  %-20s %-8s %6.1fs  %s"
+              % (result["device"], result["status"], result["seconds"],
+                 ", ".join(result["steps"])))
+    print("%d devices provisioned, %d failed"
+          % (len(results) - failures, failures))
+    return failures
+
+
+def partition_drive(unparted):
+    """
+    Create a partition table with one partition on a drive
+
+    :param unparted: drive to partition
+    :raises ProvisionError: if a command fails
+    """
+    create_status, create_output = \
+        commands.getstatusoutput("/sbin/parted -s " + unparted +
+                                 " mklabel gpt")
+
+    if create_status != 0:
+        raise ProvisionError("Failed to create partition table for disk %s "
+                             "- %s" % (unparted, create_output))
+
+    partition_status, partition_output = \
+        commands.getstatusoutput("/sbin/parted -s -- " + unparted +
+                                 " mkpart primary 1 -1")
+
+    if partition_status != 0:
+        raise ProvisionError("Failed to create partition table for disk %s "
+                             "- %s" % (unparted, partition_output))
+
+    # The cached partition table is out of date
+    parted_cache.pop(unparted, None)
+    drive_inventory.forget(unparted)
+
+    blockdev_retry_max = 5
+    blockdev_retry_count = 0
+
+    while blockdev_retry_count < blockdev_retry_max:
+        blockdev_status, blockdev_output = \
+            commands.getstatusoutput("/sbin/blockdev --rereadpt " +
+                                     unparted)
+
+        if blockdev_status != 0:
+            blockdev_retry_count += 1
+            time.sleep(1)
+        else:
+            break
+
+    if blockdev_retry_max == blockdev_retry_count:
+        raise ProvisionError("Failed to reread the disks partition table %s "
+                             "- %s" % (unparted, blockdev_output))
+
+    # Need to introduce a delay between creating the partition and the
+    # file system
+    time.sleep(1)
+
+
+def make_filesystem(unparted, fs):
+    """
+    Create a filesystem on the partition of a drive partitioned by
+    partition_drive
+
+    :param unparted: drive that was partitioned
+    :param fs: type of filesystem to create
+    :raises ProvisionError: if the filesystem cannot be created
+    """
+    # Only supports xfs for now
+    if fs == "xfs":
+        filesys_status, filesys_output = \
+            commands.getstatusoutput("/sbin/mkfs.xfs -f -i size=1024 " +
+                                     unparted + "1")
+
+        if filesys_status != 0:
+            raise ProvisionError("Failed to create filesystem for disk %s - "
+                                 "%s" % (unparted, filesys_output))
+
+
+def format_drives(blank_drives, unparted_drives, fs, cp_input_list, tasks):
     """
     Partition all raw drives
 
-    As well as partitioning and adding a fs to a drive, the function will also
-    add them to the unlabelled drives list
+    As well as partitioning and adding a fs to a drive (see partition_drive
+    and make_filesystem), the function will also add them to the unlabelled
+    drives list. The drives are partitioned when the tasks are run.
 
     :param blank_drives: list of partitioned drives that do not have a swift
                          label
@@ -446,6 +824,7 @@ def format_drives(blank_drives, unparted_drives, fs, cp_input_list):
     :parama cp_input_list: list of tuples that show the devices selected by
                            the configuration(drive/part/lvm name, swift device
                            name)
+    :param tasks: ProvisionTasks to add the partition steps to
     :return blank_drives: see above
     """
     for unparted in unparted_drives:
@@ -463,59 +842,8 @@ def format_drives(blank_drives, unparted_drives, fs, cp_input_list):
                 print("%s has not been selected for swift use" % (unparted))
                 continue
 
-        # Partition the drive:
-        create_status, create_output = \
-            commands.getstatusoutput("/sbin/parted -s " + unparted +
-                                     " mklabel gpt")
-
-        if create_status != 0:
-            print("Error: Failed to create partition table for disk %s - %s"
-                  % (unparted, create_output))
-            sys.exit(1)
-
-        partition_status, partition_output = \
-            commands.getstatusoutput("/sbin/parted -s -- " + unparted +
-                                     " mkpart primary 1 -1")
-
-        if partition_status != 0:
-            print("Error: Failed to create partition table for disk %s - %s"
-                  % (unparted, partition_output))
-            sys.exit(1)
-
-        blockdev_retry_max = 5
-        blockdev_retry_count = 0
-
-        while blockdev_retry_count < blockdev_retry_max:
-            blockdev_status, blockdev_output = \
-                commands.getstatusoutput("/sbin/blockdev --rereadpt " +
-                                         unparted)
-
-            if blockdev_status != 0:
-                blockdev_retry_count += 1
-                time.sleep(1)
-            else:
-                break
-
-        if blockdev_retry_max == blockdev_retry_count:
-            print("Error: Failed to reread the disks partition table %s - %s"
-                  % (unparted, blockdev_output))
-            sys.exit(1)
-
-        # Need to introduce a delay between creating the partition and the
-        # file system
-        time.sleep(1)
-
-        # Only supports xfs for now
-        if fs == "xfs":
-            filesys_status, filesys_output = \
-                commands.getstatusoutput("/sbin/mkfs.xfs -f -i size=1024 " +
-                                         unparted + "1")
-
-        if filesys_status != 0:
-            print("Error: Failed to create filesystem for disk %s - %s"
-                  % (unparted, filesys_output))
-            sys.exit(1)
-
+        tasks.add(unparted, "partition", partition_drive, unparted)
+        tasks.add(unparted, "mkfs", make_filesystem, unparted, fs)
         blank_drives.append(unparted)
 
     return blank_drives
@@ -639,10 +967,26 @@ def get_full_label(disk_val, disk_label_list, cp_input_list, ip_label):
     return full_label, disk_count
 
 
-def label_volumes(blank_volumes, ip_label, disk_label_list, cp_input_list):
+def label_volume(blank_vol, full_label):
     """
     Label the filesystem of a logical volume
 
+    :raises ProvisionError: if the volume cannot be labelled
+    """
+    vol_label_status, vol_label_output = \
+        commands.getstatusoutput('/usr/sbin/xfs_admin -L "' + full_label +
+                                 '" ' + blank_vol)
+
+    if vol_label_status != 0:
+        raise ProvisionError("Error labelling xfs volume %s - %s"
+                             % (blank_vol, vol_label_output))
+
+
+def label_volumes(blank_volumes, ip_label, disk_label_list, cp_input_list,
+                  tasks):
+    """
+    Label the filesystem of logical volumes (see label_volume)
+
     :param blank_volumes: volumes that have not been labelled yet
     :param disk_label_list: list of devices that are labelled and their swift
                             device number ("v" is with the swift number if the
@@ -652,6 +996,7 @@ def label_volumes(blank_volumes, ip_label, disk_label_list, cp_input_list):
     :param cp_input_list: list of tuples that show the devices selected by the
                           configuration(drive/part/lvm name, swift device
                           name)
+    :param tasks: ProvisionTasks to add the label steps to
     :return disk_label_list: see above
     """
     for blank_vol in blank_volumes:
@@ -675,24 +1020,44 @@ def label_volumes(blank_volumes, ip_label, disk_label_list, cp_input_list):
                                                        disk_label_list,
                                                        cp_input_list, ip_label)
 
-        vol_label_status, vol_label_output = \
-            commands.getstatusoutput('/usr/sbin/xfs_admin -L "' + full_label +
-                                     '" ' + blank_vol)
-
-        if vol_label_status != 0:
-            print("Error labelling xfs volume %s - %s"
-                  % (blank_vol, vol_label_output))
-            sys.exit(1)
-
+        tasks.add(blank_vol, "label", label_volume, blank_vol, full_label)
         disk_label_list.append([str(volume_number), blank_vol])
 
     return disk_label_list
 
 
-def label_drives(blank_drives, ip_label, fs, disk_label_list, cp_input_list):
+def label_drive(blank, full_label):
     """
     Label the partition and filesystem of a drive
 
+    :raises ProvisionError: if the drive cannot be labelled
+    """
+    p_lab_status, p_lab_output = \
+        commands.getstatusoutput('/sbin/parted -s ' + blank +
+                                 ' name 1 "' + full_label + '"')
+
+    if p_lab_status != 0:
+        raise ProvisionError("Error labelling partition %s - %s"
+                             % (blank, p_lab_output))
+
+    time.sleep(1)
+
+    xfs_label_status, xfs_label_output = \
+        commands.getstatusoutput('/usr/sbin/xfs_admin -L "' +
+                                 full_label + '" ' + blank + '1')
+
+    if xfs_label_status != 0:
+        # Revert the partition label back
+        os.system('/sbin/parted -s ' + blank + ' name 1 "primary"')
+        raise ProvisionError("Error labelling xfs partition %s - %s"
+                             % (blank, xfs_label_output))
+
+
+def label_drives(blank_drives, ip_label, fs, disk_label_list, cp_input_list,
+                 tasks):
+    """
+    Label the partition and filesystem of drives (see label_drive)
+
     :param blank_drives: drives that have not been labelled yet
     :param disk_label_list: list of devices that are labelled and their swift
                             device number ("v" is with the swift number if the
@@ -702,6 +1067,7 @@ def label_drives(blank_drives, ip_label, fs, disk_label_list, cp_input_list):
     :param cp_input_list: list of tuples that show the devices selected by the
                           configuration(drive/part/lvm name, swift device
                           name)
+    :param tasks: ProvisionTasks to add the label steps to
     :return disk_label_list: see above
     """
     for blank in blank_drives:
@@ -716,37 +1082,72 @@ def label_drives(blank_drives, ip_label, fs, disk_label_list, cp_input_list):
                                                  disk_label_list,
                                                  cp_input_list, ip_label)
 
-        p_lab_status, p_lab_output = \
-            commands.getstatusoutput('/sbin/parted -s ' + blank +
-                                     ' name 1 "' + full_label + '"')
+        tasks.add(blank, "label", label_drive, blank, full_label)
+        disk_label_list.append([str(disk_number), blank + "1"])
 
-        if p_lab_status != 0:
-            print("Error labelling partition %s - %s"
-                  % (blank, p_lab_output))
-            sys.exit(1)
+    return disk_label_list
 
-        time.sleep(1)
 
-        xfs_label_status, xfs_label_output = \
-            commands.getstatusoutput('/usr/sbin/xfs_admin -L "' +
-                                     full_label + '" ' + blank + '1')
+def split_partition(partition):
+    """
+    Split a partition into its drive and partition number, e.g. /dev/sda10
+    into /dev/sda and 10
+    """
+    drive = partition.rstrip("0123456789")
+    return drive, partition[len(drive):]
 
-        if xfs_label_status != 0:
-            print("Error labelling xfs partition %s - %s"
-                  % (blank, xfs_label_output))
-            # Revert the partition label back
-            os.system('/sbin/parted -s ' + blank + ' name 1 "primary"')
-            sys.exit(1)
 
-        disk_label_list.append([str(disk_number), blank + "1"])
+def label_partition(blank_p, full_label, fs):
+    """
+    Label a partition and its filesystem, creating the filesystem if the
+    partition does not have one
 
-    return disk_label_list
+    :raises ProvisionError: if the partition cannot be labelled
+    """
+    drive, number = split_partition(blank_p)
+    p_lab_status, p_lab_output = \
+        commands.getstatusoutput('/sbin/parted -s ' + drive +
+                                 ' name ' + number + ' "' +
+                                 full_label + '"')
+
+    if p_lab_status != 0:
+        raise ProvisionError("Error labelling partition %s - %s"
+                             % (blank_p, p_lab_output))
+
+    time.sleep(1)
+
+    # Make sure that there is a filesystem to label
+    part_status, part_output = \
+        commands.getstatusoutput('/sbin/parted -s ' + blank_p + ' p')
+
+    # Add the fs to the partition if it isn't there already
+    if fs not in part_output and fs == "xfs":
+
+        create_fs_stat, create_fs_out = \
+            commands.getstatusoutput('/sbin/mkfs.xfs -f -i size=1024 ' +
+                                     blank_p)
+
+        if create_fs_stat != 0:
+            raise ProvisionError("Failed to create filesystem for partition "
+                                 "%s - %s" % (blank_p, create_fs_out))
+
+    fs_label_status, fs_label_output = \
+        commands.getstatusoutput('/usr/sbin/xfs_admin -L "' +
+                                 full_label + '" ' + blank_p)
+
+    if fs_label_status != 0:
+        # Revert the partition label back
+        os.system('/sbin/parted -s ' + drive + ' name ' +
+                  number + ' "primary"')
+        raise ProvisionError("Error labelling xfs partition %s - %s"
+                             % (blank_p, fs_label_output))
 
 
 def label_partitions(blank_partitions, ip_label, fs, disk_label_list,
-                     cp_input_list):
+                     cp_input_list, tasks):
     """
-    Label particular partitions and filesystems in a drive
+    Label particular partitions and filesystems in a drive (see
+    label_partition)
 
     :param blank_partitions: partitions that have not been labelled yet
     :param disk_label_list: list of devices that are labelled and their swift
@@ -757,6 +1158,7 @@ def label_partitions(blank_partitions, ip_label, fs, disk_label_list,
     :param cp_input_list: list of tuples that show the devices selected by the
                           configuration(drive/part/lvm name, swift device
                           name)
+    :param tasks: ProvisionTasks to add the label steps to
     :return disk_label_list: see above
     """
     for blank_p in blank_partitions:
@@ -771,77 +1173,72 @@ def label_partitions(blank_partitions, ip_label, fs, disk_label_list,
                                                  disk_label_list,
                                                  cp_input_list, ip_label)
 
-        p_lab_status, p_lab_output = \
-            commands.getstatusoutput('/sbin/parted -s ' + blank_p[:-1] +
-                                     ' name ' + blank_p[-1] + ' "' +
-                                     full_label + '"')
-
-        if p_lab_status != 0:
-            print("Error labelling partition %s - %s"
-                  % (blank_p, p_lab_output))
-            sys.exit(1)
-
-        time.sleep(1)
-
-        # Make sure that there is a filesystem to label
-        part_status, part_output = \
-            commands.getstatusoutput('/sbin/parted -s ' + blank_p + ' p')
-
-        # Add the fs to the partition if it isn't there already
-        if fs not in part_output and fs == "xfs":
-
-            create_fs_stat, create_fs_out = \
-                commands.getstatusoutput('/sbin/mkfs.xfs -f -i size=1024 ' +
-                                         blank_p)
-
-            if create_fs_stat != 0:
-                print("Error: Failed to create filesystem for partition %s "
-                      "- %s" % (blank_p, create_fs_out))
-                sys.exit(1)
-
-        fs_label_status, fs_label_output = \
-            commands.getstatusoutput('/usr/sbin/xfs_admin -L "' +
-                                     full_label + '" ' + blank_p)
-
-        if fs_label_status != 0:
-            print("Error labelling xfs partition %s - %s"
-                  % (blank_p, fs_label_output))
-            # Revert the partition label back
-            os.system('/sbin/parted -s ' + blank_p[:-1] + ' name ' +
-                      blank_p[-1] + ' "primary"')
-            sys.exit(1)
-
+        # Steps on partitions of the same drive run one after the other
+        tasks.add(split_partition(blank_p)[0], "label %s" % (blank_p),
+                  label_partition, blank_p, full_label, fs)
         disk_label_list.append([str(disk_number), blank_p])
 
     return disk_label_list
 
 
-def mount_by_label(mount_point, mount_label, return_val):
+def mount_by_label(mount_point, mount_label):
     """
     Mount a device by it's label
 
+    Creates the mount point (owned by root:root) if need be. The mount point
+    is owned by swift:swift once the device is mounted.
+
     :param mount_point: directory that device will be mounted to
     :param mount_label: device's label
-    :param return_val: list of device mounting results
+    :raises ProvisionError: if the device cannot be mounted
     """
-    command = "/bin/mount -o noatime,nodiratime,nobarrier,logbufs=8 -L " + \
-              mount_label + " " + mount_point
+    # Create mount dir if it doesn't exist
+    if not os.path.isdir(mount_point):
+        cmp_status, cmp_output = \
+            commands.getstatusoutput("/bin/mkdir " + mount_point)
+
+        if cmp_status != 0:
+            raise ProvisionError("Error creating mount point %s - %s"
+                                 % (mount_point, cmp_output))
+
+    # Check if already mounted
+    if os.path.ismount(mount_point):
+        print("%s is already mounted" % (mount_point))
+    else:
+        # Make sure that the directories are owned by root:root
+        chown_status, chown_out = \
+            commands.getstatusoutput("/bin/chown root:root " + mount_point)
+
+        if chown_status != 0:
+            raise ProvisionError("Error changing ownership of %s - %s"
+                                 % (mount_point, chown_out))
 
-    child = subprocess.Popen(command, shell=True, stderr=subprocess.PIPE)
+        command = "/bin/mount -o noatime,nodiratime,nobarrier,logbufs=8 " \
+                  "-L " + mount_label + " " + mount_point
 
-    (outtext, errtext) = child.communicate()
-    rc = child.returncode
-    if rc != 0:
-        return_val.append(command + ": status: " + str(rc) + " (ERROR) -  " +
-                          errtext + "\n")
-    else:
-        return_val.append(command + ": status: " + str(rc) + " (SUCCESS)\n")
+        child = subprocess.Popen(command, shell=True,
+                                 stderr=subprocess.PIPE)
+
+        (outtext, errtext) = child.communicate()
+        if child.returncode != 0:
+            raise ProvisionError("%s: status: %s (ERROR) - %s"
+                                 % (command, child.returncode,
+                                    errtext.strip()))
 
+    # Double-check the directories are owned by swift:swift
+    chwn_status, chwn_out = \
+        commands.getstatusoutput("/bin/chown swift:swift " + mount_point)
 
-def mount_devices(ip_label, disk_label_list, mount_dir, cp_input_list):
+    if chwn_status != 0:
+        raise ProvisionError("Error changing ownership of %s - %s"
+                             % (mount_point, chwn_out))
+
+
+def mount_devices(ip_label, disk_label_list, mount_dir, cp_input_list, tasks):
     """
-    Function to mount all labelled devices. Returns a list of
-    mounted drives
+    Function to mount all labelled devices (see mount_by_label). The devices
+    are mounted when the tasks are run, after any other steps for the
+    device.
 
     :param ip_label: hex representation of the ip address that is used for the
                      swift device labels
@@ -852,11 +1249,8 @@ def mount_devices(ip_label, disk_label_list, mount_dir, cp_input_list):
     :param cp_input_list: list of tuples that show the devices selected by the
                           configuration(drive/part/lvm name, swift device
                           name)
+    :param tasks: ProvisionTasks to add the mount steps to
     """
-    mounts_to_check = []
-    return_results = []
-    mount_threads = []
-
     if not os.path.isdir(mount_dir):
         cmd_status, cmd_output = \
             commands.getstatusoutput("/bin/mkdir " + mount_dir)
@@ -899,73 +1293,36 @@ def mount_devices(ip_label, disk_label_list, mount_dir, cp_input_list):
             else:
                 mount_point = mount_dir + "disk" + label_no[0]
 
-        # Create mount dir if it doesn't exist
-        if not os.path.isdir(mount_point):
-            cmp_status, cmp_output = \
-                commands.getstatusoutput("/bin/mkdir " + mount_point)
-
-            if cmp_status != 0:
-                print("Error creating mount point %s - %s"
-                      % (mount_point, cmp_output))
-                sys.exit(1)
-
-        # Make sure that the directories are owned by root:root
-        chown_status, chown_out = \
-            commands.getstatusoutput("/bin/chown root:root " + mount_point)
-
-        if chown_status != 0:
-            print("Error changing ownership of %s - %s"
-                  % (mount_point, chown_out))
-            sys.exit(1)
-
         if "v" in label_no[0]:
             mount_label = ip_label + "v" + three_dig_format(label_no[0][1:])
         else:
             mount_label = ip_label + "h" + three_dig_format(label_no[0])
 
-        # Check if already mounted
-        if os.path.ismount(mount_point):
-            print("%s is already mounted" % (mount_point))
-        else:
-            t = threading.Thread(target=mount_by_label, args=(mount_point,
-                                                              mount_label,
-                                                              return_results))
-            t.start()
-            mount_threads.append(t)
-        mounts_to_check.append([mount_label, mount_point])
+        # Partitions are mounted after the steps for their drive
+        tasks.add(task_device(label_no), "mount %s" % (mount_point),
+                  mount_by_label, mount_point, mount_label)
 
-    for mt in mount_threads:
-        mt.join(thread_timeout)
 
-    # TODO - this will soon be logged instead of printed out
-    if return_results:
-        print ("%s" % ("Running: ".join(return_results)))
-
-    # Confirm that the drives are mounted
-    for drives in mounts_to_check:
-        if os.path.isdir(drives[1]):
-
-            # Double-check the directories are owned by swift:swift
-            # NOTE - there is a corner-case where the thread_timeout value
-            # expires and the ownership will not be changed here (the mount
-            # thread may complete at a later time). In this case, it is
-            # necessary that the diags pick up bad ownership asap
-            chwn_status, chwn_out = \
-                commands.getstatusoutput("/bin/chown swift:swift " +
-                                         drives[1])
-
-            if chwn_status != 0:
-                print("Error changing ownership of %s - %s"
-                      % (drives[1], chwn_out))
-                sys.exit(1)
+def task_device(label_no):
+    """
+    The device of the ProvisionTasks task that provisions a labelled device
 
-            print("Mounted to %s with label %s" % (drives[1], drives[0]))
+    :param label_no: entry of the disk_label_list
+    :return: the volume, or the drive of the partition
+    """
+    if "v" in label_no[0]:
+        return label_no[1]
+    return split_partition(label_no[1])[0]
 
 
 def get_product_name():
     '''
     Returns the type of node (product)
     '''
+    product_name = inventory.get_product_name()
+    if product_name:
+        return product_name
+
     prod_stat, prod_out = commands.getstatusoutput("dmidecode -s \
                                                    system-product-name")
 
@@ -998,8 +1355,13 @@ def generate_drive_info(my_ip, mount_dir, disk_label_list):
     for lab in disk_label_list:
 
         # Get the size of the drive
-        size_status, size_output = \
-            commands.getstatusoutput("/sbin/blockdev --getsize64 " + lab[1])
+        device = drive_inventory.find(lab[1])
+        if device is not None:
+            size_status, size_output = 0, device.size_bytes
+        else:
+            size_status, size_output = \
+                commands.getstatusoutput("/sbin/blockdev --getsize64 " +
+                                         lab[1])
 
         if size_status == 0:
             size = ((float(size_output)/1024)/1024)/1024
@@ -1106,6 +1468,10 @@ def main():
                     help="Only mount the drives")
     args.add_option("-c", "--check", dest="check", action="store_true",
                     help="Check config data and hardware match")
+    args.add_option("-j", "--jobs", dest="jobs", type="int",
+                    default=provision_jobs,
+                    help="Number of devices to provision at once"
+                         " (default %d)" % (provision_jobs))
     options, arguments = args.parse_args()
 
     # Get confuration data from /etc/swift/hlm_storage.conf
@@ -1214,6 +1580,12 @@ def main():
 
     all_drives = all_drives.split('\n')
 
+    global drive_inventory
+    drive_inventory = inventory.DriveInventory.load()
+
+    probe_drives([drive for drive in all_drives
+                  if not inventory_device(drive)])
+
     data_conflict = check_data_matches(cp_input_list, all_drives)
 
     if data_conflict:
@@ -1240,6 +1612,8 @@ def main():
         print("Unlabelled partition list = %s" % (str(blank_partitions)))
         print("Unlabelled volume list = %s" % (str(blank_volumes)))
 
+    tasks = ProvisionTasks()
+
     if options.all_actions or options.partition:
         if not unparted_drives:
             print("No drives that need to be partitioned")
@@ -1247,7 +1621,7 @@ def main():
             print("The following drives are not partitioned - %s"
                   % (str(unparted_drives)))
             blank_drives = format_drives(blank_drives, unparted_drives,
-                                         fs, cp_input_list)
+                                         fs, cp_input_list, tasks)
 
     if options.all_actions or options.label:
         if not blank_drives:
@@ -1255,32 +1629,52 @@ def main():
         else:
             print("Label the following drives - %s" % (str(blank_drives)))
             disk_label_list = label_drives(blank_drives, ip_label, fs,
-                                           disk_label_list, cp_input_list)
+                                           disk_label_list, cp_input_list,
+                                           tasks)
         if not blank_partitions:
             print("No multiple partition drives that need to be labelled")
         else:
             print("Label the following partitions - %s"
                   % (str(blank_partitions)))
             disk_label_list = label_partitions(blank_partitions, ip_label, fs,
-                                               disk_label_list, cp_input_list)
+                                               disk_label_list, cp_input_list,
+                                               tasks)
         if not blank_volumes:
             print("No volumes that need to be labelled")
         else:
             print("Label the following volumes - %s"
                   % (str(blank_volumes)))
             disk_label_list = label_volumes(blank_volumes, ip_label,
-                                            disk_label_list, cp_input_list)
+                                            disk_label_list, cp_input_list,
+                                            tasks)
 
     if options.all_actions or options.mount:
         if not disk_label_list:
             print("No drives ready to be mounted")
         else:
-            mount_devices(ip_label, disk_label_list, mount_dir, cp_input_list)
+            mount_devices(ip_label, disk_label_list, mount_dir, cp_input_list,
+                          tasks)
+
+    # Provision the devices
+    failed = set()
+    if tasks:
+        results = tasks.run(options.jobs)
+        print_summary(results)
+        failed = set(result["device"] for result in results
+                     if result["status"] != "ok")
+
+    # The fact file records the devices that were provisioned even if others
+    # failed
+    disk_label_list = [label_no for label_no in disk_label_list
+                       if task_device(label_no) not in failed]
 
     node_drive_info = generate_drive_info(my_ip, mount_dir, disk_label_list)
 
     write_to_info_file(node_drive_info, fact_file)
 
+    if failed:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+from collections import OrderedDict
+import glob
+import importlib
+import os
+
+import swiftlm
+
+# Importing pkg_resources scans every installed distribution and loading an
+# entry point imports its module, which together dominate the start up time
+# of swiftlm-scan. Instead the entry points are read from the entry_points.txt
+# index that setuptools writes into the swiftlm metadata directory when it is
+# installed, and a plugin module is only imported when the plugin is loaded.
+
+PLUGIN_GROUP = 'swiftlm.plugins'
+
+METADATA_PATTERNS = (
+    'swiftlm.egg-info',
+    'swiftlm-*.egg-info',
+    'swiftlm-*.dist-info',
+    'EGG-INFO',
+)
+
+
+class PluginEntryPoint(object):
+    """An entry point that imports its module when it is loaded."""
+    def __init__(self, name, module_name, attrs=()):
+        self.name = name
+        self.module_name = module_name
+        self.attrs = tuple(attrs)
+
+    @classmethod
+    def parse(cls, name, target):
+        """
+        :param target: entry point target e.g. 'swiftlm.systems.ntp:main'
+        """
+        # Drop any extras e.g. 'module:attr [extra]'
+        target = target.split('[', 1)[0].strip()
+        module_name, _, attrs = target.partition(':')
+        attrs = [a for a in attrs.strip().split('.') if a]
+        return cls(name, module_name.strip(), attrs)
+
+    def load(self):
+        obj = importlib.import_module(self.module_name)
+        for attr in self.attrs:
+            obj = getattr(obj, attr)
+        return obj
+
+    def __repr__(self):
+        return '%s = %s:%s' % (self.name, self.module_name,
+                               '.'.join(self.attrs))
+
+
+def find_entry_points_file(package_dir=None):
+    """
+    Find the entry_points.txt installed alongside the swiftlm package.
+
+    :returns: path to entry_points.txt or None if there is no single
+              candidate
+    """
+    if package_dir is None:
+        package_dir = os.path.dirname(os.path.abspath(swiftlm.__file__))
+    parent = os.path.dirname(package_dir)
+
+    candidates = []
+    for pattern in METADATA_PATTERNS:
+        for metadata_dir in glob.glob(os.path.join(parent, pattern)):
+            path = os.path.join(metadata_dir, 'entry_points.txt')
+            if os.path.isfile(path):
+                candidates.append(path)
+
+    # Several installed versions are ambiguous, let pkg_resources decide.
+    if len(candidates) == 1:
+        return candidates[0]
+    return None
+
+
+def read_entry_points(path, group=PLUGIN_GROUP):
+    """
+    :returns: OrderedDict of entry point name to PluginEntryPoint
+    """
+    parser = configparser.RawConfigParser()
+    # Entry point names are case sensitive
+    parser.optionxform = str
+    parser.read(path)
+
+    entry_points = OrderedDict()
+    if parser.has_section(group):
+        for name, target in parser.items(group):
+            entry_points[name] = PluginEntryPoint.parse(name, target)
+    return entry_points
+
+
+def get_entry_map(group=PLUGIN_GROUP, package_dir=None):
+    """
+    Get the swiftlm entry points of a group without importing them.
+
+    Falls back to pkg_resources when the installed metadata cannot be found.
+
+    :returns: dict of entry point name to an object with a load() method
+    """
+    path = find_entry_points_file(package_dir)
+    if path is not None:
+        return read_entry_points(path, group)
+
+    import pkg_resources
+    entry_map = pkg_resources.get_entry_map('swiftlm', group)
+    return OrderedDict(sorted(entry_map.items()))
@@ -19,12 +19,13 @@
 from __future__ import print_function
 
 import argparse
-import pkg_resources
 import json
 import sys
+import threading
+import time
 import traceback
-import yaml
 
+from swiftlm.cli import plugin_index
 from swiftlm.utils.metricdata import MetricData
 from swiftlm.utils.values import Severity
 
@@ -41,6 +42,8 @@ def display_json(metrics, pretty):
 
 
 def display_yaml(metrics, pretty):
+    # yaml is only imported when it is used to keep start up fast.
+    import yaml
     yaml.add_representer(Severity, Severity.yaml_repr, yaml.SafeDumper)
     kwargs = {}
     if pretty:
@@ -55,8 +58,40 @@ FORMATS = {
 }
 
 
+class PluginHelpAction(argparse.Action):
+    """
+    Print help, loading every plugin to get its help text.
+
+    Plugins are only loaded when help is requested so that a normal scan
+    imports the selected plugins only.
+    """
+    def __init__(self, option_strings, plugin_actions, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        super(PluginHelpAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default,
+            nargs=0, help=help)
+        self.plugin_actions = plugin_actions
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        for action, unloaded_func in self.plugin_actions:
+            try:
+                action.help = unloaded_func.load().__doc__
+            except Exception:   # noqa
+                action.help = None
+            action.help = action.help or 'Reserved for future use.'
+        parser.print_help()
+        parser.exit()
+
+
 def construct_parser(plugins):
-    parser = argparse.ArgumentParser(description='XXX')
+    parser = argparse.ArgumentParser(description='XXX', add_help=False)
+    plugin_actions = []
+    parser.add_argument(
+        '-h', '--help',
+        action=PluginHelpAction,
+        plugin_actions=plugin_actions,
+        help='show this help message and exit'
+    )
 
     # Create a flag for each plugin that adds the matching function to the
     # selected list if it appears on the command line.
@@ -65,16 +100,13 @@ def construct_parser(plugins):
         'Select one or more of the available checks to run as a subset.'
     )
     for name, unloaded_func in plugins.items():
-        func = unloaded_func.load()
-        help_string = func.__doc__ or 'Reserved for future use.'
-
-        selection_group.add_argument(
+        action = selection_group.add_argument(
             '--' + name,
             dest='selected',
             action='append_const',
-            const=func,
-            help=help_string
+            const=name
         )
+        plugin_actions.append((action, unloaded_func))
 
     parser.add_argument(
         '--format',
@@ -91,46 +123,212 @@ def construct_parser(plugins):
         '-v', '--verbose',
         action='count'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of checks to run concurrently (default: %(default)s).'
+    )
+    parser.add_argument(
+        '-t', '--timeout',
+        type=float,
+        default=None,
+        help='Seconds each check may run before it is reported as failed '
+             '(default: no limit, or the [daemon] timeout of '
+             'swiftlm-scan.conf with --daemon).'
+    )
+    parser.add_argument(
+        '--by-check',
+        action='store_true',
+        help='Report a mapping of each check name to its metrics rather '
+             'than a single list of metrics.'
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Run the selected checks on a schedule and serve their latest '
+             'results over a unix socket.'
+    )
 
     return parser
 
 
-def parse_args():
-    ps = pkg_resources.get_entry_map('swiftlm', 'swiftlm.plugins')
+def parse_args(argv=None):
+    ps = plugin_index.get_entry_map()
     p = construct_parser(ps)
-    args = p.parse_args()
+    args = p.parse_args(argv)
 
     # we make the common case easy, No selected flags indicate that we should
-    # run all diagnostics.
+    # run all diagnostics, except those that only run when selected (they
+    # still run on the schedule of the daemon).
     if args.selected is None:
-        args.selected = [f.load() for f in ps.values()]
+        args.selected = [PluginTask(name, ps[name].load())
+                         for name in ps.keys()]
+        if not args.daemon:
+            args.selected = [task for task in args.selected
+                             if not task.explicit]
+    else:
+        args.selected = [PluginTask(name, ps[name].load())
+                         for name in args.selected]
 
     return args
 
 
+def check_failure(func, error):
+    return MetricData.single('check.failure',
+                             Severity.fail,
+                             '{check} failed with: {error}',
+                             {'check': str(func),
+                              'error': error.replace('\n', ' '),
+                              'component': 'swiftlm-scan',
+                              'service': 'object-storage'})
+
+
+def run_plugin(func):
+    """
+    Run a single plugin and convert its results to metric dicts.
+
+    Any exception raised by the plugin is reported as a check.failure metric.
+
+    :param func: the loaded plugin entry point
+    :returns: list of metric dicts
+    """
+    metrics = []
+    try:
+        r = func()
+        if isinstance(r, list) and r and isinstance(r[0], MetricData):
+            metrics.extend([result.metric() for result in r])
+        elif isinstance(r, MetricData):
+            metrics.append(r.metric())
+    except:   # noqa
+        t, v, tb = sys.exc_info()
+        backtrace = ' '.join(traceback.format_exception(t, v, tb))
+        metrics.append(check_failure(func, backtrace).metric())
+
+    return metrics
+
+
+class PluginTask(object):
+    """
+    A selected plugin and the metrics it produced.
+
+    A plugin may declare that it must run after other plugins by setting a
+    ``depends`` attribute listing their entry point names on its main
+    function. Dependencies that are not selected for this scan are ignored.
+
+    A plugin whose main function has a true ``explicit`` attribute is left
+    out of a scan that does not select any plugins, except by the daemon.
+    """
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.depends = frozenset(getattr(func, 'depends', ()))
+        self.explicit = bool(getattr(func, 'explicit', False))
+        self.metrics = None
+        self.started = None
+        self.finished = False
+        self.timed_out = False
+
+    def run(self, cond):
+        metrics = run_plugin(self.func)
+        with cond:
+            if not self.timed_out:
+                self.metrics = metrics
+            self.finished = True
+            cond.notify()
+
+    def time_out(self, timeout):
+        self.timed_out = True
+        self.metrics = [check_failure(
+            self.func, 'timed out after %ss' % timeout).metric()]
+
+    def start(self, cond):
+        t = threading.Thread(target=self.run, args=(cond,))
+        # A plugin that times out is abandoned, it must not keep the scan
+        # from exiting.
+        t.daemon = True
+        self.started = time.time()
+        t.start()
+
+
+def run_serial(tasks):
+    for task in tasks:
+        task.metrics = run_plugin(task.func)
+        task.finished = True
+
+
+def run_parallel(tasks, jobs, timeout=None):
+    """
+    Run plugins concurrently.
+
+    At most ``jobs`` plugins run at once. A plugin is not started until the
+    plugins it depends on have finished or timed out. A plugin that runs for
+    longer than ``timeout`` seconds is abandoned and reported as a
+    check.failure; it no longer counts towards the ``jobs`` limit.
+
+    :param tasks: list of PluginTask
+    :param jobs: maximum number of plugins to run at once
+    :param timeout: seconds allowed per plugin, None to wait indefinitely
+    """
+    cond = threading.Condition()
+    names = frozenset(t.name for t in tasks)
+    done = set()
+    pending = list(tasks)
+    running = []
+
+    with cond:
+        while pending or running:
+            ready = [t for t in pending if (t.depends & names) <= done]
+            if not ready and not running:
+                # Circular dependencies, break the cycle in selection order.
+                ready = pending[:1]
+            for task in ready[:max(jobs, 1) - len(running)]:
+                pending.remove(task)
+                running.append(task)
+                task.start(cond)
+
+            now = time.time()
+            wait = None
+            for task in list(running):
+                if task.finished:
+                    running.remove(task)
+                    done.add(task.name)
+                elif timeout is not None:
+                    remaining = task.started + timeout - now
+                    if remaining <= 0:
+                        task.time_out(timeout)
+                        running.remove(task)
+                        done.add(task.name)
+                    elif wait is None or remaining < wait:
+                        wait = remaining
+
+            if running and not any(t.finished for t in running):
+                cond.wait(wait)
+
+
 def main():
     args = parse_args()
-    metrics = []
 
-    for func in args.selected:
-        try:
-            r = func()
-            if isinstance(r, list) and r and isinstance(r[0], MetricData):
-                metrics.extend([result.metric() for result in r])
-            elif isinstance(r, MetricData):
-                metrics.append(r.metric())
-        except:   # noqa
-            t, v, tb = sys.exc_info()
-            backtrace = ' '.join(traceback.format_exception(t, v, tb))
-            r = MetricData.single('check.failure',
-                                  Severity.fail,
-                                  '{check} failed with: {error}',
-                                  {'check': str(func),
-                                   'error': backtrace.replace('\n', ' '),
-                                   'component': 'swiftlm-scan',
-                                   'service': 'object-storage'})
-            metrics.append(r.metric())
-            pass
+    if args.daemon:
+        # Imported here since scan_daemon depends on this module.
+        from swiftlm.cli.scan_daemon import run_daemon
+        run_daemon(dict((t.name, t.func) for t in args.selected),
+                   args.jobs, args.timeout)
+        return
+
+    if args.jobs > 1 or args.timeout is not None:
+        run_parallel(args.selected, args.jobs, args.timeout)
+    else:
+        run_serial(args.selected)
+
+    if args.by_check:
+        metrics = dict((task.name, task.metrics) for task in args.selected)
+    else:
+        # Results are reported in selection order regardless of the order in
+        # which the plugins completed.
+        metrics = []
+        for task in args.selected:
+            metrics.extend(task.metrics)
 
     FORMATS[args.format](metrics, args.pretty)
 
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+import errno
+import grp
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+from swiftlm.cli.runner import PluginTask, check_failure
+from swiftlm.utils.utility import get_logger, swiftlm_scan_conf
+
+# swiftlm-scan --daemon runs each plugin on its own schedule and serves the
+# latest metrics of every plugin over a unix socket. A client sends a single
+# line containing a comma separated list of plugin names (an empty line
+# selects all plugins) and receives a json encoded dict mapping each plugin
+# name to its list of metric dicts. Plugins that have not completed a run yet
+# are left out of the reply. The metrics of a plugin that have not been
+# updated for STALE_INTERVALS times its interval (because it is hung, or the
+# scheduler has died) are replaced with a "stale" check.failure.
+
+DEFAULT_SOCKET_PATH = '/var/run/swiftlm/swiftlm-scan.sock'
+DEFAULT_SOCKET_MODE = '0660'
+DEFAULT_INTERVAL = 60
+# Seconds a plugin may run before it is reported as timed out, may be
+# overridden by the timeout option of the [daemon] section
+DEFAULT_TIMEOUT = 120
+STALE_INTERVALS = 2
+
+# Seconds between runs of each plugin, may be overridden in the
+# [daemon-intervals] section of swiftlm-scan.conf
+DEFAULT_INTERVALS = {
+    'hpssacli': 600,
+    'drive-audit': 300,
+    'file-ownership': 300,
+    'file-ownership-deep': 600,
+    'replication': 120,
+    'swift-services': 30,
+}
+
+
+def load_daemon_config(conf_file=swiftlm_scan_conf):
+    """
+    Read the daemon options from swiftlm-scan.conf.
+
+    :returns: tuple of (options dict, intervals dict)
+    """
+    parser = configparser.RawConfigParser()
+    parser.read(conf_file)
+
+    options = {'socket_path': DEFAULT_SOCKET_PATH,
+               'socket_mode': DEFAULT_SOCKET_MODE,
+               'socket_group': None,
+               'timeout': DEFAULT_TIMEOUT}
+    logging_conf = {}
+    if parser.has_section('daemon'):
+        options.update(parser.items('daemon'))
+    options['timeout'] = float(options['timeout'])
+    if parser.has_section('logging'):
+        logging_conf = dict(parser.items('logging'))
+    options['logging'] = logging_conf
+
+    intervals = dict(DEFAULT_INTERVALS)
+    if parser.has_section('daemon-intervals'):
+        for name, value in parser.items('daemon-intervals'):
+            intervals[name] = float(value)
+
+    return options, intervals
+
+
+class ScanCache(object):
+    """
+    The latest metrics produced by each plugin, with the time they were
+    produced and the number of seconds they remain current (their ttl).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def update(self, name, metrics, ttl=None, now=None):
+        """
+        :param ttl: seconds before the metrics are stale, None for never
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._results[name] = (metrics, now, ttl)
+
+    def _current(self, name, now):
+        metrics, updated, ttl = self._results[name]
+        if ttl is not None and now - updated > ttl:
+            return [check_failure(
+                name, 'stale, last updated %ds ago' % (now - updated)
+            ).metric()]
+        return metrics
+
+    def get(self, names=None, now=None):
+        """
+        :param names: plugin names to return, None for all plugins
+        :returns: dict of plugin name to list of metric dicts
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if names is None:
+                names = list(self._results)
+            return dict((n, self._current(n, now)) for n in names
+                        if n in self._results)
+
+
+class ScanScheduler(object):
+    """
+    Runs each plugin every ``intervals[name]`` seconds and stores its metrics
+    in a ScanCache.
+
+    At most ``jobs`` plugins run at once and a plugin does not start while a
+    plugin it depends on is running. A plugin that runs for longer than
+    ``timeout`` seconds is abandoned and its metrics replaced with a
+    check.failure. It is not started again until the abandoned run has
+    returned, so a hung plugin does not pile up threads.
+
+    The metrics of each plugin go stale STALE_INTERVALS times its interval
+    after they were stored.
+    """
+    def __init__(self, plugins, cache, intervals=None, jobs=1, timeout=None,
+                 logger=None):
+        """
+        :param plugins: dict of plugin name to loaded entry point
+        :param cache: ScanCache to receive results
+        :param intervals: dict of plugin name to seconds between runs
+        """
+        self.plugins = plugins
+        self.cache = cache
+        intervals = intervals or {}
+        self.intervals = dict((name, float(intervals.get(name,
+                                                         DEFAULT_INTERVAL)))
+                              for name in plugins)
+        self.jobs = max(jobs, 1)
+        self.timeout = timeout
+        self.logger = logger
+        self.next_run = dict((name, 0) for name in plugins)
+        self.running = {}
+        # Timed out tasks whose thread has not returned yet
+        self.abandoned = {}
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def _ttl(self, name):
+        return self.intervals[name] * STALE_INTERVALS
+
+    def _collect(self, now):
+        for name, task in list(self.abandoned.items()):
+            if task.finished:
+                del self.abandoned[name]
+        for name, task in list(self.running.items()):
+            if not task.finished:
+                if (self.timeout is None or
+                        now - task.started < self.timeout):
+                    continue
+                task.time_out(self.timeout)
+                self.abandoned[name] = task
+                if self.logger:
+                    self.logger.warning('%s timed out after %ss'
+                                        % (name, self.timeout))
+            self.cache.update(name, task.metrics, self._ttl(name))
+            del self.running[name]
+
+    def _start_due(self, now):
+        for name in sorted(self.next_run, key=self.next_run.get):
+            if len(self.running) >= self.jobs:
+                break
+            if name in self.running or self.next_run[name] > now:
+                continue
+            if name in self.abandoned:
+                # Still hung, report it again rather than start another run
+                self.cache.update(name, [check_failure(
+                    name, 'timed out run still running after %ds'
+                    % (time.time() - self.abandoned[name].started)
+                ).metric()], self._ttl(name))
+                self.next_run[name] = now + self.intervals[name]
+                continue
+            task = PluginTask(name, self.plugins[name])
+            if task.depends & set(self.running):
+                continue
+            task.start(self.cond)
+            self.running[name] = task
+            self.next_run[name] = now + self.intervals[name]
+
+    def step(self, now=None):
+        """
+        Collect finished plugins and start any that are due.
+
+        Must be called with self.cond held.
+
+        :returns: seconds until the next plugin is due or times out
+        """
+        if now is None:
+            now = time.time()
+        self._collect(now)
+        self._start_due(now)
+
+        wakeups = [t for n, t in self.next_run.items()
+                   if n not in self.running]
+        if self.timeout is not None:
+            wakeups.extend(t.started + self.timeout
+                           for t in self.running.values())
+        if not wakeups:
+            return None
+        return max(min(wakeups) - now, 0)
+
+    def run_forever(self):
+        with self.cond:
+            while not self.stopped:
+                wait = self.step()
+                if any(t.finished for t in self.running.values()):
+                    continue
+                # Don't spin when the only due plugins are blocked by the
+                # job limit or their dependencies, and wake up regularly so
+                # that signals are handled.
+                if wait is None:
+                    wait = 1.0
+                self.cond.wait(min(max(wait, 0.1), 1.0))
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+
+class ScanRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8').strip()
+        names = [n.strip() for n in line.split(',') if n.strip()] or None
+        reply = json.dumps(self.server.cache.get(names))
+        self.wfile.write(reply.encode('utf-8'))
+
+
+class ScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, cache, socket_mode=0o660,
+                 socket_group=None):
+        """
+        :param socket_group: name of the group to give the socket, so that
+                             a client that is not root may connect to it
+        """
+        self.cache = cache
+        self.socket_path = socket_path
+        try:
+            # Remove the socket left behind by a previous daemon.
+            os.unlink(socket_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               ScanRequestHandler)
+        os.chmod(socket_path, socket_mode)
+        if socket_group:
+            os.chown(socket_path, -1, grp.getgrnam(socket_group).gr_gid)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def query(socket_path, names=None, timeout=5.0):
+    """
+    Fetch the latest metrics from a running daemon.
+
+    :param names: plugin names to fetch, None for all plugins
+    :returns: dict of plugin name to list of metric dicts
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(socket_path)
+        s.sendall((','.join(names or []) + '\n').encode('utf-8'))
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        s.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def run_daemon(plugins, jobs=1, timeout=None, conf_file=swiftlm_scan_conf):
+    """
+    Serve plugin results until terminated.
+
+    :param plugins: dict of plugin name to loaded entry point
+    :param timeout: seconds each plugin may run, None for the timeout of
+                    swiftlm-scan.conf (DEFAULT_TIMEOUT unless set)
+    """
+    options, intervals = load_daemon_config(conf_file)
+    logger = get_logger(options['logging'], name='swiftlm-scan')
+    if timeout is None:
+        timeout = options['timeout']
+
+    socket_dir = os.path.dirname(options['socket_path'])
+    if socket_dir and not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir)
+
+    cache = ScanCache()
+    scheduler = ScanScheduler(plugins, cache, intervals, jobs, timeout,
+                              logger)
+    try:
+        server = ScanServer(options['socket_path'], cache,
+                            int(options['socket_mode'], 8),
+                            options['socket_group'])
+    except KeyError:
+        logger.error('Unknown socket_group %s' % options['socket_group'])
+        raise
+
+    def terminate(*args):
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    logger.info('Serving %s on %s'
+                % (', '.join(sorted(plugins)), options['socket_path']))
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        logger.info('Stopped')
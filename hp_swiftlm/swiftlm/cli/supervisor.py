@@ -16,6 +16,8 @@
 # under the License.
 #
 
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 from optparse import OptionParser
 import sys
@@ -34,18 +36,20 @@ DEFAULT_HOSTS = 'hosts.hf'
 DEFAULT_SWIFT_RING_BUILDER_CONSUMES = 'swift_ring_builder_consumes.yml'
 DEFAULT_RING_DELTA = os.path.join('deploy_dir', 'ring-delta.yml')
 DEFAULT_OSCONFIG = 'drive_configurations'
+DEFAULT_JOBS = 4
 
 usage = '''
 
     % {cmd} [--make-delta [--weight-step <value> ] [--stop-on-warnings]]
-            [--rebalance [--dry-run]]
+            [--rebalance [--dry-run] [--batch [--jobs <count>]]]
             [--report [--detail=summary|full]]
             [--etc <dirname>]
-            [--input-vars <filename> --hosts <hosts-file>
+            [--input-vars <filename>
+             --hosts <hosts-file> | --host-ips <host-ips-file>
             [--swift-ring-builder-consumes <swift-ring-builder-consumes-file>]
             [--osconfig <dirname>]
             [--builder_dir <dirname>]
-            [--ring-delta <filename> [--format yaml|json]
+            [--ring-delta <filename> [--format yaml|json|compact]
             [--storage-policies --region-name <region-name>]
             [--help]
 
@@ -105,6 +109,13 @@ Examples:
 
     % {cmd} --make-delta --rebalance --weight-step 4.0
 
+    Add --batch to apply all the device changes of a ring with one
+    swift-ring-builder command for each of add, set_weight and remove
+    (rather than one command per device), and to update several rings
+    at the same time:
+
+    % {cmd} --make-delta --rebalance --batch --jobs 4
+
     Example 6:
 
     Print storage policy information (useful in ansible playbooks)
@@ -146,6 +157,9 @@ def main():
                            ' be assigned to drives.')
     parser.add_option('--hosts', dest='hosts', default=None,
                       help='Hosts file (/etc/hosts or ./net/hosts.hf)')
+    parser.add_option('--host-ips', dest='host_ips', default=None,
+                      help='YAML file mapping each network host name to'
+                           ' its IP address. Used instead of --hosts.')
     parser.add_option('--swift-ring-builder-consumes',
                       dest='swift_ring_builder_consumes',
                       default=None,
@@ -155,9 +169,10 @@ def main():
                            ' A value of "-" (on output means to write'
                            ' to stdout')
     parser.add_option('--format', dest='fmt', default='yaml',
-                      help='One of yaml or json.'
+                      help='One of yaml, json or compact.'
                            ' When used with --ring-delta, specifies the'
-                           ' format of the file.')
+                           ' format of the file. The compact format is'
+                           ' fastest for large deltas.')
     parser.add_option('--detail', dest='detail', default='summary',
                       help='Level of detail to use with --report.'
                            ' Use summary or full')
@@ -168,6 +183,14 @@ def main():
     parser.add_option('--dry-run', dest='dry_run', default=False,
                       action="store_true",
                       help='Show the proposed swift-ring-builder commands')
+    parser.add_option('--batch', dest='batch', default=False,
+                      action="store_true",
+                      help='Used with --rebalance. Change all devices of a'
+                           ' ring with one command per action and update'
+                           ' rings in parallel')
+    parser.add_option('--jobs', dest='jobs', default=DEFAULT_JOBS, type='int',
+                      help='Used with --batch. Number of rings to update at'
+                           ' the same time. Default is %d' % DEFAULT_JOBS)
     parser.add_option('--make-delta', dest='make_delta', default=False,
                       action="store_true",
                       help='Make a ring delta file')
@@ -248,7 +271,7 @@ def main():
         if not options.builder_dir:
             print('Need --builder-dir option')
             sys.exit(1)
-        if options.fmt not in ['yaml', 'json']:
+        if options.fmt not in ['yaml', 'json', 'compact']:
             print('Invalid value for --format')
 
     if options.report:
@@ -272,7 +295,7 @@ def main():
         if not options.ring_delta:
             print('Need --ring-delta file as input')
             sys.exit(1)
-        if options.fmt not in ['yaml', 'json']:
+        if options.fmt not in ['yaml', 'json', 'compact']:
             print('Invalid value for --format')
 
     if len(actions) == 0:
@@ -296,13 +319,26 @@ def main():
         delta = RingDelta()
 
     if 'input-from-model' in actions:
+        hosts_fd = None
+        host_ips = None
         try:
             input_model_fd = open(options.input_vars, 'r')
-            hosts_fd = open(options.hosts, 'r')
+            if options.host_ips:
+                with open(options.host_ips, 'r') as host_ips_fd:
+                    host_ips = safe_load(host_ips_fd)
+            else:
+                hosts_fd = open(options.hosts, 'r')
             consumes_fd = open(options.swift_ring_builder_consumes, 'r')
         except IOError as err:
             print('ERROR: %s' % err)
             sys.exit(1)
+        except scanner.ScannerError as err:
+            print('ERROR in %s: %s' % (options.host_ips, err))
+            sys.exit(err)
+        if options.host_ips and not isinstance(host_ips, dict):
+            print('ERROR in %s: expected a mapping of host name to IP'
+                  ' address' % options.host_ips)
+            sys.exit(1)
         try:
             input_vars = safe_load(input_model_fd)
             consumes_model = safe_load(consumes_fd)
@@ -311,7 +347,8 @@ def main():
             sys.exit(err)
         try:
             input_model = InputModel(config=input_vars, hosts_fd=hosts_fd,
-                                     consumes=consumes_model)
+                                     consumes=consumes_model,
+                                     host_ips=host_ips)
             ring_model = RingSpecifications(model=input_vars)
         except SwiftModelException as err:
             sys.exit(err)
@@ -368,7 +405,8 @@ def main():
         print(delta.get_report(options.detail))
 
     if 'rebalance' in actions:
-        rebalance(delta, rings, options.dry_run)
+        rebalance(delta, rings, options.dry_run, options.batch,
+                  options.jobs)
 
 
 def osconfig_load(osconfig_dir):
@@ -406,6 +444,8 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
     model_errors = []
     model_warnings = []
 
+    model_devices = []
+
     # Run through the input model and find ring specifications
     for ksregion in ring_model.keystone_ring_specifications:
         region_name = ksregion.region_name
@@ -423,6 +463,7 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
         device_regions = set()
         ringspec_regions = set()
         for device_info in input_model.iter_devices():
+            model_devices.append(device_info)
             device_regions.add(device_info.region_name)
         for ksregion in ring_model.keystone_ring_specifications:
             region_name = ksregion.region_name
@@ -444,6 +485,16 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
     except SwiftModelException as err:
         model_errors.append(err)
 
+    # Index the devices by identity so that matching devices in the input
+    # model against the builder files (and vice versa) is a lookup rather
+    # than a scan of all devices.
+    model_device_ids = set(device_info.identity()
+                           for device_info in model_devices)
+    ring_devices = {}
+    for in_ring_device_info in rings.flat_device_list:
+        ring_devices.setdefault(in_ring_device_info.identity(),
+                                in_ring_device_info)
+
     # Run through the builder files and match them against the model
     for region_name, ring_name in rings.builder_rings.keys():
         if delta.delta_rings.get((region_name, ring_name)):
@@ -465,7 +516,7 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
 
     # Run through all devices in the input model
     try:
-        for device_info in input_model.iter_devices():
+        for device_info in model_devices:
 
             # Update the device info with the region and zone id from the
             # ring specifications.
@@ -501,11 +552,8 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
             device_info.zone_id = zone_id
 
             # See if the device is in a builder file of an existing ring
-            found = False
-            for in_ring_device_info in rings.flat_device_list:
-                if device_info.is_same_device(in_ring_device_info):
-                    found = True
-                    break
+            in_ring_device_info = ring_devices.get(device_info.identity())
+            found = in_ring_device_info is not None
 
             for ip_address in input_model.aliases(device_info.server_ip):
                 hw_size, hw_fulldrive = drive_configurations.get_hw(
@@ -586,12 +634,7 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
 
     # Run through all devices in builder files
     for in_ring_device_info in rings.flat_device_list:
-        found = False
-        for device_info in input_model.iter_devices():
-            if device_info.is_same_device(in_ring_device_info):
-                found = True
-                break
-        if not found:
+        if in_ring_device_info.identity() not in model_device_ids:
             in_ring_device_info.presence = 'remove'
             delta.append_device(in_ring_device_info)
 
@@ -612,7 +655,7 @@ def generate_delta(input_model, ring_model, rings, drive_configurations,
                                   ' We recommend you correct the errors.')
 
 
-def rebalance(delta, rings, dry_run):
+def rebalance(delta, rings, dry_run, batch=False, jobs=DEFAULT_JOBS):
 
     for region_name, ring_name in delta.delta_rings.keys():
         if not os.path.isdir(rings.builder_dir):
@@ -622,6 +665,9 @@ def rebalance(delta, rings, dry_run):
                                           region_name)):
             os.mkdir(os.path.join(rings.builder_dir, 'region-%s' %
                                   region_name))
+    if batch:
+        return rebalance_batch(delta, rings, dry_run, jobs)
+
     cmds = []
     for region_name, ring_name in delta.delta_rings.keys():
         if 'add' in delta.delta_ring_actions.get((region_name, ring_name)):
@@ -659,5 +705,107 @@ def rebalance(delta, rings, dry_run):
                 print('NOTE: %s' % output)
     return cmds
 
+
+def rebalance_batch(delta, rings, dry_run, jobs=DEFAULT_JOBS):
+    """
+    Same as rebalance() except that the devices of a ring are changed with
+    one command per action and rings are updated in parallel
+    """
+    ring_cmds = batch_cmds(delta, rings)
+    cmds = [cmd for region_ring_cmds in ring_cmds.values()
+            for cmd in region_ring_cmds]
+    if dry_run:
+        for cmd in cmds:
+            print('DRY-RUN: %s' % cmd)
+    else:
+        run_batch_cmds(ring_cmds, rings, jobs)
+    return cmds
+
+
+def batch_cmds(delta, rings):
+    """
+    Get the commands to update each ring
+
+    Each ring is created or has its replica count changed, then all devices
+    are added, have their weight set and are removed with a single command
+    per action, and finally the ring is rebalanced.
+
+    :returns: OrderedDict of (region_name, ring_name) to a list of commands.
+              Commands of different rings are independent of each other.
+    """
+    ring_cmds = OrderedDict()
+    for region_name, ring_name in sorted(delta.delta_rings.keys()):
+        actions = delta.delta_ring_actions.get((region_name, ring_name))
+        ringspec = delta.delta_rings.get((region_name, ring_name))
+        cmds = ring_cmds.setdefault((region_name, ring_name), [])
+        if 'add' in actions:
+            cmds.append(rings.command_ring_create(region_name, ringspec))
+        if 'set-replica-count' in actions:
+            cmds.append(rings.command_set_replica_count(region_name,
+                                                        ringspec))
+
+    ring_devices = OrderedDict()
+    for device_info in delta.delta_devices:
+        key = (device_info.region_name, device_info.ring_name)
+        ring_devices.setdefault(key, {}).setdefault(
+            device_info.presence, []).append(device_info)
+    for (region_name, ring_name), devices in ring_devices.items():
+        cmds = ring_cmds.setdefault((region_name, ring_name), [])
+        if devices.get('add'):
+            cmds.append(rings.command_devices_add(region_name, ring_name,
+                                                  devices['add']))
+        if devices.get('set-weight'):
+            cmds.append(rings.command_devices_set_weight(
+                region_name, ring_name, devices['set-weight']))
+        if devices.get('remove'):
+            cmds.append(rings.command_devices_remove(region_name, ring_name,
+                                                     devices['remove']))
+
+    for region_name, ring_name in ring_cmds.keys():
+        ringspec = delta.delta_rings.get((region_name, ring_name))
+        if ringspec:
+            ring_cmds[(region_name, ring_name)].append(
+                rings.command_rebalance(region_name, ringspec))
+    return ring_cmds
+
+
+def run_batch_cmds(ring_cmds, rings, jobs=DEFAULT_JOBS):
+    """
+    Run the commands of each ring, with up to jobs rings at the same time
+
+    The commands of a ring are run in order and stop at the first error.
+    The output is printed ring by ring once all rings are done.
+    """
+    def run_ring_cmds(cmds):
+        results = []
+        for cmd in cmds:
+            status, output = rings.run_cmd(cmd)
+            results.append((cmd, status, output))
+            if status > 0:
+                break
+        return results
+
+    ring_cmds = [cmds for cmds in ring_cmds.values() if cmds]
+    if not ring_cmds:
+        return
+    pool = ThreadPool(max(1, min(jobs, len(ring_cmds))))
+    try:
+        ring_results = pool.map(run_ring_cmds, ring_cmds)
+    finally:
+        pool.close()
+        pool.join()
+
+    error_status = 0
+    for results in ring_results:
+        for cmd, status, output in results:
+            print('Running: %s' % cmd)
+            if status > 0:
+                print('ERROR: %s' % output)
+                error_status = error_status or status
+            elif status < 0:
+                print('NOTE: %s' % output)
+    if error_status:
+        sys.exit(error_status)
+
 if __name__ == '__main__':
     main()
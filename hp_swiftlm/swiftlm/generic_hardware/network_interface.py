@@ -15,18 +15,31 @@
 # under the License.
 #
 
-try:
-    import commands
-except ImportError:
-    import subprocess as commands
-import string
-
+from collections import namedtuple
+import os
+import time
 
 from swiftlm.utils.utility import get_swift_bind_ips, UtilityExeception
 from swiftlm.utils.utility import ip_to_interface
+from swiftlm.utils.utility import load_json_state, save_json_state
 from swiftlm.utils.metricdata import MetricData
 from swiftlm.utils.values import Severity
 
+NET_DEV = '/proc/net/dev'
+SYS_CLASS_NET = '/sys/class/net'
+STATE_FILE = '/var/cache/swiftlm/network_interface.json'
+
+# The columns of /proc/net/dev, after the interface name
+RX_FIELDS = ('bytes', 'packets', 'errs', 'drop', 'fifo', 'frame',
+             'compressed', 'multicast')
+TX_FIELDS = ('bytes', 'packets', 'errs', 'drop', 'fifo', 'colls',
+             'carrier', 'compressed')
+# The counters reported as a rate per second
+RATE_FIELDS = ('bytes', 'packets', 'errs')
+
+# speed is in Mb/s, 0 if the link has no speed (it is down or virtual)
+Link = namedtuple('Link', ['speed', 'duplex', 'operstate'])
+
 BASE_RESULT = MetricData(
     name=__name__,
     messages={
@@ -50,85 +63,132 @@ def get_interface_names(ip_to_interface_map, bind_ip_list):
     """
     Get set of unique interface names.
 
+    An alias (eth0:1) is counted as the interface it is an alias of.
+
     :return: list of interface names
     """
     interface_name_list = set()
 
     for ip_address in bind_ip_list:
-        interface_name_list.add(ip_to_interface_map[ip_address])
+        try:
+            interface_name = ip_to_interface_map[ip_address]
+        except KeyError:
+            raise UtilityExeception('No interface has address %s'
+                                    % ip_address)
+        interface_name_list.add(interface_name.split(':')[0])
 
     return interface_name_list
 
 
-def get_interface_speed(interface_name):
+def read_sys_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        # speed cannot be read while a link is down
+        return None
+
+
+def get_link(interface_name, sys_class_net=None):
+    """
+    Read the speed, duplex and operstate of an interface from sysfs
+    """
+    path = os.path.join(sys_class_net or SYS_CLASS_NET, interface_name)
+    speed = str_to_num(read_sys_file(os.path.join(path, 'speed')) or '0')
+    if not isinstance(speed, int) or speed < 0:
+        speed = 0
+    duplex = read_sys_file(os.path.join(path, 'duplex'))
+    operstate = read_sys_file(os.path.join(path, 'operstate'))
+    return Link(speed, duplex or 'unknown', operstate or 'unknown')
+
+
+def get_interface_speed(interface_name, link=None):
     """
     Get the NIC speed of the specified interface
 
     :param interface_name: eth1
+    :param link: Link of the interface, read from sysfs if None
     :return: Response
     """
+    link = link or get_link(interface_name)
     c = BASE_RESULT.child(dimensions={'interface': interface_name})
+    c.value = link.speed
+    c.value_meta['duplex'] = link.duplex
+    c.value_meta['operstate'] = link.operstate
+    return c
+
+
+def read_net_dev(path=None):
+    """
+    Read the counters of every interface from /proc/net/dev
 
-    command = "ethtool " + interface_name
-    interface_data = commands.getoutput(command)
-    speed = ''
+    :return: dict of interface name: {'rx': {...}, 'tx': {...}}, empty if
+             the file cannot be read
+    """
+    try:
+        with open(path or NET_DEV) as f:
+            # Two lines of headings
+            lines = f.read().splitlines()[2:]
+    except (IOError, OSError):
+        return {}
 
-    # Filter lines here. We only want the speed.
-    lines = interface_data.split('\n')
+    counters = {}
     for line in lines:
-        if 'Speed' in line:
-            _, speed = line.split(':')
-
-    # Only leave the digits
-    speed = ''.join(c for c in speed if c in string.digits)
-    if speed:
-        c.value = str_to_num(speed)
-    else:
-        c.value = 0
-    return c
+        interface_name, _, values = line.partition(':')
+        data = [str_to_num(val) for val in values.split()]
+        if len(data) < len(RX_FIELDS) + len(TX_FIELDS):
+            continue
+        counters[interface_name.strip()] = {
+            'rx': dict(zip(RX_FIELDS, data[:len(RX_FIELDS)])),
+            'tx': dict(zip(TX_FIELDS, data[len(RX_FIELDS):])),
+        }
+    return counters
+
+
+def get_interface_data(interface_name, counters=None):
+    """Turn the counters of an interface into a dict of values."""
+    counters = counters if counters is not None else read_net_dev()
+    d = {'interface': interface_name}
+    d.update(counters[interface_name])
+    return d
 
 
-def get_interface_data(interface_name):
-    """Turn the raw data line for an interface into a dict of values."""
-    command = 'cat /proc/net/dev | grep ' + interface_name + ':'
-    interface_data = commands.getoutput(command)
-
-    data = [str_to_num(val) for val in interface_data.split()]
-
-    # Values are the index of the data after splitting command
-    # output on whitespace.
-    d = {
-        'interface': interface_name,
-        'rx': {
-            'bytes': 1,
-            'packets': 2,
-            'errs': 3,
-            'drop': 4,
-            'fifo': 5,
-            'frame': 6,
-            'compressed': 7,
-            'multicast': 8,
-        },
-        'tx': {
-            'bytes': 9,
-            'packets': 10,
-            'errs': 11,
-            'drop': 12,
-            'fifo': 13,
-            'colls': 14,
-            'carrier': 15,
-            'compressed': 16,
-        },
-    }
+def get_interface_rates(data, previous, elapsed, link):
+    """
+    The rates of the counters of an interface since the previous scan
 
-    for x in ['rx', 'tx']:
-        for field_name, field_index in d[x].items():
-            d[x][field_name] = data[field_index]
+    A counter that went backwards (the interface was reset, or the counter
+    wrapped) has no rate.
 
-    return d
+    :param data: get_interface_data of the interface
+    :param previous: the counters of the interface at the previous scan
+    :param elapsed: seconds since the previous scan
+    :param link: Link of the interface
+    :return: list of results
+    """
+    results = []
+    dimensions = {'interface': data['interface']}
+    for x in ['rx', 'tx']:
+        for stat_name in RATE_FIELDS:
+            before = previous.get(x, {}).get(stat_name)
+            if before is None or data[x][stat_name] < before:
+                continue
+            rate = float(data[x][stat_name] - before) / elapsed
+            c = BASE_RESULT.child(name=x + '.' + stat_name + '_per_sec',
+                                  dimensions=dimensions)
+            c.value = round(rate, 2)
+            results.append(c)
+            if stat_name == 'bytes' and link.speed:
+                # speed is in megabits per second
+                c = BASE_RESULT.child(name=x + '.utilisation',
+                                      dimensions=dimensions)
+                c.value = round(rate * 8 * 100 / (link.speed * 1000000.0),
+                                2)
+                results.append(c)
+    return results
 
 
-def run_network_interface_check():
+def run_network_interface_check(state_file=None):
     results = []
     ip_to_interface_map = ip_to_interface()
     bind_ip_list = get_swift_bind_ips()
@@ -141,9 +201,18 @@ def run_network_interface_check():
         c.value = Severity.fail
         return [c]
 
-    for interface_name in interface_names:
-        results.append(get_interface_speed(interface_name))
-        data = get_interface_data(interface_name)
+    counters = read_net_dev()
+    now = time.time()
+    state_file = state_file or STATE_FILE
+    state = load_json_state(state_file)
+    elapsed = now - state.get('time', now)
+
+    for interface_name in sorted(interface_names):
+        link = get_link(interface_name)
+        results.append(get_interface_speed(interface_name, link))
+        if interface_name not in counters:
+            continue
+        data = get_interface_data(interface_name, counters)
         for x in ['rx', 'tx']:
             for stat_name, stat_count in data[x].items():
                 c = BASE_RESULT.child(
@@ -154,12 +223,26 @@ def run_network_interface_check():
                 )
                 c.value = stat_count
                 results.append(c)
+        previous = state.get('counters', {}).get(interface_name)
+        if previous and elapsed > 0:
+            results.extend(get_interface_rates(data, previous, elapsed,
+                                               link))
+
+    try:
+        save_json_state({'time': now,
+                         'counters': dict((name, counters[name])
+                                          for name in interface_names
+                                          if name in counters)},
+                        state_file)
+    except (IOError, OSError):
+        # There are no rates on the next scan
+        pass
 
     return results
 
 
 def main():
-    """Check NIC speed and stats for each interface."""
+    """Check NIC speed, stats and rates for each interface."""
     return run_network_interface_check()
 
 
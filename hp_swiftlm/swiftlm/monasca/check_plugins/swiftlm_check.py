@@ -32,7 +32,11 @@ import threading
 # playbook task that deploys the associated swiftlm_detect detect plugin. Files
 # should contain json encoded lists of metric dicts.
 #
-# 2. Run a swiftlm-scan command line.
+# 2. Run a swiftlm-scan command line. All tasks are run by a single command
+# line that reports metrics per task; a command line is run for each task only
+# if that fails. If a swiftlm-scan daemon socket is configured then the latest
+# results are read from the daemon instead and the command line is only run
+# for tasks the daemon has no results for.
 #
 # 3. Run a python function found from a list of entry points.
 #
@@ -171,6 +175,13 @@ class SwiftLMScan(checks.AgentCheck):
     COMMAND_ARGS = ['sudo', 'swiftlm-scan', '--format', 'json']
     COMMAND_TIMEOUT = 15.0
     SUBCOMMAND_PREFIX = '--'
+    DAEMON_TIMEOUT = 5.0
+
+    # args added when all sub-commands are run with a single shell command;
+    # each sub-command is also limited to BATCH_TASK_TIMEOUT so that one slow
+    # sub-command does not cause the whole command to time out.
+    BATCH_ARGS = ['--by-check']
+    BATCH_TASK_TIMEOUT = 10.0
 
     # list of sub-commands each of which is appended to a shell command
     # with the prefix added
@@ -179,6 +190,10 @@ class SwiftLMScan(checks.AgentCheck):
     # list of tasks for which any 'ok' metrics will NOT be reported
     DEFAULT_SUPPRESS_OK = []
 
+    # run all sub-commands with a single shell command, falling back to one
+    # shell command per sub-command for any that are missing from the result
+    DEFAULT_BATCH_SUBCOMMANDS = True
+
     def __init__(self, name, init_config, agent_config, instances=None,
                  logger=None):
         super(SwiftLMScan, self).__init__(
@@ -278,6 +293,74 @@ class SwiftLMScan(checks.AgentCheck):
                     metrics = create_task_failed_metric('command', task_name)
         return metrics
 
+    def _run_batch_command(self, task_names):
+        # run all tasks with a single swiftlm-scan command line that reports
+        # the metrics of each task separately. Tasks that are missing from
+        # the result are run individually by _run_cached_command_task.
+        command = list(self.COMMAND_ARGS)
+        command.extend(self.BATCH_ARGS)
+        command.extend(['--jobs', str(len(task_names)),
+                        '--timeout', str(self.BATCH_TASK_TIMEOUT)])
+        command.extend(self.SUBCOMMAND_PREFIX + t for t in task_names)
+        cmd_str = ' '.join(command)
+        runner = CommandRunner(command)
+        results = {}
+        try:
+            runner.run_with_timeout(self.COMMAND_TIMEOUT)
+        except Exception as e:  # noqa
+            self.log.warn('Command "%s" failed with "%s"'
+                          % (cmd_str, e))
+            return results
+        if runner.exception:
+            self.log.warn('Command "%s" failed with "%s"'
+                          % (cmd_str, runner.exception))
+        elif runner.timed_out:
+            self.log.warn('Command "%s" timed out after %ss'
+                          % (cmd_str, self.COMMAND_TIMEOUT))
+        elif runner.returncode:
+            self.log.warn('Command "%s" failed with status %s'
+                          % (cmd_str, runner.returncode))
+        else:
+            try:
+                results = json.loads(runner.stdout)
+            except (ValueError, TypeError) as e:
+                self.log.warn('Failed to parse json: %s' % e)
+            if not isinstance(results, dict):
+                self.log.warn('Unexpected result from command "%s"'
+                              % cmd_str)
+                results = {}
+        return dict((t, results[t]) for t in task_names if t in results)
+
+    def _read_daemon_results(self, task_names):
+        # read the latest results of all tasks from the swiftlm-scan daemon
+        # in one request; see swiftlm.cli.scan_daemon for the protocol.
+        results = {}
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.DAEMON_TIMEOUT)
+        try:
+            s.connect(self.daemon_socket)
+            s.sendall(','.join(task_names) + '\n')
+            chunks = []
+            while True:
+                chunk = s.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            results = json.loads(''.join(chunks))
+        except Exception as e:  # noqa
+            self.log.warn('Reading from swiftlm-scan daemon "%s" failed'
+                          ' with "%s"' % (self.daemon_socket, e))
+        finally:
+            s.close()
+        return results
+
+    def _run_cached_command_task(self, task_name):
+        metrics = self.command_results.get(task_name)
+        if metrics is None:
+            # the daemon or batch command has no results for this task
+            metrics = self._run_command_line_task(task_name)
+        return metrics
+
     def _run_load_file_task(self, file_path):
         try:
             with open(file_path, 'r') as f:
@@ -335,6 +418,16 @@ class SwiftLMScan(checks.AgentCheck):
         else:
             self.suppress_ok = self._csv_to_list(instance.get('suppress_ok'))
 
+        self.daemon_socket = instance.get('daemon_socket') or None
+        self.log.debug('Using daemon socket %s' % self.daemon_socket)
+
+        batch = instance.get('batch_subcommands')
+        if batch is None:
+            self.batch_subcommands = self.DEFAULT_BATCH_SUBCOMMANDS
+        else:
+            self.batch_subcommands = str(batch).lower() in ('true', 'yes', '1')
+        self.log.debug('Batch subcommands %s' % self.batch_subcommands)
+
     def check(self, instance):
         self._load_instance_config(instance)
 
@@ -344,8 +437,16 @@ class SwiftLMScan(checks.AgentCheck):
         self.log_summary('entry point', summary)
 
         # run command line tasks
+        self.command_results = {}
+        if self.daemon_socket:
+            self.command_results.update(
+                self._read_daemon_results(self.subcommands))
+        missing = [task_name for task_name in self.subcommands
+                   if task_name not in self.command_results]
+        if self.batch_subcommands and len(missing) > 1:
+            self.command_results.update(self._run_batch_command(missing))
         metrics, summary = self._get_metrics(
-            self.subcommands, self._run_command_line_task)
+            self.subcommands, self._run_cached_command_task)
         self.log_summary('command', summary)
         all_metrics.extend(metrics)
 
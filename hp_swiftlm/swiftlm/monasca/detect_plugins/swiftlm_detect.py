@@ -47,7 +47,8 @@ class SwiftLMDetect(monasca_setup.detection.ArgsPlugin):
         config = agent_config.Plugins()
         parameters = {'name': self.CHECK_NAME}
         if self.args:
-            for arg in ('metrics_files', 'subcommands', 'suppress_ok'):
+            for arg in ('metrics_files', 'subcommands', 'suppress_ok',
+                        'daemon_socket', 'batch_subcommands'):
                 if arg in self.args:
                     parameters[arg] = self.args.get(arg)
 
@@ -14,6 +14,8 @@
 #
 
 
+from collections import namedtuple
+from itertools import chain
 import sys
 import os.path
 from yaml import safe_load, safe_dump
@@ -21,6 +23,40 @@ from yaml import safe_load, safe_dump
 from swiftlm.rings.ring_model import DeviceInfo, Consumes, SwiftModelException
 from swiftlm.utils.drivedata import DISK_MOUNT, LVM_MOUNT
 
+# The items of a device found in the input model
+DEVICE_FIELDS = ('region_name', 'rack_id', 'region_id', 'zone_id',
+                 'server_name', 'server_ip', 'server_bind_port',
+                 'replication_ip', 'replication_bind_port',
+                 'swift_drive_name', 'device_name', 'ring_name',
+                 'group_type', 'block_devices', 'presence')
+
+
+def _copy_model(value):
+    """
+    Copy the dicts and lists of a model item, faster than copy.deepcopy()
+    """
+    if isinstance(value, dict):
+        return dict((key, _copy_model(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_copy_model(item) for item in value]
+    return value
+
+
+class DeviceRecord(namedtuple('DeviceRecord', DEVICE_FIELDS)):
+    """
+    Read-only record of a device in the input model
+    """
+    __slots__ = ()
+
+    def device_info(self):
+        """
+        :returns: a new DeviceInfo for the device, which the caller may change
+                  (including its block_devices)
+        """
+        model = dict(zip(self._fields, self))
+        model['block_devices'] = _copy_model(self.block_devices)
+        return DeviceInfo(model)
+
 
 class InputModel(object):
     """
@@ -83,28 +119,54 @@ class InputModel(object):
         presence:
             Currently always 'present' (reserved for future use -- would allow
             controlled removal of drives or server from an input model)
+
+    The devices are read from the model once into a table of DeviceRecord.
+    iter_devices() returns new DeviceInfo objects on each call, so callers
+    are free to change them.
     """
 
-    def __init__(self, fd=None, config=None, hosts_fd=None, consumes=None):
+    def __init__(self, fd=None, config=None, hosts_fd=None, consumes=None,
+                 host_ips=None):
         self.config = {}
         self.servers = []
         self.host_ip_map = {}
+        self.alias_map = {}
         if fd:
             self._read_config(fd)
         if config:
             self.config = config
             self.servers = self.config.get('global').get('all_servers')
         self.devices = []
+        self._device_table = None
+        self._server_binds = {}
         if hosts_fd:
             self._load_host_ip_mapping(hosts_fd)
+        if host_ips:
+            self._load_host_ips(host_ips)
         if consumes:
             self.consumes = Consumes(consumes)
 
+    def device_table(self):
+        """
+        Get the table of devices in the input model
+
+        The table is built on first use and then reused, so the servers and
+        disk models are only walked once.
+
+        :returns: list of DeviceRecord
+        """
+        if self._device_table is None:
+            records = []
+            for device_info in chain(self._iter_device_groups(),
+                                     self._iter_volume_groups()):
+                records.append(DeviceRecord(
+                    *[device_info.get(field) for field in DEVICE_FIELDS]))
+            self._device_table = records
+        return self._device_table
+
     def iter_devices(self):
-        for device_info in self._iter_device_groups():
-            yield device_info
-        for device_info in self._iter_volume_groups():
-            yield device_info
+        for record in self.device_table():
+            yield record.device_info()
 
     def _iter_device_groups(self):
         for server in self.config.get('global').get('all_servers'):
@@ -243,12 +305,17 @@ class InputModel(object):
                         lv_index += 1
 
     def _get_server_bind(self, ring_name, server_name):
+        server_bind = self._server_binds.get((ring_name, server_name))
+        if server_bind:
+            return server_bind
         network_name, network_port = self.consumes.get_network_name_port(
             ring_name, server_name)
         if not network_name:
             return None, None
         server_ip = self.ip_address(network_name, 'ring: %s host: %s' % (
             ring_name, server_name))
+        self._server_binds[(ring_name, server_name)] = (server_ip,
+                                                        network_port)
         return (server_ip, network_port)
 
     def __repr__(self):
@@ -284,6 +351,33 @@ class InputModel(object):
                 self.host_ip_map[hostname] = ip_address
             except Exception:
                 continue  # Ignore all parsing errors
+        self._build_alias_map()
+
+    def _load_host_ips(self, host_ips):
+        """
+        Load host to IP mapping data from the network data of a model
+
+        This avoids writing and parsing a hosts file when the caller already
+        has the network names and addresses.
+
+        :param host_ips: dict of network host name to IP address
+        """
+        for hostname, ip_address in host_ips.items():
+            self.host_ip_map[ip_address] = hostname
+            self.host_ip_map[hostname] = ip_address
+        self._build_alias_map()
+
+    def _build_alias_map(self):
+        """
+        Index the items of host_ip_map by the basename of their value
+
+        so that aliases() is a lookup rather than a scan of all hosts.
+        """
+        self.alias_map = {}
+        for item, item_name in self.host_ip_map.items():
+            if item_name:
+                self.alias_map.setdefault(Consumes.basename(item_name),
+                                          []).append(item)
 
     def ip_address(self, hostname, context):
         """
@@ -302,15 +396,7 @@ class InputModel(object):
         :param ip_address: The ip address to lookup.
         :return: list of ip addresses
         """
-        aliases = []
         network_name = self.host_ip_map.get(ip_address)
         if not network_name:
             return []
-        basename = Consumes.basename(network_name)
-        for item in self.host_ip_map.keys():
-            item_name = self.host_ip_map.get(item)
-            if item_name:
-                item_basename = Consumes.basename(item_name)
-                if item_basename == basename:
-                    aliases.append(item)
-        return aliases
+        return list(self.alias_map.get(Consumes.basename(network_name), []))
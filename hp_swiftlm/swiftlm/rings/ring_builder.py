@@ -14,7 +14,9 @@
 #
 
 
+from multiprocessing.pool import ThreadPool
 from os import listdir
+import importlib
 import os.path
 import subprocess
 import sys
@@ -23,6 +25,116 @@ import json
 
 from swiftlm.rings.ring_model import DeviceInfo, RingSpecification
 
+try:
+    # The libyaml based loader and dumper are much faster
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+try:
+    import cPickle
+
+    def _builder_unpickler(fd):
+        unpickler = cPickle.Unpickler(fd)
+        unpickler.find_global = _find_builder_global
+        return unpickler
+except ImportError:
+    import pickle
+
+    class _builder_unpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            return _find_builder_global(module, name)
+
+# First line of a ring delta in the compact format, see RingDelta
+COMPACT_FORMAT = 'swiftlm-ring-delta-compact/1'
+
+# Number of builder files read at the same time
+DEFAULT_READ_JOBS = 8
+
+# Same as swift.common.ring.builder.MAX_BALANCE
+MAX_BALANCE = 999.99
+
+# The only classes found in a builder file saved by swift (which pickles the
+# dict returned by RingBuilder.to_dict()). Builder files from very old
+# versions of swift pickle the RingBuilder object itself; we cannot load
+# those without swift so they are read using swift-ring-builder instead.
+BUILDER_GLOBALS = set([
+    ('array', 'array'),
+    ('array', '_array_reconstructor'),
+    ('__builtin__', 'set'),
+    ('builtins', 'set'),
+])
+
+
+def search_ip(ip):
+    """
+    An IP address as swift-ring-builder expects it in a device search value
+    (or the device of a batch add): IPv6 addresses in brackets
+    """
+    if ':' in ip:
+        return '[%s]' % ip
+    return ip
+
+
+def _find_builder_global(module, name):
+    if (module, name) not in BUILDER_GLOBALS:
+        raise ValueError('Unexpected %s.%s in builder file' % (module, name))
+    return getattr(importlib.import_module(module), name)
+
+
+def read_builder_file(builder_filename):
+    """
+    Read a builder file without using swift-ring-builder
+
+    The devices are described in the same terms as in the output of
+    swift-ring-builder, so the weight, balance, ports etc. are strings.
+
+    :param builder_filename: path to the builder file
+    :returns: tuple of replica count, balance and a list of DeviceInfo
+    :raises ValueError: if the file is not a builder file that we can read
+    """
+    with open(builder_filename, 'rb') as fd:
+        try:
+            builder = _builder_unpickler(fd).load()
+        except Exception as err:
+            raise ValueError('Cannot read %s: %s' % (builder_filename, err))
+    if not isinstance(builder, dict) or 'devs' not in builder:
+        raise ValueError('%s is not a builder file' % builder_filename)
+
+    replica_count = float(builder['replicas'])
+    parts = 2 ** builder['part_power']
+    devs = [dev for dev in builder['devs'] if dev is not None]
+    total_weight = sum(dev['weight'] for dev in devs)
+    weight_of_one_part = 0.0
+    if total_weight:
+        weight_of_one_part = parts * replica_count / total_weight
+
+    ring_name = builder_filename[0:builder_filename.find('.builder')]
+    balance = 0.0
+    device_list = []
+    for dev in devs:
+        if not dev['weight']:
+            dev_balance = MAX_BALANCE if dev.get('parts') else 0.0
+        else:
+            dev_balance = (100.0 * dev.get('parts', 0) /
+                           (dev['weight'] * weight_of_one_part) - 100.0)
+        balance = max(balance, min(abs(dev_balance), MAX_BALANCE))
+        device_list.append(DeviceInfo({
+            'ring_name': ring_name,
+            'zone_id': '%d' % dev['zone'],
+            'region_id': '%d' % dev.get('region', 1),
+            'server_ip': dev['ip'],
+            'server_bind_port': '%d' % dev['port'],
+            'replication_ip': dev.get('replication_ip', dev['ip']),
+            'replication_bind_port':
+            '%d' % dev.get('replication_port', dev['port']),
+            'swift_drive_name': dev['device'],
+            'weight': '%.2f' % dev['weight'],
+            'balance': '%.2f' % dev_balance,
+            'meta': dev.get('meta', ''),
+            'presence': 'present'}))
+    return replica_count, float('%.2f' % balance), device_list
+
 
 class RingDelta(object):
     """
@@ -56,22 +168,67 @@ class RingDelta(object):
 
     def read_from_file(self, fd, fmt):
         if fmt == 'yaml':
-            model = yaml.safe_load(fd)
+            self.load_model(yaml.load(fd, Loader=SafeLoader))
+        elif fmt == 'compact':
+            self._read_compact(fd)
         else:
-            model = json.loads(fd)
-        self.load_model(model)
+            self.load_model(json.load(fd))
         fd.close()
 
     def write_to_file(self, fd, fmt):
-        data = self.dump_model()
         if fmt == 'yaml':
-            output = yaml.safe_dump(data, default_flow_style=False)
+            yaml.dump(self.dump_model(), fd, Dumper=SafeDumper,
+                      default_flow_style=False)
+        elif fmt == 'compact':
+            self._write_compact(fd)
         else:
-            output = yaml.dumps(data, indent=2)
-        fd.write(output)
+            json.dump(self.dump_model(), fd, indent=2)
+            fd.write('\n')
         if not fd == sys.stdout:
             fd.close()
 
+    def _write_compact(self, fd):
+        """
+        Write the delta in the compact format
+
+        The compact format is line oriented. The first line identifies the
+        format. The second line is a json object with the rings, the ring
+        actions and the names of the device keys. Each following line is a
+        json list of the values of the keys of one device. A device with
+        items that are not device keys (see DeviceInfo.extra) has them in a
+        json object after the values. Devices are written (and read) one at
+        a time.
+        """
+        header = self.dump_model(devices=False)
+        header['device_keys'] = DeviceInfo.keynames
+        fd.write('%s\n' % COMPACT_FORMAT)
+        fd.write('%s\n' % json.dumps(header, separators=(',', ':')))
+        for device in self.delta_devices:
+            row = [device.get(key) for key in DeviceInfo.keynames]
+            if device.extra:
+                row.append(device.extra)
+            fd.write('%s\n' % json.dumps(row, separators=(',', ':')))
+
+    def _read_compact(self, fd):
+        lines = iter(fd)
+        if next(lines, '').strip() != COMPACT_FORMAT:
+            raise ValueError('Not a compact ring delta file')
+        header = json.loads(next(lines))
+        keys = header.pop('device_keys')
+        header['delta_devices'] = []
+        self.load_model(header)
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            model = dict((key, value) for key, value in zip(keys, row)
+                         if value is not None)
+            if len(row) > len(keys):
+                model.update(row[len(keys)])
+            device = DeviceInfo()
+            device.load_from_model(model)
+            self.delta_devices.append(device)
+
     def __repr__(self):
         output = ''
         for region_name, ring_name in self.delta_rings.keys():
@@ -90,7 +247,7 @@ class RingDelta(object):
             output += '%s\n' % device
         return output
 
-    def dump_model(self):
+    def dump_model(self, devices=True):
         staged_rings = []
         for region_name, ring_name in self.delta_rings.keys():
             ring_specification = self.delta_rings[(region_name, ring_name)]
@@ -104,12 +261,12 @@ class RingDelta(object):
             stage_ring_actions.append({'region_name': region_name,
                                        'ring_name': ring_name,
                                        'action': action})
-        staged_devices = []
-        for device in self.delta_devices:
-            staged_devices.append(device.dump_model())
-        return {'delta_rings': staged_rings,
-                'delta_ring_actions': stage_ring_actions,
-                'delta_devices': staged_devices}
+        model = {'delta_rings': staged_rings,
+                 'delta_ring_actions': stage_ring_actions}
+        if devices:
+            model['delta_devices'] = [device.dump_model()
+                                      for device in self.delta_devices]
+        return model
 
     def load_model(self, data):
         staged_rings = data.get('delta_rings')
@@ -175,13 +332,14 @@ class RingDelta(object):
 
 class RingBuilder(object):
 
-    def __init__(self, builder_dir, read_write):
+    def __init__(self, builder_dir, read_write, jobs=DEFAULT_READ_JOBS):
         self.builder_dir = builder_dir
         self.flat_device_list = []
         self.builder_rings = {}
         if not os.path.isdir(builder_dir):
                 raise IOError('%s is not a directory' % builder_dir)
         if read_write:
+            builder_files = []
             for region_dir in [f for f in listdir(builder_dir) if
                                (os.path.isdir(os.path.join(builder_dir, f)) and
                                 f.startswith('region-'))]:
@@ -192,15 +350,20 @@ class RingBuilder(object):
                                                               f)) and
                                   f.endswith('.builder'))]:
                     ring_name = filename[0:filename.find('.builder')]
-                    self.replica_count = 0.0
-                    self.balance = 0.0
-                    for device_info in self._parse_builder_output(os.path.join(
-                            region_dir, filename)):
-                        device_info.region_name = region_name
-                        device_info.ring_name = ring_name
-                        self.flat_device_list.append(device_info)
-                    self.register_ring(region_name, ring_name,
-                                       self.replica_count, self.balance)
+                    builder_files.append((region_name, ring_name,
+                                          os.path.join(region_dir, filename)))
+            builder_files.sort()
+            results = self._read_builder_files(
+                [path for _, _, path in builder_files], jobs)
+            for (region_name, ring_name, _), result in zip(builder_files,
+                                                           results):
+                replica_count, balance, device_list = result
+                for device_info in device_list:
+                    device_info.region_name = region_name
+                    device_info.ring_name = ring_name
+                    self.flat_device_list.append(device_info)
+                self.register_ring(region_name, ring_name,
+                                   replica_count, balance)
 
     def __repr__(self):
         output = '  RING FILES\n'
@@ -230,29 +393,54 @@ class RingBuilder(object):
     def get_ringspec(self, region_name, ring_name):
         return self.builder_rings[(region_name, ring_name)]
 
+    def _read_builder_files(self, builder_filenames, jobs):
+        """
+        Read builder files in parallel
+
+        :returns: list of (replica_count, balance, device_list), in the same
+                  order as builder_filenames
+        """
+        if len(builder_filenames) <= 1 or jobs <= 1:
+            return [self._read_builder(f) for f in builder_filenames]
+        pool = ThreadPool(min(jobs, len(builder_filenames)))
+        try:
+            return pool.map(self._read_builder, builder_filenames)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _read_builder(self, builder_filename):
+        try:
+            return read_builder_file(builder_filename)
+        except (IOError, ValueError):
+            return self._parse_builder_output(builder_filename)
+
     def _parse_builder_output(self, builder_filename):
         ring_name = builder_filename[0:builder_filename.find('.builder')]
         try:
             output = subprocess.check_output(['swift-ring-builder',
                                               '%s' % builder_filename])
-        except subprocess.CalledProcessError as err:
-            print('ERROR: swift-ring-builder %s: %s' % (builder_filename, err))
-            sys.exit(1)
+        except (OSError, subprocess.CalledProcessError) as err:
+            # Raised rather than exiting since this runs in a worker thread
+            raise IOError('swift-ring-builder %s: %s' % (builder_filename,
+                                                         err))
+        replica_count = 0.0
+        balance = 0.0
+        device_list = []
         done_with_headers = False
         for line in output.split('\n'):
             items = line.split()
             if not items:
-                break
-            if items[1] == 'partitions,':
-                self.partitions = int(items[0])
-                self.replica_count = float(items[2])
-                self.balance = float(items[10])
+                continue
+            if len(items) > 10 and items[1] == 'partitions,':
+                replica_count = float(items[2])
+                balance = float(items[10])
             if items[0] == 'Devices:':
                 done_with_headers = True
                 continue
             if done_with_headers:
                 (deviceid, region_id, zone_id, server, port, replicationip,
-                 replicationport, drive, weight, partitions, balance,
+                 replicationport, drive, weight, partitions, dev_balance,
                  meta) = items
                 device_info = DeviceInfo({'ring_name': ring_name,
                                           'zone_id': zone_id,
@@ -264,10 +452,11 @@ class RingBuilder(object):
                                           replicationport,
                                           'swift_drive_name': drive,
                                           'weight': weight,
-                                          'balance': balance,
+                                          'balance': dev_balance,
                                           'meta': meta,
                                           'presence': 'present'})
-                yield device_info
+                device_list.append(device_info)
+        return replica_count, balance, device_list
 
     def device_count(self, region_name, ring_name):
         count = 0
@@ -323,6 +512,61 @@ class RingBuilder(object):
                                   device_info.meta,
                                   device_info.weight))
 
+    def command_devices_add(self, region_name, ring_name, device_infos):
+        """
+        Add several devices to a ring with one swift-ring-builder command
+
+        The builder file is loaded and saved once rather than once for
+        each device as with command_device_add().
+        """
+        builder_path = os.path.join(self.builder_dir,
+                                    'region-%s' % region_name,
+                                    '%s.builder' % ring_name)
+        devices = []
+        for device_info in device_infos:
+            if not device_info.replication_bind_port:
+                device_info.replication_bind_port = (
+                    device_info.server_bind_port)
+            if not device_info.replication_ip:
+                device_info.replication_ip = device_info.server_ip
+            device = 'r%sz%s-%s:%sR%s:%s/%s' % (
+                device_info.region_id,
+                device_info.zone_id,
+                search_ip(device_info.server_ip),
+                device_info.server_bind_port,
+                search_ip(device_info.replication_ip),
+                device_info.replication_bind_port,
+                device_info.swift_drive_name)
+            if device_info.meta:
+                device += '_%s' % device_info.meta
+            devices.append('%s %s' % (device, device_info.weight))
+        return 'swift-ring-builder %s add %s' % (builder_path,
+                                                 ' '.join(devices))
+
+    def command_devices_set_weight(self, region_name, ring_name,
+                                   device_infos):
+        """ Set the weight of several devices with one command """
+        builder_path = os.path.join(self.builder_dir,
+                                    'region-%s' % region_name,
+                                    '%s.builder' % ring_name)
+        searches = ['%s/%s %s' % (search_ip(device_info.server_ip),
+                                  device_info.swift_drive_name,
+                                  device_info.weight)
+                    for device_info in device_infos]
+        return 'swift-ring-builder %s set_weight %s' % (builder_path,
+                                                        ' '.join(searches))
+
+    def command_devices_remove(self, region_name, ring_name, device_infos):
+        """ Remove several devices with one command """
+        builder_path = os.path.join(self.builder_dir,
+                                    'region-%s' % region_name,
+                                    '%s.builder' % ring_name)
+        searches = ['%s/%s' % (search_ip(device_info.server_ip),
+                               device_info.swift_drive_name)
+                    for device_info in device_infos]
+        return 'swift-ring-builder %s remove %s' % (builder_path,
+                                                    ' '.join(searches))
+
     def command_rebalance(self, region_name, ringspec):
         ring_name = ringspec.name
         builder_path = os.path.join(self.builder_dir,
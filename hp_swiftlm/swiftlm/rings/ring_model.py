@@ -27,7 +27,117 @@ class SwiftModelException(Exception):
         return repr(self.value)
 
 
-class RingSpecification(dict):
+class ModelRecord(object):
+    """
+    Base class of records with a fixed set of keys
+
+    Each key in keynames is stored in a slot, so reading an item as an
+    attribute is a plain attribute lookup and a record is much smaller than
+    a dict. A key that has not been set reads as None. Records support the
+    dict methods used with models (get, [], keys, items, update, copy and
+    comparison with a dict) so they can be used in place of the dicts they
+    replace. dump_model() returns a plain dict.
+
+    Items with keys not in keynames (e.g. from a newer input model) are kept
+    in the extra dict, so they can be read as items and are dumped again,
+    but not read as attributes.
+
+    Subclasses set __slots__ = keynames.
+    """
+    __slots__ = ('extra',)
+    keynames = ()
+
+    def __init__(self, model=None):
+        self.extra = None
+        if model:
+            self.update(model)
+
+    def __getattr__(self, item):
+        # Only called if item is not set
+        if item in self.keynames:
+            return None
+        raise AttributeError('No key %s in %s' % (item, self))
+
+    def __getitem__(self, key):
+        try:
+            if key in self.keynames:
+                return object.__getattribute__(self, key)
+            return self.extra[key]
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.keynames:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key not in self.keynames:
+            return bool(self.extra) and key in self.extra
+        try:
+            object.__getattribute__(self, key)
+        except AttributeError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, ModelRecord):
+            other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        items = []
+        for key in self.keynames:
+            try:
+                items.append((key, object.__getattribute__(self, key)))
+            except AttributeError:
+                pass
+        if self.extra:
+            items.extend(self.extra.items())
+        return items
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def update(self, model):
+        for key, value in model.items():
+            if key == 'extra':
+                self[key] = value
+                continue
+            try:
+                setattr(self, key, value)
+            except AttributeError:
+                # Not a slot
+                self[key] = value
+
+    def copy(self):
+        return dict(self.items())
+
+
+class RingSpecification(ModelRecord):
     """
     Specification of a single ring
 
@@ -65,39 +175,32 @@ class RingSpecification(dict):
                                            # containing specification
                                            # (to inherit region and zone)
     """
-    keynames = ['name', 'display_name', 'partition_power', 'min_part_time',
+    keynames = ('name', 'display_name', 'partition_power', 'min_part_time',
                 'default', 'server_network_group', 'server_bind_port',
                 'replication_network_group', 'replication_bind_port',
                 'replication_policy', 'erasure_coding_policy',
-                'swift_zones', 'balance', 'parent', 'weight_step']
+                'swift_zones', 'balance', 'parent', 'weight_step')
+    __slots__ = keynames
 
     def __init__(self, parent):
         super(RingSpecification, self).__init__()
-        self.update({'parent': parent})
-
-    def __getattr__(self, item):
-        # Special case for replica-count
-        if item == 'replica_count':
-            if self.get('replication_policy'):
-                return float(
-                    self.get('replication_policy').get('replica_count'))
-            elif self.get('erasure_coding_policy'):
-                ec = self.get('erasure_coding_policy')
-                return float((ec.get('ec_num_data_fragments') +
-                              ec.get('ec_num_parity_fragments')))
-            return None
+        self.parent = parent
 
-        # Return value for valid items
-        if item in RingSpecification.keynames:
-            return self.get(item, None)
-        else:
-            raise AttributeError
+    @property
+    def replica_count(self):
+        if self.replication_policy:
+            return float(self.replication_policy.get('replica_count'))
+        elif self.erasure_coding_policy:
+            ec = self.erasure_coding_policy
+            return float((ec.get('ec_num_data_fragments') +
+                          ec.get('ec_num_parity_fragments')))
+        return None
 
     def __repr__(self):
         output = '(ring) name: %s,' % self.name
         output += ' display-name: %s,' % self.display_name
         output += ' partition-power: %s,' % self.partition_power
-        output += ' replica_count: %s' % self.__getattr__('replica_count')
+        output += ' replica_count: %s' % self.replica_count
         return output
 
     def dump_model(self):
@@ -302,42 +405,36 @@ class RingSpecifications(object):
         return None
 
 
-class DeviceInfo(dict):
+class DeviceInfo(ModelRecord):
     """
     Represents all the data connected with a device
     """
 
-    keynames = ['region_name', 'rack_id', 'region_id', 'zone_id',
+    keynames = ('region_name', 'rack_id', 'region_id', 'zone_id',
                 'server_name', 'server_ip', 'server_bind_port',
                 'replication_ip', 'replication_bind_port',
                 'swift_drive_name', 'device_name', 'ring_name', 'group_type',
                 'presence', 'weight', 'balance', 'meta',
-                'block_devices']
+                'block_devices')
+    __slots__ = keynames
 
     def __init__(self, model=None):
         super(DeviceInfo, self).__init__()
         if model:
             self.load_from_model(model)
 
-    def __getattr__(self, item):
-        if item in DeviceInfo.keynames:
-            return self.get(item, None)
-        else:
-            raise AttributeError('No key %s in %s' % (item, self))
+    def identity(self):
+        """
+        Get the key that identifies a device in a ring
 
-    def __setattr__(self, item, value):
-        if item in DeviceInfo.keynames:
-            self.update({item: value})
-        else:
-            raise AttributeError('No key %s in %s' % (item, self))
+        Devices with the same identity are the same device (see
+        is_same_device()), so the identity can be used to index devices.
+        """
+        return (self.region_name, self.ring_name, self.server_ip,
+                self.swift_drive_name)
 
     def is_same_device(self, device_info):
-        if (self.region_name == device_info.region_name and
-                self.ring_name == device_info.ring_name and
-                self.server_ip == device_info.server_ip and
-                self.swift_drive_name == device_info.swift_drive_name):
-            return True
-        return False
+        return self.identity() == device_info.identity()
 
     def dump_model(self):
         return self.copy()
@@ -16,14 +16,65 @@
 #
 
 
-import ast
-import subprocess
+"""
+Scan the kernel log for drive errors, as swift-drive-audit does, without
+running swift-drive-audit.
+
+Each scan only reads what has been added to the log since the last one: the
+inode of the log and the offset read to are persisted, along with the error
+counts of recent scans, so that the errors of each drive over the last
+error_window seconds are reported. When the log has been rotated, the rest
+of the rotated log (log_file.1) is read first.
+
+Each line is counted at the time it was logged, and lines logged before
+the window (such as those of the old log read by the first scan) are
+ignored, as swift-drive-audit ignores lines older than its minutes option.
+Lines whose syslog timestamp cannot be parsed are skipped.
+
+The device directory, the window (minutes) and the error patterns
+(regex_pattern1, regex_pattern2...) are read from swift's drive-audit.conf.
+The [drive-audit] section of swiftlm-scan.conf may set log_file and
+override them (error_window is in seconds). As in swift-drive-audit, the
+first group of each pattern is the kernel name of the device with the error.
+"""
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+import calendar
+import datetime
+import os
+import re
+import time
 
 from swiftlm.utils.metricdata import MetricData
+from swiftlm.utils.utility import (
+    load_json_state, save_json_state, swiftlm_scan_conf
+)
 from swiftlm.utils.values import Severity
 
-ERRORS_PATTERN = 'drive-audit: Errors found:'
-DEVICES_PATTERN = 'drive-audit: Devices found:'
+KERN_LOG = '/var/log/kern.log'
+DRIVE_AUDIT_CONF = '/etc/swift/drive-audit.conf'
+DEVICE_DIR = '/srv/node'
+MOUNTS = '/proc/mounts'
+STATE_FILE = '/var/cache/swiftlm/drive_audit_state.json'
+# Seconds over which errors are counted, swift-drive-audit counts the errors
+# of the last 60 minutes
+ERROR_WINDOW = 3600
+# The first scan reads at most this many bytes from the end of the log
+INITIAL_READ_BYTES = 1024 * 1024
+# The default patterns of swift-drive-audit
+ERROR_PATTERNS = (
+    r'\berror\b.*\b(sd[a-z]{1,2}\d?)\b',
+    r'\b(sd[a-z]{1,2}\d?)\b.*\berror\b',
+)
+# Lines logged this many seconds after the scan are taken to be from the
+# previous year (a syslog timestamp has no year)
+CLOCK_SKEW = 86400
+ISO_TIMESTAMP = re.compile(
+    r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?'
+    r'(Z|[+-]\d\d:?\d\d)?\s')
 
 BASE_RESULT = MetricData(
     name=__name__,
@@ -36,50 +87,237 @@ BASE_RESULT = MetricData(
 )
 
 
-def get_devices(output):
+def _read_section(conf_file):
+    parser = configparser.RawConfigParser()
+    parser.read(conf_file)
+    if parser.has_section('drive-audit'):
+        return dict(parser.items('drive-audit'))
+    return {}
+
+
+def _patterns(options):
+    """ The regex_pattern options, as swift-drive-audit names them """
+    return [options[key] for key in sorted(options)
+            if key.startswith('regex_pattern')]
+
+
+def load_config(conf_file=None, drive_audit_conf=None):
+    """
+    Read the [drive-audit] sections of swift's drive-audit.conf and of
+    swiftlm-scan.conf, the latter taking precedence
+
+    :returns: dict of log_file, device_dir, error_window and patterns, a
+              list of compiled regular expressions
+    """
+    swift_options = _read_section(drive_audit_conf or DRIVE_AUDIT_CONF)
+    options = _read_section(conf_file or swiftlm_scan_conf)
+
+    error_window = ERROR_WINDOW
+    if 'minutes' in swift_options:
+        error_window = int(swift_options['minutes']) * 60
+    patterns = (_patterns(options) or _patterns(swift_options) or
+                ERROR_PATTERNS)
+    return {'log_file': options.get('log_file', KERN_LOG),
+            'device_dir': options.get(
+                'device_dir', swift_options.get('device_dir', DEVICE_DIR)),
+            'error_window': int(options.get('error_window', error_window)),
+            'patterns': [re.compile(pattern) for pattern in patterns]}
+
+
+def drive_name(kernel_device):
+    """ The drive of a partition: sdb1 is on sdb """
+    return re.sub(r'(?<=[a-z])\d+$', '', kernel_device)
+
+
+def get_devices(device_dir=DEVICE_DIR, mounts=MOUNTS):
     """
-    Returns a list of devices as a dict of mount_point and device
+    Returns a list of the devices mounted below device_dir as a dict of
+    mount_point and kernel_device (the drive the mounted partition is on)
     """
-    # TODO use drive_model.yml to determine drives to check
-    lines = [s.strip() for s in output.split('\n') if s]
+    devices = []
+    try:
+        with open(mounts) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return devices
     for line in lines:
-        if DEVICES_PATTERN in line:
-            devs = line.split(DEVICES_PATTERN)[1].strip()
-            devices = ast.literal_eval(devs)
-            return [{'mount_point': d['mount_point'],
-                     'kernel_device': d['kernel_device'][:-1]} for
-                    d in devices]
+        fields = line.split()
+        if len(fields) < 2 or not fields[0].startswith('/dev/'):
+            continue
+        block_device, mount_point = fields[:2]
+        if not mount_point.startswith(device_dir):
+            continue
+        # The real device of a link such as /dev/disk/by-label/...
+        kernel_device = os.path.basename(os.path.realpath(block_device))
+        devices.append({'mount_point': mount_point,
+                        'kernel_device': drive_name(kernel_device)})
+    return devices
+
+
+def _read_from(path, offset):
+    """
+    Read the complete lines of a file from offset
+
+    :returns: (lines, offset after the last complete line)
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode('utf-8', 'replace').splitlines()
+    return lines, offset + end
 
 
-def get_error_devices(output):
+def read_new_lines(log_file, state):
     """
-    Returns a dict of mapping device->error count for each device
-    with errors.
+    Read the lines added to the log since the position in state
+
+    :params state: dict with the inode and offset of the log when it was
+                   last read, updated to the new position
+    :returns: list of lines
+    :raises IOError, OSError: if the log cannot be read
+    """
+    st = os.stat(log_file)
+    inode = state.get('inode')
+    offset = state.get('offset', 0)
+    lines = []
+
+    if inode is None:
+        # First scan, start near the end of the log
+        offset = max(0, st.st_size - INITIAL_READ_BYTES)
+        if offset:
+            skipped, offset = _read_from(log_file, offset)
+            # Drop the (partial) line offset fell in
+            lines = skipped[1:]
+            state.update(inode=st.st_ino, offset=offset)
+            return lines
+    elif inode != st.st_ino:
+        # Rotated, read what was added to the old log before it was
+        rotated = log_file + '.1'
+        try:
+            if os.stat(rotated).st_ino == inode:
+                lines, _ = _read_from(rotated, offset)
+        except (IOError, OSError):
+            pass
+        offset = 0
+    elif st.st_size < offset:
+        # Truncated
+        offset = 0
+
+    new_lines, offset = _read_from(log_file, offset)
+    lines.extend(new_lines)
+    state.update(inode=st.st_ino, offset=offset)
+    return lines
+
+
+def log_time(line, now):
+    """
+    The time a line was logged, from its syslog timestamp: either
+    "Oct 10 10:00:02" in local time, or an ISO 8601 timestamp such as
+    "2015-10-10T10:00:02.123456+01:00"
+
+    :param now: the time of the scan, for the year of a syslog timestamp
+    :returns: seconds since the epoch, None if there is no timestamp
+    """
+    match = ISO_TIMESTAMP.match(line)
+    if match:
+        try:
+            logged = datetime.datetime.strptime(match.group(1),
+                                                '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            return None
+        zone = match.group(2)
+        if not zone:
+            return time.mktime(logged.timetuple())
+        offset = 0
+        if zone != 'Z':
+            zone = zone.replace(':', '')
+            offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+            if zone[0] == '-':
+                offset = -offset
+        return calendar.timegm(logged.timetuple()) - offset
+
+    year = time.localtime(now).tm_year
+    try:
+        logged = datetime.datetime.strptime(
+            '%d %s' % (year, ' '.join(line.split()[:3])),
+            '%Y %b %d %H:%M:%S')
+    except ValueError:
+        return None
+    seconds = time.mktime(logged.timetuple())
+    if seconds > now + CLOCK_SKEW:
+        # Logged last year
+        seconds = time.mktime(logged.replace(year=year - 1).timetuple())
+    return seconds
+
+
+def find_errors(lines, patterns, now, window=ERROR_WINDOW):
+    """
+    Find the errors of each drive logged in the last window seconds
+
+    :returns: dict of drive: list of [time logged, number of errors]
     """
-    lines = [s.strip() for s in output.split('\n') if s]
+    errors = {}
     for line in lines:
-        if ERRORS_PATTERN in line:
-            devices = line.split(ERRORS_PATTERN)[1].strip()
-            err_devices = ast.literal_eval(devices)
-            return err_devices
+        for pattern in patterns:
+            match = pattern.search(line)
+            if match:
+                break
+        else:
+            continue
+        logged = log_time(line, now)
+        if logged is None or logged <= now - window:
+            continue
+        # Count the errors logged in the same second together
+        logged = int(logged)
+        counts = errors.setdefault(drive_name(match.group(1)), {})
+        counts[logged] = counts.get(logged, 0) + 1
+    return dict((drive, sorted([t, n] for t, n in counts.items()))
+                for drive, counts in errors.items())
+
+
+def update_error_counts(state, errors, now, window=ERROR_WINDOW):
+    """
+    Add the errors found by a scan (see find_errors) to the rolling error
+    counts in state and drop counts older than window seconds
+
+    :returns: dict of drive: number of errors in the window
+    """
+    counts = state.get('errors', {})
+    for drive, logged in errors.items():
+        counts.setdefault(drive, []).extend(logged)
+    totals = {}
+    for drive in list(counts):
+        counts[drive] = [c for c in counts[drive] if c[0] > now - window]
+        if counts[drive]:
+            totals[drive] = sum(c[1] for c in counts[drive])
+        else:
+            del counts[drive]
+    state['errors'] = counts
+    return totals
 
 
-def check_errors():
+def check_errors(conf_file=None, state_file=None):
+    conf = load_config(conf_file)
+    state_file = state_file or STATE_FILE
+    state = load_json_state(state_file)
     try:
-        # TODO check that '/etc/swift/drive-audit.conf' exists and
-        # has log_to_console set
-        process = subprocess.Popen(
-            ['swift-drive-audit', '/etc/swift/drive-audit.conf'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        _, output = process.communicate()
+        lines = read_new_lines(conf['log_file'], state)
     except (OSError, IOError) as e:
         result = BASE_RESULT.child(dimensions={'error': str(e)})
         result.value = Severity.unknown
         return result
 
-    found_devs = get_devices(output)
+    now = time.time()
+    errors = find_errors(lines, conf['patterns'], now, conf['error_window'])
+    totals = update_error_counts(state, errors, now, conf['error_window'])
+    try:
+        save_json_state(state, state_file)
+    except (IOError, OSError):
+        # The next scan reads the same lines again
+        pass
+
+    found_devs = get_devices(conf['device_dir'], MOUNTS)
     if not found_devs:
         result = BASE_RESULT.child()
         # TODO maybe bump this up to a fail
@@ -87,12 +325,12 @@ def check_errors():
         return result
 
     results = []
-    error_devices = get_error_devices(output)
     for dev in found_devs:
         dimensions = dict(dev)
         result = BASE_RESULT.child(dimensions=dimensions)
-        if dev.get('kernel_device') in error_devices.keys():
-            # TODO might like to include error count in value_meta
+        error_count = totals.get(dev['kernel_device'])
+        if error_count:
+            result.value_meta['error_count'] = str(error_count)
             result.value = Severity.fail
         else:
             result.value = Severity.ok
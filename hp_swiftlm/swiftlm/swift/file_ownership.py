@@ -16,11 +16,25 @@
 #
 
 
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 import os
 import os.path
 import pwd
+import stat
+import time
 
-from swiftlm.utils.utility import server_type
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from swiftlm.utils.utility import (
+    load_json_state, save_json_state, server_type
+)
 from swiftlm.utils.metricdata import MetricData
 from swiftlm.utils.values import Severity, ServerType
 
@@ -28,6 +42,13 @@ SWIFT_DIR = '/etc/swift'
 CONF_DIR = '/etc'
 NODE_DIR = '/srv/node'
 
+# The deep audit of /srv/node persists how far it got on each drive here
+DEEP_AUDIT_CURSOR_FILE = '/var/cache/swiftlm/file_ownership_cursor.json'
+# Seconds each run of the deep audit may spend on a drive
+DEEP_AUDIT_BUDGET = 30.0
+# Ownership failures reported for each drive in a run, any more are counted
+DEEP_AUDIT_MAX_FAILURES = 100
+
 ZERO_BYTE_EXCLUDE = frozenset(['reload-trigger', 'swauth_to_tenant_map.gz'])
 SWIFT_OWNED_EXCLUDE = frozenset(['lost+found'])
 
@@ -48,9 +69,88 @@ def add_result(results, path, reason):
     results.add(c)
 
 
-def _is_swift_owned(results, p):
+class _DirEntry(object):
+    """ Stands in for os.DirEntry where scandir is not available """
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def _scandir(path):
+    if scandir is not None:
+        return scandir(path)
+    return (_DirEntry(path, name) for name in os.listdir(path))
+
+
+def walk_entries(path):
+    """
+    Walk the tree below path, following links to directories, in a single
+    pass
+
+    :returns: generator of (DirEntry, stat result of the entry or None if it
+              cannot be stat'ed, e.g. a broken link). The stat result is
+              cached by the DirEntry so each entry is only stat'ed once.
+    """
+    seen = set()
+    try:
+        st = os.stat(path)
+        seen.add((st.st_dev, st.st_ino))
+    except OSError:
+        pass
+    dirs = [path]
+    while dirs:
+        try:
+            entries = list(_scandir(dirs.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                yield entry, None
+                continue
+            yield entry, st
+            if stat.S_ISDIR(st.st_mode) and (st.st_dev, st.st_ino) not in seen:
+                # Guard against links that make a loop
+                seen.add((st.st_dev, st.st_ino))
+                dirs.append(entry.path)
+
+
+def _owner_name(uid, owners):
+    """
+    The user name of uid, looked up once per uid
+
+    :params owners: dict of uid: user name of the uids already looked up
+    """
+    try:
+        return owners[uid]
+    except KeyError:
+        try:
+            name = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            # A uid with no user
+            name = str(uid)
+        owners[uid] = name
+        return name
+
+
+def _is_swift_owned(results, p, st=None, owners=None):
     # True = good, False = bad
-    owner = pwd.getpwuid(os.stat(p).st_uid).pw_name
+    if st is None:
+        st = os.stat(p)
+    owner = _owner_name(st.st_uid, {} if owners is None else owners)
     if owner == 'swift':
         return True
     else:
@@ -59,47 +159,19 @@ def _is_swift_owned(results, p):
             return False
 
 
-def not_swift_owned():
-    results = set()
-    # Check /etc/swift and its children
-    p = SWIFT_DIR
-    if os.path.isdir(p):
-        for root, dirs, files in os.walk(p, followlinks=True):
-            for d in dirs:
-                x = os.path.join(root, d)
-                _is_swift_owned(results, x)
-            for f in files:
-                x = os.path.join(root, f)
-                _is_swift_owned(results, x)
-    else:
-        add_result(results, p, 'missing')
-
-    # Check all disk directories in /srv/node/
-    p = NODE_DIR
-    if os.path.isdir(p):
-        # We need to use topdown otherwise the directory tree is generated
-        # first, This would be unacceptably slow with large numbers or objects
-        for root, dirs, _ in os.walk(p, topdown=True):
-            for d in dirs:
-                x = os.path.join(root, d)
-                _is_swift_owned(results, x)
-
-            break   # We only want to check immediate child directories
-    else:
-        if server_type(ServerType.object):
-            # We only care that this directory is missing on object servers.
-            add_result(results, p, 'missing')
-    return results
-
-
-def _is_empty_file(results, p):
+def _is_empty_file(results, p, st=None):
     # True = bad, False = good
     # Should think of a way to make false = bad here to match _is_swift_owned
-    if not os.path.isfile(p):
+    if st is None:
+        if not os.path.isfile(p):
+            add_result(results, p, 'missing')
+            return True
+        st = os.stat(p)
+    elif not stat.S_ISREG(st.st_mode):
         add_result(results, p, 'missing')
         return True
 
-    if (os.stat(p).st_size == 0 and
+    if (st.st_size == 0 and
             os.path.basename(p) not in ZERO_BYTE_EXCLUDE):
         add_result(results, p, 'empty')
         return True
@@ -107,32 +179,292 @@ def _is_empty_file(results, p):
     return False
 
 
-def empty_files():
+def audit_swift_dir(results, ownership=True, empty=True, owners=None):
+    """
+    Check that everything below /etc/swift is owned by swift and that the
+    files in it are not empty, walking the tree once
+
+    :params results: set that failures are added to
+    :params ownership: check ownership
+    :params empty: check files are not empty
+    :params owners: dict of uid: user name, shared to look each uid up once
+    """
+    if not os.path.isdir(SWIFT_DIR):
+        add_result(results, SWIFT_DIR, 'missing')
+        return
+    if owners is None:
+        owners = {}
+
+    for entry, st in walk_entries(SWIFT_DIR):
+        if st is None:
+            # A broken link, os.walk takes it for a file
+            if empty:
+                add_result(results, entry.path, 'missing')
+            continue
+        if ownership:
+            _is_swift_owned(results, entry.path, st, owners)
+        if empty and not stat.S_ISDIR(st.st_mode):
+            _is_empty_file(results, entry.path, st)
+
+
+def audit_node_dir(results, owners=None):
+    """
+    Check that the disk directories in /srv/node are owned by swift
+    """
+    if not os.path.isdir(NODE_DIR):
+        if server_type(ServerType.object):
+            # We only care that this directory is missing on object servers.
+            add_result(results, NODE_DIR, 'missing')
+        return
+    if owners is None:
+        owners = {}
+
+    # Only the immediate child directories, walking the disks below them
+    # would be unacceptably slow with large numbers of objects
+    for entry in _scandir(NODE_DIR):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            _is_swift_owned(results, entry.path, st, owners)
+
+
+def not_swift_owned():
     results = set()
-    # Check individual files
+    owners = {}
+    audit_swift_dir(results, empty=False, owners=owners)
+    audit_node_dir(results, owners)
+    return results
+
+
+def _check_conf_files(results):
     if not server_type(ServerType.proxy):
         _is_empty_file(results, CONF_DIR + '/rsyncd.conf')
 
     _is_empty_file(results, CONF_DIR + '/rsyslog.conf')
 
-    # Check all children in /etc/swift
-    p = SWIFT_DIR
-    if os.path.isdir(p):
-        for root, _, files in os.walk(p, followlinks=True):
-            for f in files:
-                x = os.path.join(root, f)
-                _is_empty_file(results, x)
+
+def empty_files():
+    results = set()
+    _check_conf_files(results)
+    audit_swift_dir(results, ownership=False)
+    return results
+
+
+# Result of auditing one drive: partitions is the number of partitions on
+# the drive, cursor its updated cursor (see audit_drive) and failures the
+# paths found not to be owned by swift
+DriveAudit = namedtuple('DriveAudit', ['drive', 'partitions', 'cursor',
+                                       'failures', 'failure_count'])
+
+
+def list_partitions(drive_dir):
+    """
+    The partition directories of a drive
+
+    :returns: sorted list of partition paths relative to drive_dir, such as
+              'objects/1234'
+    """
+    partitions = []
+    try:
+        datadirs = os.listdir(drive_dir)
+    except OSError:
+        return partitions
+    for datadir in datadirs:
+        if not datadir.startswith(('accounts', 'containers', 'objects')):
+            continue
+        try:
+            names = os.listdir(os.path.join(drive_dir, datadir))
+        except OSError:
+            continue
+        partitions.extend(datadir + '/' + name for name in names
+                          if name.isdigit())
+    return sorted(partitions)
+
+
+def audit_drive(drive_dir, cursor, end, owners=None,
+                max_failures=DEEP_AUDIT_MAX_FAILURES):
+    """
+    Check the ownership of everything in the partitions of a drive, carrying
+    on from where the last audit of the drive stopped until end
+
+    A partition is audited one entry (suffix directory or file) at a time, a
+    partition that is not finished by end is carried on with from its next
+    entry. At least one entry is audited by each call, so a partition that
+    takes longer than the budget to walk does not stop the audit from
+    advancing.
+
+    :params cursor: dict of last: the last partition audited, audited: the
+                    number of partitions audited in this cycle through the
+                    drive and, if the partition after last was partly
+                    audited, partial: [partition, last entry audited]. Empty
+                    to start at the first partition.
+    :params end: time by which to stop
+    :params owners: dict of uid: user name, shared to look each uid up once
+    :returns: DriveAudit. When the audit reaches the last partition, the
+              cursor is reset so the next audit starts a new cycle.
+    """
+    if owners is None:
+        owners = {}
+    partitions = list_partitions(drive_dir)
+    last = cursor.get('last')
+    audited = cursor.get('audited', 0)
+    partial = cursor.get('partial')
+    todo = [p for p in partitions if last is None or p > last]
+    failures = []
+    failure_count = 0
+    progressed = False
+
+    def check(path, st):
+        if _owner_name(st.st_uid, owners) != 'swift':
+            if len(failures) < max_failures:
+                failures.append(path)
+            return 1
+        return 0
+
+    for partition in todo:
+        if time.time() >= end:
+            break
+        path = os.path.join(drive_dir, partition)
+        done = None
+        if partial and partial[0] == partition:
+            done = partial[1]
+        partial = None
+        try:
+            st = os.stat(path)
+            names = sorted(os.listdir(path))
+        except OSError:
+            # Removed by the replicator
+            continue
+        if done is None:
+            failure_count += check(path, st)
+        completed = True
+        for name in names:
+            if done is not None and name <= done:
+                continue
+            if time.time() >= end and progressed:
+                completed = False
+                break
+            entry_path = os.path.join(path, name)
+            try:
+                st = os.stat(entry_path)
+            except OSError:
+                continue
+            failure_count += check(entry_path, st)
+            if stat.S_ISDIR(st.st_mode):
+                for entry, st in walk_entries(entry_path):
+                    if st is not None:
+                        failure_count += check(entry.path, st)
+            done = name
+            progressed = True
+        if not completed:
+            # Carry on after the last entry audited next time
+            if done is not None:
+                partial = [partition, done]
+            break
+        last = partition
+        audited += 1
+        progressed = True
     else:
-        add_result(results, p, 'missing')
+        # The whole drive has been covered, start again next time
+        return DriveAudit(drive_dir, len(partitions), {}, failures,
+                          failure_count)
+
+    cursor = {'last': last, 'audited': audited}
+    if partial:
+        cursor['partial'] = partial
+    return DriveAudit(drive_dir, len(partitions), cursor, failures,
+                      failure_count)
+
+
+def load_cursors(path=DEEP_AUDIT_CURSOR_FILE):
+    return load_json_state(path)
+
+
+def save_cursors(cursors, path=DEEP_AUDIT_CURSOR_FILE):
+    save_json_state(cursors, path)
+
+
+def deep_audit(budget=DEEP_AUDIT_BUDGET, cursor_file=DEEP_AUDIT_CURSOR_FILE):
+    """
+    Check the ownership of the partitions on each drive in /srv/node, one
+    worker per drive, for at most budget seconds. Each run carries on from
+    where the last one stopped, so successive runs cover every partition.
+
+    Reports, for each drive, the fraction of its partitions covered in the
+    current cycle and the number of entries not owned by swift that were
+    found, as well as (up to DEEP_AUDIT_MAX_FAILURES of) those entries.
+    """
+    results = set()
+    if not os.path.isdir(NODE_DIR):
+        return results
+    drives = sorted(entry.path for entry in _scandir(NODE_DIR)
+                    if entry.is_dir())
+    if not drives:
+        return results
+
+    cursors = load_cursors(cursor_file)
+    end = time.time() + budget
+    owners = {}
+    pool = ThreadPool(len(drives))
+    try:
+        audits = pool.map(
+            lambda drive: audit_drive(
+                drive, cursors.get(os.path.basename(drive), {}), end,
+                owners, DEEP_AUDIT_MAX_FAILURES),
+            drives)
+    finally:
+        pool.close()
+        pool.join()
+
+    for audit in audits:
+        name = os.path.basename(audit.drive)
+        cursors[name] = audit.cursor
+        for path in audit.failures:
+            add_result(results, path, 'ownership')
+        if not audit.partitions:
+            continue
+        c = BASE_RESULT.child('deep_audit.coverage',
+                              dimensions={'path': audit.drive})
+        if audit.cursor:
+            c.value = round(min(
+                1.0, float(audit.cursor['audited']) / audit.partitions), 4)
+        else:
+            c.value = 1.0
+        results.add(c)
+        c = BASE_RESULT.child('deep_audit.failures',
+                              dimensions={'path': audit.drive})
+        c.value = audit.failure_count
+        results.add(c)
+
+    try:
+        save_cursors(cursors, cursor_file)
+    except (IOError, OSError):
+        # The next run starts again from the beginning
+        pass
     return results
 
 
 def main():
     """Check that swift owns its relevant files and directories."""
-    results = not_swift_owned()
-    results.update(empty_files())
+    results = set()
+    owners = {}
+    _check_conf_files(results)
+    # One pass of /etc/swift for both ownership and empty files
+    audit_swift_dir(results, owners=owners)
+    audit_node_dir(results, owners)
     return list(results)
 
 
+def deep_audit_main():
+    """Check that swift owns the partitions of its drives, in stages."""
+    return list(deep_audit())
+
+# Walking /srv/node takes up to DEEP_AUDIT_BUDGET, so the deep audit is not
+# part of a plain swiftlm-scan. It runs on the daemon's schedule.
+deep_audit_main.explicit = True
+
+
 if __name__ == "__main__":
     main()
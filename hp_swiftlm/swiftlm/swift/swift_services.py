@@ -16,11 +16,9 @@
 #
 
 
-import os
-import re
-
 from swiftlm.utils.utility import server_type
 from swiftlm.utils.metricdata import MetricData
+from swiftlm.utils.proc_table import ProcessTable
 from swiftlm.utils.values import Severity
 
 PROC_DIR = '/proc'
@@ -60,7 +58,7 @@ def services_to_check():
     return services
 
 
-def check_swift_processes():
+def check_swift_processes(processes=None):
     results = []
 
     services = services_to_check()
@@ -70,10 +68,13 @@ def check_swift_processes():
         c.value = Severity.unknown
         return c
 
+    if processes is None:
+        processes = ProcessTable.load(PROC_DIR)
+
     for service in services:
         c = BASE_RESULT.child(dimensions={'component': service})
 
-        if not is_service_running(service):
+        if not is_service_running(service, processes):
             c.value = Severity.fail
         else:
             c.value = Severity.ok
@@ -83,18 +84,40 @@ def check_swift_processes():
     return results
 
 
-def is_service_running(service):
-    for sub_directory in os.listdir(PROC_DIR):
-        if ((os.path.exists(os.path.join(PROC_DIR, sub_directory, "comm"))) and
-                (re.match("^[0-9]+", sub_directory))):
-            cmdline = os.path.join(PROC_DIR, sub_directory, "cmdline")
-            if "swift-" + service in open(cmdline, "r").read():
-                return True
+def is_service_running(service, processes=None):
+    if processes is None:
+        processes = ProcessTable.load(PROC_DIR)
+    return processes.is_running('swift-' + service)
+
+
+def check_process_stats(processes=None):
+    """
+    Report the resident memory and cpu time of the processes of each
+    service that is running
+    """
+    results = []
+    if processes is None:
+        processes = ProcessTable.load(PROC_DIR)
+
+    for service in services_to_check():
+        pids = processes.pids('swift-' + service)
+        if not pids:
+            continue
+        stats = processes.stats(pids)
+        for name, value in (('rss_bytes', stats.rss_bytes),
+                            ('cpu_seconds', round(stats.cpu_seconds, 2))):
+            c = BASE_RESULT.child(name, dimensions={'component': service})
+            c.value = value
+            results.append(c)
 
-    # Reach here if no matching process not found in /proc/cmdline
-    return False
+    return results
 
 
 def main():
     """Check that the relevant services are running."""
     return check_swift_processes()
+
+
+def process_stats_main():
+    """Report the memory and cpu use of the relevant services."""
+    return check_process_stats()
@@ -21,18 +21,31 @@ import grp
 import os
 import pwd
 import json
-import subprocess
+import time
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
+from swiftlm.utils.drive_inventory import unescape_label
 from swiftlm.utils.values import Severity
 from swiftlm.utils.metricdata import MetricData
-from swiftlm.utils.utility import run_cmd
+from swiftlm.utils.utility import run_cmd, load_json_state, save_json_state
 
 DEVICES = '/etc/ansible/facts.d/swift_drive_info.fact'
 MOUNT_PATH = '/srv/node/'
 LABEL_CHECK_DISABLED = '---NA---'
+MOUNTINFO = '/proc/self/mountinfo'
+BY_LABEL = '/dev/disk/by-label'
+
+# xfs_info is the only check that runs a command. A filesystem that passed
+# it is probed again after XFS_INFO_INTERVAL seconds, one that failed on
+# every scan. At most XFS_INFO_WORKERS probes run at once.
+XFS_INFO_STATE_FILE = '/var/cache/swiftlm/check_mounts_xfs_info.json'
+XFS_INFO_INTERVAL = 3600
+XFS_INFO_WORKERS = 8
 
 Device = namedtuple('Device', ['device', 'mount', 'label'])
+# An entry of the mount table
+Mount = namedtuple('Mount', ['source', 'fs_type', 'options'])
 
 
 def get_devices():
@@ -71,11 +84,112 @@ def get_devices():
     return devices
 
 
-def is_mounted(d, r):
-    return os.path.ismount(d.mount)
+def unescape_mount_path(path):
+    """
+    Undo the octal escaping (\\040 for a space) of a mountinfo path
+    """
+    if '\\' not in path:
+        return path
+    parts = path.split('\\')
+    unescaped = parts[0]
+    for part in parts[1:]:
+        try:
+            unescaped += chr(int(part[:3], 8)) + part[3:]
+        except ValueError:
+            unescaped += '\\' + part
+    return unescaped
+
+
+def parse_mountinfo_line(line):
+    """
+    Parse a line of /proc/<pid>/mountinfo, which looks like::
+
+        36 25 8:17 / /srv/node/disk0 rw,noatime shared:1 - xfs /dev/sdb1 rw
+
+    The optional fields (shared:1) end at the "-" separator.
+
+    :return: (mount point, Mount) or None for a line that cannot be parsed
+    """
+    fields = line.split()
+    try:
+        separator = fields.index('-', 6)
+        mount_point = unescape_mount_path(fields[4])
+        mount = Mount(source=unescape_mount_path(fields[separator + 2]),
+                      fs_type=fields[separator + 1],
+                      options=fields[5].split(','))
+    except (ValueError, IndexError):
+        return None
+    return mount_point, mount
+
+
+class MountTable(object):
+    """
+    The mounted filesystems, read from mountinfo in a single pass, and the
+    labels of the devices that have one
 
+    mounts is a dict of mount point: Mount and labels a dict of device
+    name (sdb1, dm-0): filesystem label.
+    """
 
-def is_mounted_775(d, r):
+    def __init__(self, mounts, labels):
+        self.mounts = mounts
+        self.labels = labels
+
+    @classmethod
+    def load(cls, mountinfo=None, by_label=None):
+        """
+        :return: a MountTable, empty if mountinfo cannot be read
+        """
+        mounts = {}
+        try:
+            with open(mountinfo or MOUNTINFO) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            lines = []
+        for line in lines:
+            entry = parse_mountinfo_line(line)
+            if entry is not None:
+                # A filesystem mounted over another one hides it, and
+                # comes later in the table
+                mounts[entry[0]] = entry[1]
+        return cls(mounts, cls._load_labels(by_label or BY_LABEL))
+
+    @staticmethod
+    def _load_labels(by_label):
+        labels = {}
+        try:
+            names = os.listdir(by_label)
+        except OSError:
+            return labels
+        for name in names:
+            try:
+                target = os.readlink(os.path.join(by_label, name))
+            except OSError:
+                continue
+            labels[os.path.basename(target)] = unescape_label(name)
+        return labels
+
+    def find(self, mount_point):
+        """
+        :return: the Mount at mount_point, None if nothing is mounted there
+        """
+        return self.mounts.get(os.path.normpath(mount_point))
+
+    def label(self, source):
+        """
+        :param source: a device, or a link to one such as /dev/mapper/<vol>
+        :return: the filesystem label of the device, None if it has none
+        """
+        return self.labels.get(os.path.basename(os.path.realpath(source)))
+
+
+def is_mounted(d, r, mounts=None):
+    if mounts is None:
+        return os.path.ismount(d.mount)
+    return mounts.find(d.mount) is not None
+
+
+def is_mounted_775(d, r, mounts=None):
     # Take the last three digits of the octal repr of the permissions.
     perms = oct(os.stat(d.mount).st_mode)[-3:]
     if perms == '755':
@@ -85,7 +199,7 @@ def is_mounted_775(d, r):
         return False
 
 
-def is_ug_swift(d, r):
+def is_ug_swift(d, r, mounts=None):
     """Checks mount point is owned by swift"""
     stats = os.stat(d.mount)
     uid = stats.st_uid
@@ -101,31 +215,85 @@ def is_ug_swift(d, r):
         return False
 
 
-def is_valid_label(d, r):
+def is_valid_label(d, r, mounts=None):
     if d.label == LABEL_CHECK_DISABLED:
         return True
 
-    rc = run_cmd('xfs_admin -l %s | grep -q %s' % (d.mount, d.label))
-    if rc.exitcode == 0:
-        return True
-    else:
-        return False
+    mounts = mounts or MountTable.load()
+    mount = mounts.find(d.mount)
+    return mount is not None and mounts.label(mount.source) == d.label
 
 
-def is_xfs(d, r):
-    rc = run_cmd('mount | grep -qE "%s.*xfs"' % d.mount)
-    if rc.exitcode == 0:
-        return True
-    else:
-        return False
+def is_xfs(d, r, mounts=None):
+    mount = (mounts or MountTable.load()).find(d.mount)
+    return mount is not None and mount.fs_type == 'xfs'
 
 
-def is_valid_xfs(d, r):
-    rc = run_cmd('xfs_info %s' % d.mount)
-    if rc.exitcode == 0:
-        return True
-    else:
-        return False
+def is_read_write(d, r, mounts=None):
+    mount = (mounts or MountTable.load()).find(d.mount)
+    return mount is not None and 'rw' in mount.options
+
+
+def run_xfs_info(mount_point):
+    return run_cmd('xfs_info %s' % mount_point).exitcode == 0
+
+
+def probe_xfs(devices, mounts, state_file=None, now=None):
+    """
+    Run xfs_info on the filesystems that are due a probe, in parallel
+
+    A result is kept in the state file with the device it was found for,
+    so a different device mounted in its place is probed straight away.
+
+    :param devices: the Devices to probe
+    :param mounts: MountTable
+    :return: dict of mount point: True if xfs_info succeeded
+    """
+    state_file = state_file or XFS_INFO_STATE_FILE
+    now = time.time() if now is None else now
+    state = load_json_state(state_file)
+    results = {}
+    due = []
+    for d in devices:
+        mount = mounts.find(d.mount)
+        source = mount.source if mount else d.device
+        last = state.get(d.mount)
+        if (last and last.get('source') == source and last.get('ok') and
+                now - last.get('time', 0) < XFS_INFO_INTERVAL):
+            results[d.mount] = True
+        else:
+            due.append((d.mount, source))
+
+    if due:
+        pool = ThreadPool(min(len(due), XFS_INFO_WORKERS))
+        try:
+            probed = pool.map(run_xfs_info, [m for m, _ in due])
+        finally:
+            pool.close()
+            pool.join()
+        for (mount_point, source), ok in zip(due, probed):
+            results[mount_point] = ok
+            state[mount_point] = {'source': source, 'ok': ok, 'time': now}
+
+    # Forget drives that are no longer checked
+    for mount_point in list(state):
+        if mount_point not in results:
+            del state[mount_point]
+    try:
+        save_json_state(state, state_file)
+    except (IOError, OSError):
+        # Everything is probed again on the next scan
+        pass
+    return results
+
+
+def is_valid_xfs(d, r, probed=None):
+    """
+    :param probed: results of probe_xfs, xfs_info is run for d if None
+    """
+    if probed is None:
+        return run_xfs_info(d.mount)
+    return probed.get(d.mount, False)
 
 
 BASE_RESULT = MetricData(
@@ -139,6 +307,7 @@ BASE_RESULT = MetricData(
         is_valid_label.__name__: ('{device} mounted at {mount} has invalid '
                                   'label {label}'),
         is_xfs.__name__: '{device} mounted at {mount} is not XFS',
+        is_read_write.__name__: '{device} mounted at {mount} is read-only',
         is_valid_xfs.__name__: '{device} mounted at {mount} is corrupt',
         'ok': '{device} mounted at {mount} ok',
         'no_devices': 'No devices found'
@@ -146,7 +315,11 @@ BASE_RESULT = MetricData(
 )
 
 
-def check_mounts():
+def check_mounts(state_file=None):
+    """
+    The mount table is read once for all the devices. The checks that
+    pass are followed by the xfs_info probe (see probe_xfs).
+    """
     results = []
     checks = (
         is_mounted,
@@ -154,7 +327,7 @@ def check_mounts():
         is_ug_swift,
         is_valid_label,
         is_xfs,
-        is_valid_xfs)
+        is_read_write)
 
     devices = get_devices()
     if not devices:
@@ -164,18 +337,28 @@ def check_mounts():
 
         return result
 
+    mounts = MountTable.load()
+    passed = []
     for d in devices:
         result = BASE_RESULT.child(dimensions=d.__dict__)
         for check in checks:
-            if not check(d, result):
+            if not check(d, result, mounts):
                 result.message = check.__name__
                 result.value = Severity.fail
                 break
         else:
-            result.value = Severity.ok
+            passed.append((d, result))
 
         results.append(result)
 
+    probed = probe_xfs([d for d, _ in passed], mounts, state_file)
+    for d, result in passed:
+        if is_valid_xfs(d, result, probed):
+            result.value = Severity.ok
+        else:
+            result.message = is_valid_xfs.__name__
+            result.value = Severity.fail
+
     return results
 
 
@@ -16,7 +16,11 @@
 #
 
 
-from threading import Thread, BoundedSemaphore
+import errno
+import math
+import select
+from threading import Condition, Thread
+import time
 import urlparse
 
 try:
@@ -25,7 +29,7 @@ except ImportError:
     import ConfigParser as configparser
 import os
 import socket
-from collections import namedtuple
+from collections import deque, namedtuple
 
 from swiftlm.utils.utility import (
     get_ring_hosts, server_type, UtilityExeception
@@ -52,6 +56,14 @@ BASE_RESULT = MetricData(
 )
 
 MAX_THREAD_LIMIT = 10
+# All the checks of a run must complete within this many seconds
+CHECK_DEADLINE = 10.0
+# Seconds to wait for a connection (and reply) to one target
+CONNECT_TIMEOUT = 10.0
+# Maximum number of sockets that probe() has open at once
+MAX_PROBE_SOCKETS = 512
+# Number of times check_all() probes each target to measure its latency
+PROBE_SAMPLES = 3
 SWIFT_PROXY_PATH = '/opt/stack/service/swift-proxy-server/etc'
 
 
@@ -83,40 +95,262 @@ class HostPort(namedtuple('HostPort', ['host', 'port'])):
                 return cls(*s.rsplit(':', 1))
 
 
-class CheckThread(Thread):
-    """ Threaded generic check """
-    def __init__(self, hostport, check_func, thread_limit, result):
+class CheckPool(object):
+    """
+    Runs checks on a fixed number of worker threads
+
+    Each (HostPort, check function) is only checked once however many times
+    it is added. All checks must complete by a deadline: checks that have
+    not started by then are cancelled and the result of any that are still
+    running is discarded.
+    """
+    def __init__(self, workers=MAX_THREAD_LIMIT):
+        self.workers = workers
+        self.pending = deque()
+        self.results = {}
+        self.cancelled = False
+        self.cond = Condition()
+
+    def add(self, hostport, check_func):
+        key = (hostport, check_func)
+        if key not in self.results:
+            self.results[key] = None
+            self.pending.append(key)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                if self.cancelled or not self.pending:
+                    return
+                hostport, check_func = key = self.pending.popleft()
+            try:
+                check_result = check_func(hostport)
+            except Exception as e:
+                check_result = (False, str(e))
+            with self.cond:
+                if not self.cancelled:
+                    self.results[key] = check_result
+                    self.cond.notify_all()
+
+    def _done(self):
+        return all(r is not None for r in self.results.values())
+
+    def run(self, deadline=CHECK_DEADLINE):
         """
-        :params hostport: HostPort to be passed to check_func.
-        :params check_func: function that accepts a HostPort, performs a check
-                            and returns a bool indicating success or failure.
-                            True is success, False is a failure
-        :params thread_limit: BoundedSemaphore for limiting number of active
-                              threads.
-        :params result: MetricData that will contain the results of the threads
-                        check.
+        Run the checks
+
+        :params deadline: seconds to wait for all the checks to complete
+        :returns: dict of (HostPort, check function): check result, where
+                  the result of a check that did not complete is None
         """
-        Thread.__init__(self)
-        self.thread_limit = thread_limit
-        self.check_func = check_func
-        self.hostport = hostport
-
-        self.result = result
-        self.result.name += '.' + check_func.__name__
-        self.result['hostname'] = hostport.host
-        self.result['target_port'] = hostport.port
-
-    def run(self):
-        self.thread_limit.acquire()
-        check_result = self.check_func(self.hostport)
-
-        if check_result[0]:
-            self.result.value = Severity.ok
+        end = time.time() + deadline
+        for _ in range(min(self.workers, len(self.pending))):
+            t = Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+
+        with self.cond:
+            while not self._done():
+                remaining = end - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            self.cancelled = True
+            return dict(self.results)
+
+
+# Result of probe(): ok is a bool, latencies the seconds taken by each
+# sample that succeeded and reason the failure message
+ProbeResult = namedtuple('ProbeResult', ['ok', 'latencies', 'reason'])
+
+# The probes of probe() and the check functions they replace
+CONNECT_PROBE = 'connect'
+MEMCACHE_PROBE = 'memcache'
+
+
+class _Probe(object):
+    """ The state of one probe """
+    def __init__(self, key, sock, start):
+        self.key = key
+        self.sock = sock
+        self.start = start
+        self.connected = False
+
+
+def _socket_error(err):
+    """ The message of a socket error, as raised by a blocking socket """
+    return str(socket.error(err, os.strerror(err)))
+
+
+def probe(targets, timeout=CONNECT_TIMEOUT, deadline=CHECK_DEADLINE,
+          max_sockets=MAX_PROBE_SOCKETS, samples=1):
+    """
+    Probe targets from this thread using non-blocking sockets
+
+    A connect probe connects to the target and its latency is the time taken
+    to connect. A memcache probe also sends a stats command and waits for
+    (the start of) the reply; its latency is the whole round trip.
+
+    Each target is probed samples times, one after the other. A target fails
+    as soon as one of its samples fails. A target that has succeeded at
+    least once when the deadline passes is ok, with the latencies sampled.
+
+    The address of each host and port is looked up once, before any probe
+    starts, as getaddrinfo() blocks. A target whose address cannot be found
+    fails with the lookup error.
+
+    :params targets: iterable of (HostPort, CONNECT_PROBE or MEMCACHE_PROBE)
+    :params timeout: seconds to wait for each sample
+    :params deadline: seconds to wait for all targets, after which probes
+                      that have not completed fail
+    :params max_sockets: maximum number of probes in progress at once
+    :params samples: number of times to probe each target
+    :returns: dict of (HostPort, probe): ProbeResult
+    """
+    end = time.time() + deadline
+    results = {}
+    latencies = {}
+    pending = deque()
+    addresses = {}
+    for key in targets:
+        if key in latencies:
+            continue
+        latencies[key] = []
+        hostport = key[0]
+        if hostport not in addresses:
+            try:
+                addresses[hostport] = socket.getaddrinfo(
+                    hostport.host, hostport.port, 0, socket.SOCK_STREAM)[0]
+            except socket.error as e:
+                addresses[hostport] = e
+        if isinstance(addresses[hostport], socket.error):
+            results[key] = ProbeResult(False, [], str(addresses[hostport]))
+        else:
+            pending.append(key)
+
+    poller = select.poll()
+    probes = {}
+
+    def incomplete(key, reason='timed out'):
+        if latencies[key]:
+            results[key] = ProbeResult(True, latencies[key], None)
         else:
-            self.result['fail_message'] = check_result[1]
-            self.result.value = Severity.fail
+            results[key] = ProbeResult(False, latencies[key], reason)
 
-        self.thread_limit.release()
+    def finish(p, ok, reason=None):
+        poller.unregister(p.sock.fileno())
+        del probes[p.sock.fileno()]
+        try:
+            p.sock.close()
+        except socket.error:
+            pass
+        if ok:
+            latencies[p.key].append(time.time() - p.start)
+            if len(latencies[p.key]) < samples:
+                pending.append(p.key)
+                return
+        results[p.key] = ProbeResult(ok, latencies[p.key], reason)
+
+    while pending or probes:
+        now = time.time()
+
+        # Start probes
+        while pending and len(probes) < max_sockets and now < end:
+            key = pending.popleft()
+            family, socktype, proto, _, address = addresses[key[0]]
+            try:
+                sock = socket.socket(family, socktype, proto)
+            except socket.error as e:
+                results[key] = ProbeResult(False, latencies[key], str(e))
+                continue
+            sock.setblocking(0)
+            # The latency and timeout of a probe run from its own connect
+            start = time.time()
+            err = sock.connect_ex(address)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                results[key] = ProbeResult(False, latencies[key],
+                                           _socket_error(err))
+                continue
+            probes[sock.fileno()] = _Probe(key, sock, start)
+            poller.register(sock, select.POLLOUT)
+
+        if not pending and not probes:
+            break
+        now = time.time()
+
+        # Time out probes
+        for p in list(probes.values()):
+            if now >= p.start + timeout:
+                finish(p, False, 'timed out')
+            elif now >= end:
+                finish(p, False, 'timed out')
+                incomplete(p.key)
+        if now >= end:
+            # Probes that were never started
+            for key in pending:
+                incomplete(key)
+            break
+        if not probes:
+            continue
+
+        wait = min(end, min(p.start + timeout for p in probes.values()))
+        for fd, event in poller.poll(max(0, wait - now) * 1000):
+            p = probes[fd]
+            if not p.connected:
+                # Connected, or failed to
+                err = p.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    finish(p, False, _socket_error(err))
+                    continue
+                p.connected = True
+                if p.key[1] != MEMCACHE_PROBE:
+                    finish(p, True)
+                    continue
+                try:
+                    p.sock.send(b'stats\n')
+                except socket.error as e:
+                    finish(p, False, str(e))
+                    continue
+                poller.modify(fd, select.POLLIN)
+            else:
+                # Reply to stats
+                try:
+                    p.sock.recv(1024)
+                except socket.error as e:
+                    finish(p, False, str(e))
+                    continue
+                finish(p, True)
+
+    return results
+
+
+def percentile(values, percent):
+    """
+    The nearest rank percentile of values
+
+    :params values: sorted list of numbers
+    :params percent: 0 - 100
+    """
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def latency_results(name, latencies, dimensions=None):
+    """
+    MetricData for the p50, p95 and max of latencies, in seconds, with the
+    statistic dimension telling them apart
+    """
+    values = sorted(latencies)
+    results = []
+    for statistic, value in (('p50', percentile(values, 50)),
+                             ('p95', percentile(values, 95)),
+                             ('max', values[-1])):
+        c = BASE_RESULT.child(name, dimensions)
+        c['statistic'] = statistic
+        c.value = round(value, 6)
+        results.append(c)
+    return results
 
 
 def connect_check(hp):
@@ -158,33 +392,121 @@ def ping_check(hp):
         return (False, "ping_check failed")
 
 
-def check(targets, check_func, results):
-    threads = []
-    thread_limit = BoundedSemaphore(value=MAX_THREAD_LIMIT)
+PROBES = {connect_check: CONNECT_PROBE, memcache_check: MEMCACHE_PROBE}
+
+
+def check_all(checks, results, deadline=CHECK_DEADLINE):
+    """
+    Run checks and add their results to results
+
+    :params checks: list of (targets, check_func) where targets is a list of
+                    HostPort and check_func a function that accepts a
+                    HostPort, performs a check and returns a tuple of a bool
+                    indicating success (True) or failure (False) and, on
+                    failure, the failure message.
+    :params results: list of MetricData that the results are added to, in
+                     the order of checks and targets. There is one result
+                     for each distinct target of a check.
+    :params deadline: seconds to wait for all the checks to complete. A check
+                      that has not completed by then fails.
+
+    Checks that have a probe (see PROBES) are run by probe(), which samples
+    each target PROBE_SAMPLES times. The p50, p95 and max of the samples are
+    added as a <check>.latency metric after the result of each target, and
+    of all the samples as a latency metric for this observer after all the
+    results. Any other checks run on a CheckPool.
+    """
+    end = time.time() + deadline
+    probe_targets = []
+    pool = CheckPool()
+    for targets, check_func in checks:
+        for target in targets:
+            if check_func in PROBES:
+                probe_targets.append((target, PROBES[check_func]))
+            else:
+                pool.add(target, check_func)
+    probe_results = probe(probe_targets, deadline=deadline,
+                          samples=PROBE_SAMPLES)
+    check_results = pool.run(max(0, end - time.time()))
+    all_latencies = []
+
+    for targets, check_func in checks:
+        if not targets:
+            c = BASE_RESULT.child()
+            c.name += '.' + check_func.__name__
+            c.value = Severity.warn
+            results.append(c)
+            continue
+
+        seen = set()
+        for target in targets:
+            if target in seen:
+                continue
+            seen.add(target)
+
+            c = BASE_RESULT.child()
+            c.name += '.' + check_func.__name__
+            c['hostname'] = target.host
+            c['target_port'] = target.port
+
+            latencies = []
+            if check_func in PROBES:
+                probe_result = probe_results[(target, PROBES[check_func])]
+                check_result = (probe_result.ok, probe_result.reason)
+                latencies = probe_result.latencies
+            else:
+                check_result = check_results[(target, check_func)]
 
-    if not targets:
-        c = BASE_RESULT.child()
-        c.name += '.' + check_func.__name__
-        c.value = Severity.warn
-        results.append(c)
-        return
+            if check_result is None:
+                c['fail_message'] = 'timed out'
+                c.value = Severity.fail
+            elif check_result[0]:
+                c.value = Severity.ok
+            else:
+                c['fail_message'] = check_result[1]
+                c.value = Severity.fail
+            results.append(c)
 
-    for target in targets:
-        t = CheckThread(target, check_func, thread_limit, BASE_RESULT.child())
-        t.start()
-        threads.append(t)
+            if latencies:
+                all_latencies.extend(latencies)
+                results.extend(latency_results(
+                    check_func.__name__ + '.latency', latencies,
+                    {'hostname': target.host, 'target_port': target.port}))
 
-    for t in threads:
-        t.join(10.0)
-        if t.isAlive():
-            t.result.value = Severity.fail
+    if all_latencies:
+        results.extend(latency_results('latency', all_latencies))
 
-        results.append(t.result)
+
+def check(targets, check_func, results):
+    check_all([(targets, check_func)], results)
+
+
+def get_ring_targets():
+    """
+    The distinct (ip, port) of the devices in the rings as HostPorts, an
+    empty list if the rings cannot be loaded
+    """
+    try:
+        devices = get_ring_hosts(ring_type=None)
+    except Exception:  # noqa
+        # may be some problem loading ring files, but not concern of this
+        # check to diagnose any further.
+        return []
+
+    targets = []
+    seen = set()
+    for device in devices:
+        target = HostPort(device.ip, str(device.port))
+        if target not in seen:
+            targets.append(target)
+            seen.add(target)
+    return targets
 
 
 def main():
     """Checks connectivity to memcache and object servers."""
     results = []
+    checks = []
 
     if server_type(ServerType.proxy):
         cp = configparser.ConfigParser()
@@ -198,7 +520,7 @@ def main():
         except configparser.NoSectionError:
             memcache_servers = []
 
-        check(memcache_servers, memcache_check, results)
+        checks.append((memcache_servers, memcache_check))
 
         try:
             # Remove the version api path.
@@ -208,26 +530,11 @@ def main():
         except configparser.NoSectionError:
             endpoint_servers = []
 
-        check(endpoint_servers, connect_check, results)
-
-    # TODO -- rewrite this as a connect_check
-    # try:
-    #     ping_targets = []
-    #     devices = get_ring_hosts(ring_type=None)
-    #     ip_set = set()
-    #
-    #     for device in devices:
-    #         if device.ip not in ip_set:
-    #             # Port not relevant for ping_check. (Empty string is an
-    #             # invalid dimension value, Hence '_' used for target_port)
-    #             ping_targets.append(HostPort(device.ip, '_'))
-    #             ip_set.add(device.ip)
-    #
-    # except Exception:  # noqa
-    #   # may be some problem loading ring files, but not concern of this check
-    #     # to diagnose any further.
-    #     pass
-    #
-    # check(ping_targets, ping_check, results)
+        checks.append((endpoint_servers, connect_check))
+
+    checks.append((get_ring_targets(), connect_check))
+
+    # All checks share one pool of workers and one deadline
+    check_all(checks, results)
 
     return results
@@ -0,0 +1,266 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Inventory of the block devices of a node, read from sysfs and the udev
+database rather than by running parted, blockdev, xfs_admin or dmidecode
+for each device.
+
+/sys/block has a directory for each drive (and device mapper volume) with
+its size in 512 byte sectors and its major:minor number. A partition is a
+sub-directory of its drive that has a partition file holding its number.
+udev keeps the properties it found for a device (filesystem type and label,
+partition table type, partition name and type) in /run/udev/data/b<dev>.
+/dev/disk/by-label is used for the filesystem label of a device that udev
+has no data for.
+"""
+
+import os
+
+SYS_BLOCK = '/sys/block'
+UDEV_DATA = '/run/udev/data'
+DEV_DIR = '/dev'
+DMI_PRODUCT_NAME = '/sys/class/dmi/id/product_name'
+SECTOR_SIZE = 512
+
+# Partition types that parted shows as flags
+ESP_TYPE = 'c12a7328-f81f-11d2-ba4b-00a0c93ec93b'
+BIOS_GRUB_TYPE = '21686148-6449-6e6f-744e-656564454649'
+MSDOS_BOOT_FLAG = 0x80
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def read_udev_data(path):
+    """
+    Read the properties (E: lines) of a udev database entry
+
+    :return: dict of properties, None if there is no entry
+    """
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return None
+    properties = {}
+    for line in lines:
+        if line.startswith('E:'):
+            key, _, value = line[2:].partition('=')
+            properties[key] = value
+    return properties
+
+
+def unescape_label(name):
+    """
+    Undo the \\xNN escaping of a /dev/disk/by-label entry
+    """
+    if '\\x' not in name:
+        return name
+    parts = name.split('\\x')
+    label = parts[0]
+    for part in parts[1:]:
+        try:
+            label += chr(int(part[:2], 16)) + part[2:]
+        except ValueError:
+            label += '\\x' + part
+    return label
+
+
+class BlockDevice(object):
+    """
+    A drive, partition or device mapper volume
+
+    udev is True if the udev database had an entry for the device. Without
+    one, fs_type, part_table_type and part_name are unknown (None).
+    """
+
+    def __init__(self, name, size, dev, number=None, parent=None):
+        self.name = name
+        self.path = os.path.join(DEV_DIR, name.replace('!', '/'))
+        self.size = size
+        self.dev = dev
+        self.number = number
+        self.parent = parent
+        self.partitions = []
+        self.udev = False
+        self.fs_type = None
+        self.fs_label = None
+        self.part_table_type = None
+        self.part_name = None
+        self.part_type = None
+        self.part_flags = None
+
+    def __repr__(self):
+        return '<BlockDevice %s>' % self.path
+
+    def load_udev(self, properties):
+        self.udev = True
+        self.fs_type = properties.get('ID_FS_TYPE') or None
+        self.fs_label = properties.get('ID_FS_LABEL') or self.fs_label
+        self.part_table_type = properties.get('ID_PART_TABLE_TYPE') or None
+        self.part_name = properties.get('ID_PART_ENTRY_NAME') or None
+        self.part_type = properties.get('ID_PART_ENTRY_TYPE') or None
+        self.part_flags = properties.get('ID_PART_ENTRY_FLAGS') or None
+
+    @property
+    def size_bytes(self):
+        return self.size * SECTOR_SIZE
+
+    @property
+    def has_label(self):
+        """
+        True if parted would find a disk label (partition table) or
+        filesystem on the drive
+        """
+        return bool(self.part_table_type or self.fs_type or self.partitions)
+
+    def flags(self):
+        """
+        The flags parted shows for a partition
+        """
+        flags = []
+        part_type = (self.part_type or '').lower()
+        if part_type == ESP_TYPE:
+            flags.extend(['boot', 'esp'])
+        elif part_type == BIOS_GRUB_TYPE:
+            flags.append('bios_grub')
+        if self.part_flags and self.parent and \
+                self.parent.part_table_type == 'dos':
+            try:
+                if int(self.part_flags, 16) & MSDOS_BOOT_FLAG:
+                    flags.append('boot')
+            except ValueError:
+                pass
+        return flags
+
+
+class DriveInventory(object):
+    """
+    The block devices of a node
+
+    Devices are looked up by their path in /dev (or a link to it such as a
+    logical volume path).
+    """
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.by_name = dict((device.name, device) for device in devices)
+
+    @classmethod
+    def load(cls, sys_block=SYS_BLOCK, udev_data=UDEV_DATA,
+             by_label=os.path.join(DEV_DIR, 'disk', 'by-label')):
+        """
+        Read the inventory of the node
+
+        :return: a DriveInventory, which is empty if sysfs is not available
+        """
+        devices = []
+        try:
+            names = sorted(os.listdir(sys_block))
+        except OSError:
+            names = []
+        for name in names:
+            drive = cls._load_device(os.path.join(sys_block, name), name)
+            if drive is None:
+                continue
+            devices.append(drive)
+            try:
+                entries = sorted(os.listdir(os.path.join(sys_block, name)))
+            except OSError:
+                entries = []
+            for entry in entries:
+                part_dir = os.path.join(sys_block, name, entry)
+                number = read_file(os.path.join(part_dir, 'partition'))
+                if number is None or not number.isdigit():
+                    continue
+                partition = cls._load_device(part_dir, entry, int(number),
+                                             drive)
+                if partition is not None:
+                    drive.partitions.append(partition)
+                    devices.append(partition)
+            drive.partitions.sort(key=lambda p: p.number)
+
+        inventory = cls(devices)
+        for device in devices:
+            properties = read_udev_data(os.path.join(udev_data,
+                                                     'b' + device.dev))
+            if properties is not None:
+                device.load_udev(properties)
+        inventory._load_labels(by_label)
+        return inventory
+
+    @staticmethod
+    def _load_device(path, name, number=None, parent=None):
+        size = read_file(os.path.join(path, 'size'))
+        dev = read_file(os.path.join(path, 'dev'))
+        if size is None or not size.isdigit() or not dev:
+            return None
+        return BlockDevice(name, int(size), dev, number, parent)
+
+    def _load_labels(self, by_label):
+        try:
+            labels = os.listdir(by_label)
+        except OSError:
+            return
+        for label in labels:
+            try:
+                target = os.readlink(os.path.join(by_label, label))
+            except OSError:
+                continue
+            device = self.by_name.get(os.path.basename(target))
+            if device is not None and not device.fs_label:
+                device.fs_label = unescape_label(label)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def find(self, path):
+        """
+        Get the device at path
+
+        :return: a BlockDevice or None if the device is not in the inventory
+        """
+        name = os.path.basename(os.path.realpath(path))
+        device = self.by_name.get(name)
+        if device is None:
+            # cciss!c0d0 is /dev/cciss/c0d0
+            device = self.by_name.get(
+                os.path.relpath(path, DEV_DIR).replace('/', '!'))
+        return device
+
+    def forget(self, path):
+        """
+        Drop a drive (and its partitions) whose partition table has changed,
+        so that it is no longer found
+        """
+        device = self.find(path)
+        if device is None:
+            return
+        for forgotten in [device] + device.partitions:
+            self.by_name.pop(forgotten.name, None)
+
+
+def get_product_name(path=DMI_PRODUCT_NAME):
+    """
+    The product name of the node (as shown by dmidecode -s
+    system-product-name), None if not available
+    """
+    return read_file(path) or None
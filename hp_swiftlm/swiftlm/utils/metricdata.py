@@ -48,6 +48,8 @@ class MetricData(object):
             self.dimensions = dimensions
 
         self.messages = messages
+        # Entries of value_meta besides the message
+        self.value_meta = {}
         self.timestamp()
 
         self._message = ''
@@ -133,12 +135,15 @@ class MetricData(object):
             'timestamp': self._timestamp,
         }
 
+        value_meta = dict(self.value_meta)
         msg = str(self)
         if msg != '':
             # Msg must be under 2048 characters
             if len(msg) > 2047:
                 msg = msg[:2044] + '...'
-            metric['value_meta'] = {'msg': msg}
+            value_meta['msg'] = msg
+        if value_meta:
+            metric['value_meta'] = value_meta
 
         return metric
 
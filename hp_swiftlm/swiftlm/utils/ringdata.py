@@ -32,8 +32,15 @@ limitations under the License.
 
 
 import array
+from collections import defaultdict
+import errno
 import json
+import mmap
+import operator
+import os
 import struct
+import sys
+import tempfile
 from gzip import GzipFile
 from io import BufferedReader
 
@@ -42,6 +49,27 @@ try:
 except ImportError:
     import pickle
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Sidecar files written by RingData.load when given a cache_dir hold the
+# decompressed ring: the magic, the length of a json header, the json header
+# and then, aligned to CACHE_ALIGN bytes, the replica2part2dev_id tables.
+CACHE_MAGIC = b'SWLMRC01'
+CACHE_ALIGN = 8
+
+# Failure domains used by RingIndex, from widest to narrowest. Each maps a
+# device dict to the key of the tier it belongs to.
+TIERS = (
+    ('region', lambda dev: (dev['region'],)),
+    ('zone', lambda dev: (dev['region'], dev['zone'])),
+    ('server', lambda dev: (dev['region'], dev['zone'], dev['ip'])),
+    ('device', lambda dev: (dev['region'], dev['zone'], dev['ip'],
+                            dev['id'])),
+)
+
 
 class RingData(object):
     """Partitioned consistent hashing ring data (used for serialization)."""
@@ -64,13 +92,19 @@ class RingData(object):
         return ring_dict
 
     @classmethod
-    def load(cls, filename):
+    def load(cls, filename, cache_dir=None):
         """
         Load ring data from a file.
 
         :param filename: Path to a file serialized by the save() method.
+        :param cache_dir: If given the ring is decompressed once into a
+                          sidecar file in cache_dir, which later loads map
+                          into memory while the ring file is unchanged.
         :returns: A RingData instance containing the loaded data.
         """
+        if cache_dir is not None:
+            return cls.load_cached(filename, cache_dir)
+
         gz_file = GzipFile(filename, 'rb')
         # Python 2.6 GzipFile doesn't support BufferedIO
         if hasattr(gz_file, '_checkReadable'):
@@ -98,3 +132,277 @@ class RingData(object):
                 ring_data['part_shift']
             )
         return ring_data
+
+    @staticmethod
+    def cache_path(filename, cache_dir):
+        name = os.path.basename(filename)
+        if name.endswith('.gz'):
+            name = name[:-3]
+        return os.path.join(cache_dir, name + '.raw')
+
+    @classmethod
+    def load_cached(cls, filename, cache_dir):
+        """
+        Load ring data through a decompressed sidecar file in cache_dir.
+
+        The sidecar is rebuilt when the mtime or size of the ring file no
+        longer match those it was built from. The replica2part2dev_id tables
+        of a ring loaded from the sidecar share the memory map of the file
+        where possible (numpy arrays or, on python 3, memoryviews) rather
+        than being read into memory. Any problem with the cache falls back
+        to loading the ring file directly.
+        """
+        st = os.stat(filename)
+        path = cls.cache_path(filename, cache_dir)
+        try:
+            ring_data = cls._read_cache(path, st)
+            if ring_data is not None:
+                return ring_data
+        except (IOError, OSError, ValueError, struct.error):
+            pass
+
+        ring_data = cls.load(filename)
+        try:
+            cls._write_cache(path, st, ring_data)
+        except (IOError, OSError):
+            pass
+        return ring_data
+
+    @staticmethod
+    def _read_cache(path, st):
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        ring_data = None
+        try:
+            ring_data = RingData._map_cache(path, st, mm)
+        finally:
+            # The tables of the ring data share the mapping, so it is only
+            # closed if the cache is not used
+            if ring_data is None:
+                mm.close()
+        return ring_data
+
+    @staticmethod
+    def _map_cache(path, st, mm):
+        if mm[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            return None
+        offset = len(CACHE_MAGIC)
+        header_len, = struct.unpack('!I', mm[offset:offset + 4])
+        offset += 4
+        header = json.loads(mm[offset:offset + header_len].decode('utf-8'))
+        offset += header_len
+        if (header['mtime'] != st.st_mtime or header['size'] != st.st_size or
+                header['byteorder'] != sys.byteorder):
+            return None
+
+        offset += -offset % CACHE_ALIGN
+        # Check the length before any table shares the mapping, so that it
+        # can still be closed
+        if offset + sum(header['lengths']) * 2 > len(mm):
+            raise ValueError('Truncated ring cache %s' % path)
+        tables = []
+        for length in header['lengths']:
+            if numpy is not None:
+                table = numpy.frombuffer(mm, dtype=numpy.uint16,
+                                         count=length, offset=offset)
+            elif hasattr(memoryview, 'cast'):
+                table = memoryview(mm)[offset:offset + length * 2].cast('H')
+            else:
+                table = array.array('H', mm[offset:offset + length * 2])
+            tables.append(table)
+            offset += length * 2
+        return RingData(tables, header['devs'], header['part_shift'])
+
+    @staticmethod
+    def _write_cache(path, st, ring_data):
+        cache_dir = os.path.dirname(path)
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        tables = [array.array('H', t) if not isinstance(t, array.array)
+                  else t for t in ring_data._replica2part2dev_id]
+        header = json.dumps({
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'byteorder': sys.byteorder,
+            'part_shift': ring_data._part_shift,
+            'devs': ring_data.devs,
+            'lengths': [len(t) for t in tables],
+        }).encode('utf-8')
+        offset = len(CACHE_MAGIC) + 4 + len(header)
+
+        # Write to a temporary file and rename it so that readers never see
+        # a partially written cache.
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(CACHE_MAGIC)
+                f.write(struct.pack('!I', len(header)))
+                f.write(header)
+                f.write(b'\0' * (-offset % CACHE_ALIGN))
+                for t in tables:
+                    t.tofile(f)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class RingIndex(object):
+    """
+    Query layer over the partition assignment of a loaded ring.
+
+    The replica to partition to device tables are processed with bulk
+    operations using numpy when it is installed. Without numpy, dispersion
+    maps builtins over the tables and dev_part_counts loops over every
+    partition replica in python, which is much slower for large rings.
+    Partition counts are computed when first needed and then cached.
+    """
+
+    def __init__(self, ring_data):
+        self.ring_data = ring_data
+        self.devs = ring_data.devs
+        self.replica2part2dev_id = ring_data._replica2part2dev_id
+        self.part_count = 1 << (32 - ring_data._part_shift)
+        self._dev_part_counts = None
+
+    @property
+    def replica_count(self):
+        """Number of replicas, including any fractional replica."""
+        return sum(len(p2d) for p2d in self.replica2part2dev_id) / float(
+            self.part_count)
+
+    def get_part_devices(self, part):
+        """
+        :returns: list of the device dicts holding replicas of a partition
+        """
+        return [self.devs[p2d[part]] for p2d in self.replica2part2dev_id
+                if part < len(p2d)]
+
+    def dev_part_counts(self):
+        """
+        :returns: list of the number of partition replicas assigned to each
+                  device, indexed by device id
+        """
+        if self._dev_part_counts is not None:
+            return self._dev_part_counts
+
+        dev_count = len(self.devs)
+        if numpy is not None:
+            counts = numpy.zeros(dev_count, dtype=numpy.int64)
+            for p2d in self.replica2part2dev_id:
+                ids = numpy.frombuffer(p2d, dtype=numpy.uint16)
+                counts += numpy.bincount(ids, minlength=dev_count)[:dev_count]
+            counts = counts.tolist()
+        else:
+            # A plain loop, since collections.Counter (which loops in python
+            # on python 2) and sorting were both measured to be slower.
+            counts = [0] * dev_count
+            for p2d in self.replica2part2dev_id:
+                for dev_id in p2d:
+                    counts[dev_id] += 1
+        self._dev_part_counts = counts
+        return counts
+
+    def _weights(self):
+        return [dev['weight'] if dev else 0 for dev in self.devs]
+
+    def dev_balance(self):
+        """
+        How far the number of partitions assigned to each device is from
+        the number its weight calls for, as a percentage.
+
+        :returns: dict of device id to balance
+        """
+        counts = self.dev_part_counts()
+        weights = self._weights()
+        total_weight = float(sum(weights))
+        total_parts = sum(len(p2d) for p2d in self.replica2part2dev_id)
+        balance = {}
+        for dev in self.devs:
+            if not dev or not dev['weight']:
+                continue
+            desired = total_parts * dev['weight'] / total_weight
+            balance[dev['id']] = 100.0 * (counts[dev['id']] - desired) / \
+                desired
+        return balance
+
+    def tier_part_counts(self, tier='zone'):
+        """
+        :param tier: one of 'region', 'zone', 'server' or 'device'
+        :returns: dict of tier key to the number of partition replicas
+                  assigned to it
+        """
+        tier_key = dict(TIERS)[tier]
+        counts = self.dev_part_counts()
+        tier_counts = defaultdict(int)
+        for dev in self.devs:
+            if dev:
+                tier_counts[tier_key(dev)] += counts[dev['id']]
+        return dict(tier_counts)
+
+    def tier_balance(self, tier='zone'):
+        """
+        :returns: dict of tier key to the percentage by which its partition
+                  count differs from its share of the ring weight
+        """
+        tier_key = dict(TIERS)[tier]
+        counts = self.tier_part_counts(tier)
+        weights = defaultdict(float)
+        for dev in self.devs:
+            if dev:
+                weights[tier_key(dev)] += dev['weight']
+        total_weight = sum(weights.values())
+        total_parts = sum(counts.values())
+        balance = {}
+        for key, weight in weights.items():
+            if weight:
+                desired = total_parts * weight / total_weight
+                balance[key] = 100.0 * (counts[key] - desired) / desired
+        return balance
+
+    def _tier_ids(self, tier):
+        # Map each device id to a small integer that identifies its tier
+        tier_key = dict(TIERS)[tier]
+        ids = {}
+        dev_tier = []
+        for dev in self.devs:
+            if dev:
+                dev_tier.append(ids.setdefault(tier_key(dev), len(ids)))
+            else:
+                dev_tier.append(-1)
+        return dev_tier
+
+    def dispersion(self, tier='zone'):
+        """
+        Count partitions that have more than one replica in the same tier.
+
+        :param tier: one of 'region', 'zone', 'server' or 'device'
+        :returns: tuple of (number of partitions, percentage of partitions)
+        """
+        dev_tier = self._tier_ids(tier)
+        tables = self.replica2part2dev_id
+        if numpy is not None:
+            lookup = numpy.array(dev_tier, dtype=numpy.int64)
+            tiers = [lookup[numpy.frombuffer(p2d, dtype=numpy.uint16)]
+                     for p2d in tables]
+            shared = numpy.zeros(self.part_count, dtype=bool)
+            for i in range(len(tiers)):
+                for j in range(i + 1, len(tiers)):
+                    n = min(len(tiers[i]), len(tiers[j]))
+                    shared[:n] |= tiers[i][:n] == tiers[j][:n]
+            count = int(shared.sum())
+        else:
+            tiers = [list(map(dev_tier.__getitem__, p2d)) for p2d in tables]
+            shared = [False] * self.part_count
+            for i in range(len(tiers)):
+                for j in range(i + 1, len(tiers)):
+                    # A fractional replica covers fewer partitions
+                    n = min(len(tiers[i]), len(tiers[j]))
+                    same = map(operator.eq, tiers[i][:n], tiers[j][:n])
+                    shared[:n] = map(operator.or_, shared[:n], same)
+            count = sum(shared)
+        return count, 100.0 * count / self.part_count
@@ -27,27 +27,40 @@ import glob
 import os.path
 from collections import namedtuple
 
-from swiftlm.utils.ringdata import RingData
+from swiftlm.utils.ringdata import RingData, RingIndex
 from swiftlm.utils.values import ServerType
 from swiftlm.utils import SWIFT_PATH, PROXY_PATH, ACCOUNT_PATH, \
-    CONTAINER_PATH, OBJECT_PATH
+    CONTAINER_PATH, OBJECT_PATH, RING_CACHE_PATH
 
 import logging
 import syslog
 import signal
 import time
 import fcntl
+import array
+import binascii
+import socket
+import struct
 from contextlib import contextmanager
 import errno
 import json
+import tempfile
 
 import datetime
 import ConfigParser
 
 swiftlm_scan_conf = "/etc/swiftlm/swiftlm-scan.conf"
+IF_INET6 = '/proc/net/if_inet6'
 
-# namedtuple for use with the results from RingData.devs
-RingDeviceEntry = namedtuple('RingDeviceEntry', ['ip', 'port', 'device'])
+SIOCGIFCONF = 0x8912
+# struct ifreq is the interface name followed by a union, the largest
+# member of which is a struct ifmap (or a 16 byte struct sockaddr)
+IFREQ_SIZE = 16 + max(16, struct.calcsize('LLHBBB0L'))
+
+# namedtuple for use with the results from RingData.devs, parts is the
+# number of partition replicas assigned to the device
+RingDeviceEntry = namedtuple('RingDeviceEntry',
+                             ['ip', 'port', 'device', 'parts'])
 # More descriptive wrapper around the results of run_command
 CommandResult = namedtuple('CommandResult', ['exitcode', 'output'])
 
@@ -174,38 +187,72 @@ def get_swift_bind_ips(interface=None):
     return bind_ips
 
 
+def _ipv4_addresses(max_interfaces=1024):
+    """
+    The IPv4 addresses of the interfaces, from a SIOCGIFCONF ioctl
+
+    :returns: list of (interface, ip), an alias address has the name of
+              its label, such as eth0:1
+    """
+    buf = array.array('B', b'\0' * (IFREQ_SIZE * max_interfaces))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifconf = fcntl.ioctl(sock.fileno(), SIOCGIFCONF,
+                             struct.pack('iP', len(buf),
+                                         buf.buffer_info()[0]))
+    finally:
+        sock.close()
+    length = struct.unpack('iP', ifconf)[0]
+    data = buf.tostring()[:length]
+    addresses = []
+    for offset in range(0, length, IFREQ_SIZE):
+        name = data[offset:offset + 16].split(b'\0', 1)[0]
+        # ifr_addr is a sockaddr_in: family, port then the address
+        ip = socket.inet_ntoa(data[offset + 20:offset + 24])
+        addresses.append((name, ip))
+    return addresses
+
+
+def _ipv6_addresses(path=None):
+    """
+    The IPv6 addresses of the interfaces, from /proc/net/if_inet6
+
+    :returns: list of (interface, ip)
+    """
+    addresses = []
+    try:
+        with open(path or IF_INET6) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return addresses
+    for line in lines:
+        # address index prefix-length scope flags interface
+        fields = line.split()
+        if len(fields) != 6 or len(fields[0]) != 32:
+            continue
+        try:
+            packed = binascii.unhexlify(fields[0])
+        except (TypeError, ValueError):
+            continue
+        addresses.append((fields[5],
+                          socket.inet_ntop(socket.AF_INET6, packed)))
+    return addresses
+
+
 def ip_to_interface():
     """
-    Obtain an ip to interface map by parsing netstat -ie output.
+    Obtain an ip to interface map from the addresses the kernel reports
+    (without running netstat).
 
     :returns: dictionary of ip to interface mapping
     """
-    # netstat -ie produces...
-    # Kernel Interface table <not needed>
-    # br-eth1 Link encap:Ethernet HWaddr ca:7f:53:3f:26:4e
-    #         inet addr:192.168.245.3 Bcast:192.168.245.15 Mask:255.255.255.240
-    #         <not needed text>
-    #
-    # eth0   Link encap:Ethernet HWaddr 52:54:00:e3:c8:56
-    #        inet addr:192.168.121.171 Bcast:192.168.121.255 Mask:255.255.255.0
-    #        <not needed text>
-    netstat_string = commands_wrapper.getoutput("/bin/netstat -ie")
-    netstat_lines = (netstat_string.split('\n', 1)[1]).split('\n')
     ip_to_interface_map = dict()
-    next_interface = True
-
-    for line in netstat_lines:
-        words = line.split()
-        if next_interface:
-            interface_name = words[0]
-            next_interface = False
-        if not line:
-            # Blank line. Next line (if present) will be the next interface.
-            next_interface = True
-        elif words[0] == 'inet':
-            ip_address = words[1].split(':')[1]
-            ip_to_interface_map[ip_address] = interface_name
-
+    try:
+        addresses = _ipv4_addresses()
+    except (IOError, OSError):
+        addresses = []
+    for interface_name, ip_address in addresses + _ipv6_addresses():
+        ip_to_interface_map[ip_address] = interface_name
     return ip_to_interface_map
 
 
@@ -232,11 +279,17 @@ def get_ring_hosts(ring_type=None):
 
     for r in ring_files:
         r = os.path.join(SWIFT_PATH, r)
-        rd = RingData.load(r)
-        for device in rd.devs:
+        rd = RingData.load(r, cache_dir=RING_CACHE_PATH)
+        part_counts = RingIndex(rd).dev_part_counts()
+        # The devices are indexed by their id
+        for dev_id, device in enumerate(rd.devs):
+            if device is None:
+                # A removed device
+                continue
             ring_data.append(
                 RingDeviceEntry(
-                    device['ip'], device['port'], device['device']))
+                    device['ip'], device['port'], device['device'],
+                    part_counts[dev_id]))
 
     return ring_data
 
@@ -394,6 +447,40 @@ def get_swiftlm_uptime_mon_data(uptime_stats_file, logger, openr=open):
         logger.exception('Error parsing swiftlm uptime mon cache file')
 
 
+def load_json_state(path):
+    """
+    Load state persisted by save_json_state
+
+    :returns: the state dict, empty if there is none or it cannot be read
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_json_state(state, path):
+    """
+    Persist state (a dict) as json, replacing the file at path in one step
+    so that a reader never sees it partly written
+
+    :raises IOError, OSError: if the state cannot be written
+    """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        os.unlink(tmp_path)
+        raise
+
+
 def timestamp(dt=None,
               epoch=datetime.datetime(1970, 1, 1),
               allow_microseconds=False):
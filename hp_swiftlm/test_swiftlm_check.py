@@ -23,14 +23,15 @@ import unittest
 import fcntl
 import errno
 import mock
+import threading
 import time
 
+from swiftlm.cli import scan_daemon
 from swiftlm.swift import file_ownership, swift_services
 from swiftlm.utils import utility
 from swiftlm.utils.values import ServerType
 from tests import (create_valid_proxy_fileset, create_valid_non_proxy_fileset,
                    create_fake_process_entries, FakeLogger)
-from tests.data import drive_audit_data
 
 # TODO add tests for entry points 'drive-info', 'network-interfaces',
 
@@ -97,6 +98,7 @@ class BaseTest(unittest.TestCase):
     # to be patched into plugin for their tests.
     task_entry_points = None
     sub_commands = None
+    batch_sub_commands = None
 
     def setUp(self):
         agent_conf = config.get_config('Main')
@@ -120,6 +122,9 @@ class BaseTest(unittest.TestCase):
         if self.sub_commands is not None:
             self.check.DEFAULT_SUBCOMMANDS = self.sub_commands
 
+        if self.batch_sub_commands is not None:
+            self.check.DEFAULT_BATCH_SUBCOMMANDS = self.batch_sub_commands
+
         # setup an instance of the monasca collector which will
         # be used to call the check plugin
         checks = {'initialized_checks': [self.check],
@@ -172,11 +177,14 @@ class BaseTest(unittest.TestCase):
 
 
 def _make_fake_load_instance_conf(metrics_files=None, subcommands=None,
-                                  suppress_ok=None):
+                                  suppress_ok=None, daemon_socket=None,
+                                  batch_subcommands=False):
     def _fake_load_instance_conf(self, instance):
         self.metrics_files = metrics_files or []
         self.subcommands = subcommands or []
         self.suppress_ok = suppress_ok or []
+        self.daemon_socket = daemon_socket
+        self.batch_subcommands = batch_subcommands
     return _fake_load_instance_conf
 
 
@@ -186,26 +194,40 @@ class TestConfig(BaseTest):
         # don't bother with tasks, we are just verifying conf processing
         with mock.patch(TEST_MODULE + '.SwiftLMScan._get_metrics') as mocked:
             mocked.return_value = [], {}
-            self.check.check(conf)
+            with mock.patch(TEST_MODULE + '.SwiftLMScan._run_batch_command',
+                            return_value={}):
+                self.check.check(conf)
         self.assertEqual(swiftlm_check.SwiftLMScan.DEFAULT_SUPPRESS_OK,
                          self.check.suppress_ok)
         self.assertEqual(swiftlm_check.SwiftLMScan.DEFAULT_SUBCOMMANDS,
                          self.check.subcommands)
         self.assertEqual([], self.check.metrics_files)
+        self.assertIsNone(self.check.daemon_socket)
+        self.assertEqual(
+            swiftlm_check.SwiftLMScan.DEFAULT_BATCH_SUBCOMMANDS,
+            self.check.batch_subcommands)
 
     def test_load_instance_config(self):
         conf = {'metrics_files': 'file1,file2',
                 'subcommands': 'drive-audit,connectivity,check_mounts',
-                'suppress_ok': 'drive-audit,connectivity'}
+                'suppress_ok': 'drive-audit,connectivity',
+                'daemon_socket': '/var/run/swiftlm/swiftlm-scan.sock',
+                'batch_subcommands': 'false'}
         # don't bother with tasks, we are just verifying conf processing
         with mock.patch(TEST_MODULE + '.SwiftLMScan._get_metrics') as mocked:
             mocked.return_value = [], {}
-            self.check.check(conf)
+            with mock.patch(TEST_MODULE +
+                            '.SwiftLMScan._read_daemon_results',
+                            return_value={}):
+                self.check.check(conf)
         self.assertEqual(['drive-audit', 'connectivity'],
                          self.check.suppress_ok)
         self.assertEqual(['drive-audit', 'connectivity', 'check_mounts'],
                          self.check.subcommands)
         self.assertEqual(['file1', 'file2'], self.check.metrics_files)
+        self.assertEqual('/var/run/swiftlm/swiftlm-scan.sock',
+                         self.check.daemon_socket)
+        self.assertFalse(self.check.batch_subcommands)
 
 
 class TestErrors(BaseTest):
@@ -503,15 +525,59 @@ class TestDriveAudit(BaseTest):
     task_entry_points = ['drive-audit']
     sub_commands = []
 
+    def setUp(self):
+        super(TestDriveAudit, self).setUp()
+        self.log_file = os.path.join(self.testdir, 'kern.log')
+        self.mounts = os.path.join(self.testdir, 'mounts')
+        with open(self.mounts, 'w') as f:
+            f.write('/dev/sda2 / ext4 rw 0 0\n'
+                    '/dev/sdb1 /srv/node/disk0 xfs rw 0 0\n'
+                    '/dev/sdc1 /srv/node/disk1 xfs rw 0 0\n'
+                    '/dev/sdd1 /srv/node/disk2 xfs rw 0 0\n')
+        for name, value in (
+                ('KERN_LOG', self.log_file),
+                ('MOUNTS', self.mounts),
+                ('STATE_FILE', os.path.join(self.testdir, 'state.json')),
+                ('DRIVE_AUDIT_CONF',
+                 os.path.join(self.testdir, 'drive-audit.conf')),
+                ('swiftlm_scan_conf',
+                 os.path.join(self.testdir, 'swiftlm-scan.conf'))):
+            p = mock.patch('swiftlm.swift.drive_audit.' + name, value)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _write_log(self, *messages):
+        stamp = time.strftime('%b %d %H:%M:%S',
+                              time.localtime(time.time() - 60))
+        with open(self.log_file, 'w') as f:
+            for message in messages:
+                f.write('%s host kernel: %s\n' % (stamp, message))
+
+    def _expected(self, scenarios):
+        expected = []
+        for scenario in scenarios:
+            expected_dimensions = dict(self.expected_dimensions_base)
+            expected_dimensions.update({'kernel_device': scenario[0],
+                                        'mount_point': scenario[1]})
+            expected_value_meta = dict(msg=scenario[3])
+            if len(scenario) > 4:
+                expected_value_meta['error_count'] = scenario[4]
+            expected_metric = dict(self.expected_measurement_base)
+            expected_metric.update(dict(dimensions=expected_dimensions,
+                                        value=scenario[2],
+                                        value_meta=expected_value_meta))
+            expected.append(expected_metric)
+        return expected
+
     def test_handles_OS_error(self):
-        with mock.patch('subprocess.Popen') as mocked:
-            mocked.side_effect = OSError('blah')
-            with mock.patch('swiftlm.utils.metricdata.timestamp',
-                            lambda *args: self.fake_time):
-                actual, events, statuses = self.collector.run_checks_d()
+        # There is no kern.log
+        with mock.patch('swiftlm.utils.metricdata.timestamp',
+                        lambda *args: self.fake_time):
+            actual, events, statuses = self.collector.run_checks_d()
+        error = "[Errno 2] No such file or directory: '%s'" % self.log_file
         expected_dimensions = dict(self.expected_dimensions_base)
-        expected_dimensions.update(dict(error='blah'))
-        expected_value_meta = dict(msg='Unrecoverable error: blah')
+        expected_dimensions.update(dict(error=error))
+        expected_value_meta = dict(msg='Unrecoverable error: %s' % error)
         expected_metric = dict(self.expected_measurement_base)
         expected_metric.update(dict(dimensions=expected_dimensions,
                                     value=swiftlm_check.UNKNOWN,
@@ -519,67 +585,49 @@ class TestDriveAudit(BaseTest):
         self._assert_expected_measurements([expected_metric], actual)
 
     def test_drives_found_and_no_errors(self):
-        with mock.patch('subprocess.Popen') as mocked:
-            mocked.return_value = mock.MagicMock(
-                spec=subprocess.Popen,
-                communicate=lambda: (None, drive_audit_data.output1))
-            with mock.patch('swiftlm.utils.metricdata.timestamp',
-                            lambda *args: self.fake_time):
-                self.check.DEFAULT_SUPPRESS_OK = []
-                actual, events, statuses = self.collector.run_checks_d()
+        self._write_log('sd 0:0:1:0: [sdb] Attached SCSI disk')
+        with mock.patch('swiftlm.utils.metricdata.timestamp',
+                        lambda *args: self.fake_time):
+            self.check.DEFAULT_SUPPRESS_OK = []
+            actual, events, statuses = self.collector.run_checks_d()
 
-        scenarios = (('sdc', swiftlm_check.OK,
-                      'No errors found on device: sdc'),
-                     ('sdd', swiftlm_check.OK,
-                      'No errors found on device: sdd'))
-        expected = []
-        for scenario in scenarios:
-            expected_dimensions = dict(self.expected_dimensions_base)
-            expected_dimensions.update({'device': scenario[0]})
-            expected_value_meta = dict(msg=scenario[2])
-            expected_metric = dict(self.expected_measurement_base)
-            expected_metric.update(dict(dimensions=expected_dimensions,
-                                        value=scenario[1],
-                                        value_meta=expected_value_meta))
-            expected.append(expected_metric)
+        msg = 'No errors found on device mounted at: %s'
+        expected = self._expected((
+            ('sdb', '/srv/node/disk0', swiftlm_check.OK,
+             msg % '/srv/node/disk0'),
+            ('sdc', '/srv/node/disk1', swiftlm_check.OK,
+             msg % '/srv/node/disk1'),
+            ('sdd', '/srv/node/disk2', swiftlm_check.OK,
+             msg % '/srv/node/disk2')))
         self._assert_expected_measurements(expected, actual)
 
     def test_drives_found_and_errors(self):
-        with mock.patch('subprocess.Popen') as mocked:
-            mocked.return_value = mock.MagicMock(
-                spec=subprocess.Popen,
-                communicate=lambda: (None, drive_audit_data.output3))
-            with mock.patch('swiftlm.utils.metricdata.timestamp',
-                            lambda *args: self.fake_time):
-                self.check.DEFAULT_SUPPRESS_OK = []
-                actual, events, statuses = self.collector.run_checks_d()
+        self._write_log('end_request: I/O error, dev sdb, sector 123',
+                        'sd 0:0:2:0: [sdc] Attached SCSI disk',
+                        'XFS (sdd1): metadata I/O error: block 0x1',
+                        'end_request: I/O error, dev sdb, sector 456')
+        with mock.patch('swiftlm.utils.metricdata.timestamp',
+                        lambda *args: self.fake_time):
+            self.check.DEFAULT_SUPPRESS_OK = []
+            actual, events, statuses = self.collector.run_checks_d()
 
-        expected = []
-        scenarios = (('sdb', swiftlm_check.FAIL,
-                      'Errors found on device: sdb'),
-                     ('sdc', swiftlm_check.OK,
-                      'No errors found on device: sdc'),
-                     ('sdd', swiftlm_check.FAIL,
-                      'Errors found on device: sdd'))
-        for scenario in scenarios:
-            expected_dimensions = dict(self.expected_dimensions_base)
-            expected_dimensions.update({'device': scenario[0]})
-            expected_value_meta = dict(msg=scenario[2])
-            expected_metric = dict(self.expected_measurement_base)
-            expected_metric.update(dict(dimensions=expected_dimensions,
-                                        value=scenario[1],
-                                        value_meta=expected_value_meta))
-            expected.append(expected_metric)
+        failed = 'Errors found on device mounted at: %s'
+        expected = self._expected((
+            ('sdb', '/srv/node/disk0', swiftlm_check.FAIL,
+             failed % '/srv/node/disk0', '2'),
+            ('sdc', '/srv/node/disk1', swiftlm_check.OK,
+             'No errors found on device mounted at: /srv/node/disk1'),
+            ('sdd', '/srv/node/disk2', swiftlm_check.FAIL,
+             failed % '/srv/node/disk2', '1')))
         self._assert_expected_measurements(expected, actual)
 
     def test_no_drives_found(self):
-        with mock.patch('subprocess.Popen') as mocked:
-            mocked.return_value = mock.MagicMock(
-                spec=subprocess.Popen,
-                communicate=lambda: (None, drive_audit_data.output2))
-            with mock.patch('swiftlm.utils.metricdata.timestamp',
-                            lambda *args: self.fake_time):
-                actual, events, statuses = self.collector.run_checks_d()
+        self._write_log('end_request: I/O error, dev sdb, sector 123')
+        with open(self.mounts, 'w') as f:
+            f.write('/dev/sda2 / ext4 rw 0 0\n')
+        with mock.patch('swiftlm.utils.metricdata.timestamp',
+                        lambda *args: self.fake_time):
+            actual, events, statuses = self.collector.run_checks_d()
         expected_dimensions = dict(self.expected_dimensions_base)
         expected_value_meta = dict(msg='No devices found')
         expected_metric = dict(self.expected_measurement_base)
@@ -703,6 +751,7 @@ def _make_mock_process(stdout, stderr='', returncode=0):
 class TestCommandLineTasks(BaseTest):
     task_name = 'swiftlm.swiftlm_scan'
     task_entry_points = []
+    batch_sub_commands = False
 
     def test_commands_are_called(self):
         mock_popen = _make_mock_process('')
@@ -976,6 +1025,204 @@ class TestCommandLineTasks(BaseTest):
                 'Command "/bin/sleep 0.1" timed out after 0.01s'))
 
 
+class TestBatchCommandLineTasks(BaseTest):
+    task_name = 'swiftlm.swiftlm_scan'
+    task_entry_points = []
+    sub_commands = ['drive-audit', 'connectivity', 'check-mounts']
+    batch_sub_commands = True
+
+    def _make_metric(self, value, meta):
+        return dict(metric=self.task_name,
+                    timestamp=self.fake_time,
+                    dimensions=dict(blah='whatever',
+                                    service='object-storage',
+                                    hostname=socket.gethostname()),
+                    value=value,
+                    value_meta=dict(msg=meta))
+
+    def _expected(self, metrics):
+        expected = []
+        for metric in metrics:
+            expected_dimensions = dict(self.expected_dimensions_base)
+            expected_dimensions.update(metric['dimensions'])
+            expected_metric = dict(self.expected_measurement_base)
+            expected_metric.update(dict(dimensions=expected_dimensions,
+                                        value=metric['value'],
+                                        value_meta=metric['value_meta']))
+            expected.append(expected_metric)
+        return expected
+
+    def _batch_command(self):
+        command = list(self.check.COMMAND_ARGS) + self.check.BATCH_ARGS
+        command.extend(['--jobs', '3',
+                        '--timeout', str(self.check.BATCH_TASK_TIMEOUT)])
+        command.extend('--' + t for t in self.sub_commands)
+        return command
+
+    def test_single_command(self):
+        results = {
+            'drive-audit': [self._make_metric(0, 'I am ok'),
+                            self._make_metric(2, 'other meta')],
+            'connectivity': [self._make_metric(1, 'some meta')],
+            'check-mounts': [self._make_metric(0, 'mounted')],
+        }
+        mock_popen = _make_mock_process(json.dumps(results))
+        self.check.DEFAULT_SUPPRESS_OK = ['drive-audit']
+        with mock.patch(TEST_MODULE + '.subprocess.Popen', mock_popen):
+            actual, events, statuses = self.collector.run_checks_d()
+
+        expected = self._expected(results['drive-audit'][1:] +
+                                  results['connectivity'] +
+                                  results['check-mounts'])
+        self._assert_expected_measurements(expected, actual)
+        mock_popen.assert_called_once_with(
+            self._batch_command(), stdout=mock.ANY, stderr=mock.ANY)
+        log_lines = self.check.log.get_lines_for_level('info')
+        self.assertIn('Ran 3 command tasks. Metrics summary: {Total: 4, '
+                      'Ok: 2, Warn: 1, Fail: 1, Unknown: 0, }', log_lines)
+
+    def test_missing_task_run_individually(self):
+        results = {
+            'drive-audit': [self._make_metric(1, 'some meta')],
+            'check-mounts': [self._make_metric(0, 'mounted')],
+        }
+        connectivity = [self._make_metric(2, 'other meta')]
+        mock_popen = mock.MagicMock()
+        mock_popen.side_effect = [
+            _make_mock_process(json.dumps(results))(),
+            _make_mock_process(json.dumps(connectivity))()]
+        with mock.patch(TEST_MODULE + '.subprocess.Popen', mock_popen):
+            actual, events, statuses = self.collector.run_checks_d()
+
+        expected = self._expected(results['drive-audit'] +
+                                  results['check-mounts'] + connectivity)
+        self._assert_expected_measurements(expected, actual)
+        self.assertEqual(
+            [mock.call(self._batch_command(),
+                       stdout=mock.ANY, stderr=mock.ANY),
+             mock.call(list(self.check.COMMAND_ARGS) + ['--connectivity'],
+                       stdout=mock.ANY, stderr=mock.ANY)],
+            mock_popen.call_args_list)
+
+    def test_command_fails(self):
+        mock_popen = _make_mock_process('', returncode=2)
+        with mock.patch(TEST_MODULE + '.subprocess.Popen', mock_popen):
+            actual, events, statuses = self.collector.run_checks_d()
+
+        # batch command and then one command per task
+        self.assertEqual(4, mock_popen.call_count)
+        self.assertEqual(3, len(actual))
+        for measurement in actual:
+            self.assertEqual(swiftlm_check.MODULE_METRIC_NAME,
+                             measurement.name)
+            self.assertEqual(swiftlm_check.FAIL, measurement.value)
+        log_lines = self.check.log.get_lines_for_level('warn')
+        self.assertTrue(log_lines[0].startswith(
+            'Command "%s" failed with status 2'
+            % ' '.join(self._batch_command())), log_lines)
+
+
+class TestDaemonTasks(BaseTest):
+    task_name = 'swiftlm.swiftlm_scan'
+    task_entry_points = []
+
+    def setUp(self):
+        super(TestDaemonTasks, self).setUp()
+        self.socket_path = os.path.join(self.testdir, 'scan.sock')
+        self.cache = scan_daemon.ScanCache()
+        self.server = scan_daemon.ScanServer(self.socket_path, self.cache)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestDaemonTasks, self).tearDown()
+
+    def _make_metric(self, value, meta):
+        return dict(metric=self.task_name,
+                    timestamp=self.fake_time,
+                    dimensions=dict(blah='whatever',
+                                    service='object-storage',
+                                    hostname=socket.gethostname()),
+                    value=value,
+                    value_meta=dict(msg=meta))
+
+    def _expected(self, metrics):
+        expected = []
+        for metric in metrics:
+            expected_dimensions = dict(self.expected_dimensions_base)
+            expected_dimensions.update(metric['dimensions'])
+            expected_metric = dict(self.expected_measurement_base)
+            expected_metric.update(dict(dimensions=expected_dimensions,
+                                        value=metric['value'],
+                                        value_meta=metric['value_meta']))
+            expected.append(expected_metric)
+        return expected
+
+    def test_results_read_from_daemon(self):
+        audit = [self._make_metric(0, 'I am ok'),
+                 self._make_metric(2, 'other meta')]
+        mounts = [self._make_metric(1, 'some meta')]
+        self.cache.update('drive-audit', audit)
+        self.cache.update('check-mounts', mounts)
+        self.cache.update('connectivity', [self._make_metric(0, 'unused')])
+        mock_popen = _make_mock_process('')
+
+        fake_load_instance_config = _make_fake_load_instance_conf(
+            subcommands=['drive-audit', 'check-mounts'],
+            suppress_ok=['drive-audit'],
+            daemon_socket=self.socket_path)
+        with mock.patch(TEST_MODULE + '.SwiftLMScan._load_instance_config',
+                        fake_load_instance_config):
+            with mock.patch(TEST_MODULE + '.subprocess.Popen', mock_popen):
+                actual, events, statuses = self.collector.run_checks_d()
+
+        self._assert_expected_measurements(
+            self._expected(audit[1:] + mounts), actual)
+        self.assertFalse(mock_popen.called)
+
+    def test_command_run_for_missing_results(self):
+        audit = [self._make_metric(1, 'some meta')]
+        mounts = [self._make_metric(2, 'other meta')]
+        self.cache.update('drive-audit', audit)
+        mock_popen = _make_mock_process(json.dumps(mounts))
+
+        fake_load_instance_config = _make_fake_load_instance_conf(
+            subcommands=['drive-audit', 'check-mounts'],
+            daemon_socket=self.socket_path)
+        with mock.patch(TEST_MODULE + '.SwiftLMScan._load_instance_config',
+                        fake_load_instance_config):
+            with mock.patch(TEST_MODULE + '.subprocess.Popen', mock_popen):
+                actual, events, statuses = self.collector.run_checks_d()
+
+        self._assert_expected_measurements(self._expected(audit + mounts),
+                                           actual)
+        mock_popen.assert_called_once_with(
+            list(self.check.COMMAND_ARGS) + ['--check-mounts'],
+            stdout=mock.ANY, stderr=mock.ANY)
+
+    def test_daemon_not_running(self):
+        mounts = [self._make_metric(2, 'other meta')]
+        mock_popen = _make_mock_process(json.dumps(mounts))
+
+        fake_load_instance_config = _make_fake_load_instance_conf(
+            subcommands=['check-mounts'],
+            daemon_socket=os.path.join(self.testdir, 'missing.sock'))
+        with mock.patch(TEST_MODULE + '.SwiftLMScan._load_instance_config',
+                        fake_load_instance_config):
+            with mock.patch(TEST_MODULE + '.subprocess.Popen', mock_popen):
+                actual, events, statuses = self.collector.run_checks_d()
+
+        self._assert_expected_measurements(self._expected(mounts), actual)
+        log_lines = self.check.log.get_lines_for_level('warn')
+        self.assertEqual(1, len(log_lines),
+                         'Found log lines %s' % log_lines)
+        self.assertTrue(
+            log_lines[0].startswith('Reading from swiftlm-scan daemon'))
+
+
 class TestLoadFileTasks(BaseTest):
     task_name = 'swiftlm.swiftlm_scan'
     task_entry_points = []
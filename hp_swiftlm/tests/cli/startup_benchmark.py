@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Measure the start up time of swiftlm-scan.
+
+Each measurement runs a fresh interpreter that imports swiftlm.cli.runner and
+parses the command line for the given checks, without running them. The
+import time of every module is recorded in the style of
+``python -X importtime`` (which is not available on python 2)::
+
+    $ python tests/cli/startup_benchmark.py --swift-services
+    $ python tests/cli/startup_benchmark.py --repeat 20 --top 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Run in the child interpreter: wraps __import__ so that the self and
+# cumulative time of each first import is recorded.
+CHILD = r'''
+import json, sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+real_import = builtins.__import__
+stack = []
+timings = []
+
+
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return real_import(name, *args, **kwargs)
+    start = time.time()
+    stack.append(0.0)
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        cumulative = time.time() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += cumulative
+        timings.append((name, cumulative - children, cumulative))
+
+builtins.__import__ = timed_import
+start = time.time()
+from swiftlm.cli import runner
+imported = time.time()
+runner.parse_args(sys.argv[1:])
+parsed = time.time()
+builtins.__import__ = real_import
+json.dump({'import': imported - start, 'parse': parsed - imported,
+           'timings': timings}, sys.stdout)
+'''
+
+
+def measure(checks):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(here)), env.get('PYTHONPATH', '')])
+    out = subprocess.check_output(
+        [sys.executable, '-c', CHILD] + list(checks), env=env)
+    return json.loads(out.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of slowest imports to show.')
+    args, checks = parser.parse_known_args()
+
+    results = [measure(checks) for _ in range(args.repeat)]
+    best = min(results, key=lambda r: r['import'] + r['parse'])
+
+    print('checks: %s' % (' '.join(checks) or '(all)'))
+    print('import swiftlm.cli.runner: best %.1fms of %d runs'
+          % (best['import'] * 1000, args.repeat))
+    print('parse_args: best %.1fms' % (best['parse'] * 1000))
+    print()
+    print('%10s | %10s | %s' % ('self [us]', 'cumulative', 'module'))
+    timings = sorted(best['timings'], key=lambda t: t[2], reverse=True)
+    for name, self_time, cumulative in timings[:args.top]:
+        print('%10d | %10d | %s' % (self_time * 1e6, cumulative * 1e6, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import subprocess
+import threading
+import time
+import unittest
+
+import mock
+
+from swiftlm.cli import drive_provision
+from swiftlm.utils import drive_inventory
+from swiftlm.utils.drive_inventory import BlockDevice, DriveInventory
+
+PARTED_OUTPUT = """Model: ATA VBOX HARDDISK (scsi)
+Disk /dev/sdb: 21.5GB
+Sector size (logical/physical): 512B/512B
+Partition Table: gpt
+Disk Flags:
+
+Number  Start   End     Size    File system  Name            Flags
+ 1      1049kB  21.5GB  21.5GB  xfs          0a000001h001
+
+"""
+
+UNRECOGNISED = "Error: /dev/sdc: unrecognised disk label\n"
+
+real_popen = subprocess.Popen
+
+
+class TestPartedProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.drives = {'/dev/sdb': 'printf "%s"' % PARTED_OUTPUT,
+                       '/dev/sdc': 'printf "%s"; exit 1' % UNRECOGNISED,
+                       '/dev/sdd': 'sleep 30'}
+        self.calls = []
+        p = mock.patch('swiftlm.cli.drive_provision.subprocess.Popen',
+                       side_effect=self._fake_popen)
+        p.start()
+        self.addCleanup(p.stop)
+        p = mock.patch.dict(drive_provision.parted_cache, clear=True)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _fake_popen(self, args, **kwargs):
+        self.assertEqual(['/sbin/parted', args[1], 'print'], args)
+        self.calls.append(args[1])
+        return real_popen(['sh', '-c', self.drives[args[1]]], **kwargs)
+
+    def test_run_parted(self):
+        status, output = drive_provision.run_parted('/dev/sdb')
+        self.assertEqual(0, status)
+        self.assertEqual(PARTED_OUTPUT[:-1], output)
+        self.assertEqual((0, PARTED_OUTPUT[:-1]),
+                         drive_provision.run_parted('/dev/sdb'))
+        self.assertEqual(['/dev/sdb'], self.calls)
+
+    def test_hung_drive(self):
+        start = time.time()
+        self.assertEqual((None, ''),
+                         drive_provision.run_parted('/dev/sdd', timeout=0.2))
+        self.assertLess(time.time() - start, 10)
+
+    def test_find_parted_drives(self):
+        drives = ['/dev/sdb', '/dev/sdc', '/dev/sdd']
+        start = time.time()
+        drive_provision.probe_drives(drives, timeout=1)
+        # The drives were probed in parallel
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(sorted(drives), sorted(self.calls))
+
+        # The cached results are used
+        parted, unparted = drive_provision.find_parted_drives(drives)
+        self.assertEqual(['/dev/sdb'], parted)
+        self.assertEqual(['/dev/sdc'], unparted)
+        partitions = drive_provision.get_drive_partitions('/dev/sdb')
+        self.assertEqual(1, len(partitions))
+        self.assertIn('0a000001h001', partitions[0])
+        self.assertEqual(3, len(self.calls))
+
+    def test_hung_drive_partitions(self):
+        drive_provision.parted_cache['/dev/sdd'] = (None, '')
+        self.assertRaises(SystemExit, drive_provision.get_drive_partitions,
+                          '/dev/sdd')
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        sdb = BlockDevice('sdb', 7814037168, '8:16')
+        sdb.load_udev({'ID_PART_TABLE_TYPE': 'gpt'})
+        sdb1 = BlockDevice('sdb1', 7814033072, '8:17', 1, sdb)
+        sdb1.load_udev({'ID_FS_TYPE': 'xfs',
+                        'ID_PART_ENTRY_NAME': '0a000001h001'})
+        sdb.partitions.append(sdb1)
+        sdc = BlockDevice('sdc', 7814037168, '8:32')
+        sdc.load_udev({})
+        # Not known to udev
+        sdd = BlockDevice('sdd', 7814037168, '8:48')
+        # A boot partition, a labelled partition and unlabelled partitions
+        sde = BlockDevice('sde', 7814037168, '8:64')
+        sde.load_udev({'ID_PART_TABLE_TYPE': 'gpt'})
+        for number, properties in (
+                (1, {'ID_FS_TYPE': 'vfat',
+                     'ID_PART_ENTRY_TYPE': drive_inventory.ESP_TYPE}),
+                (2, {'ID_FS_TYPE': 'xfs',
+                     'ID_PART_ENTRY_NAME': '0a000001h002'}),
+                (3, {'ID_FS_TYPE': 'xfs'}),
+                (10, {'ID_FS_TYPE': 'xfs', 'ID_PART_ENTRY_NAME': 'primary'})):
+            part = BlockDevice('sde%d' % number, 1000, '8:%d' % (64 + number),
+                               number, sde)
+            part.load_udev(properties)
+            sde.partitions.append(part)
+        p = mock.patch('swiftlm.cli.drive_provision.drive_inventory',
+                       DriveInventory([sdb, sdb1, sdc, sdd, sde] +
+                                      sde.partitions))
+        p.start()
+        self.addCleanup(p.stop)
+        p = mock.patch.dict(drive_provision.parted_cache, clear=True)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_find_parted_drives(self):
+        with mock.patch('swiftlm.cli.drive_provision.run_parted',
+                        return_value=(0, PARTED_OUTPUT)) as mock_parted:
+            parted, unparted = drive_provision.find_parted_drives(
+                ['/dev/sdb', '/dev/sdc', '/dev/sdd'])
+        self.assertEqual(['/dev/sdb', '/dev/sdd'], parted)
+        self.assertEqual(['/dev/sdc'], unparted)
+        # Only the drive udev does not know is probed
+        self.assertEqual(set(['/dev/sdd']),
+                         set(c[0][0] for c in mock_parted.call_args_list))
+
+    def test_separate_labelled_devices(self):
+        with mock.patch('swiftlm.cli.drive_provision.run_parted') as \
+                mock_parted:
+            blank, raw, labelled, blank_partitions = \
+                drive_provision.separate_labelled_devices(
+                    '0a000001', ['/dev/sdb'], ['xfs'], [], 'boot')
+        self.assertFalse(mock_parted.called)
+        self.assertEqual([['1', '/dev/sdb1']], labelled)
+        self.assertEqual(([], [], []), (blank, raw, blank_partitions))
+
+    def test_separate_partitions(self):
+        with mock.patch('swiftlm.cli.drive_provision.run_parted') as \
+                mock_parted:
+            blank, raw, labelled, blank_partitions = \
+                drive_provision.separate_labelled_devices(
+                    '0a000001', ['/dev/sdb', '/dev/sde'], ['xfs'], [],
+                    'boot')
+        self.assertFalse(mock_parted.called)
+        self.assertEqual([['1', '/dev/sdb1'], ['2', '/dev/sde2']], labelled)
+        self.assertEqual(['/dev/sde3', '/dev/sde10'], blank_partitions)
+        self.assertEqual(([], []), (blank, raw))
+
+    def test_check_data_matches(self):
+        with mock.patch('swiftlm.cli.drive_provision.run_parted') as \
+                mock_parted, mock.patch('sys.stdout'):
+            self.assertFalse(drive_provision.check_data_matches(
+                [('/dev/sdb1', 'disk1'), ('/dev/sde3', 'disk3'),
+                 ('/dev/sdc', 'disk4')],
+                ['/dev/sdb', '/dev/sdc', '/dev/sde']))
+            self.assertTrue(drive_provision.check_data_matches(
+                [('/dev/sdc1', 'disk1')], ['/dev/sdc']))
+        self.assertFalse(mock_parted.called)
+
+    def test_drive_info(self):
+        with mock.patch('commands.getstatusoutput') as mock_status, \
+                mock.patch('swiftlm.utils.drive_inventory.get_product_name',
+                           return_value='ProLiant'):
+            info = drive_provision.generate_drive_info(
+                '10.0.0.1', '/srv/node', [['1', '/dev/sdb1']])
+        self.assertFalse(mock_status.called)
+        self.assertEqual('ProLiant', info['model'])
+        self.assertAlmostEqual(7814033072 * 512 / 1024.0 ** 3,
+                               info['devices'][0]['size_gb'])
+
+
+class TestProvisionTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    def _step(self, device, name, delay=0.05, fail=False):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+            self.calls.append((device, name))
+        if fail:
+            raise drive_provision.ProvisionError('%s failed' % name)
+
+    def _add(self, tasks, device, *names, **kwargs):
+        for name in names:
+            tasks.add(device, name, self._step, device, name,
+                      kwargs.get('delay', 0.05), name == kwargs.get('fail'))
+
+    def test_run(self):
+        tasks = drive_provision.ProvisionTasks()
+        drives = ['/dev/sd%s' % c for c in 'bcdefgh']
+        for drive in drives:
+            self._add(tasks, drive, 'partition', 'label')
+        for drive in drives:
+            self._add(tasks, drive, 'mount')
+        self._add(tasks, '/dev/sdb', 'extra', fail='extra')
+
+        with mock.patch('sys.stdout'):
+            results = tasks.run(jobs=3)
+
+        self.assertEqual(3, self.max_running)
+        self.assertEqual(drives, [r['device'] for r in results])
+        for drive in drives:
+            self.assertEqual(['partition', 'label', 'mount'],
+                             [name for d, name in self.calls
+                              if d == drive and name != 'extra'])
+        self.assertEqual({'device': '/dev/sdb',
+                          'status': 'failed',
+                          'steps': ['partition', 'label', 'mount', 'extra'],
+                          'done': ['partition', 'label', 'mount'],
+                          'failed': 'extra',
+                          'error': 'extra failed',
+                          'seconds': results[0]['seconds']}, results[0])
+        self.assertEqual(['ok'] * 6, [r['status'] for r in results[1:]])
+        with mock.patch('sys.stdout'):
+            self.assertEqual(1, drive_provision.print_summary(results))
+
+    def test_failed_step_stops_task(self):
+        tasks = drive_provision.ProvisionTasks()
+        self._add(tasks, '/dev/sdb', 'partition', 'label', 'mount',
+                  fail='label')
+        with mock.patch('sys.stdout'):
+            results = tasks.run()
+        self.assertEqual([('/dev/sdb', 'partition'), ('/dev/sdb', 'label')],
+                         self.calls)
+        self.assertEqual(['partition'], results[0]['done'])
+
+    def test_timeout(self):
+        tasks = drive_provision.ProvisionTasks()
+        self._add(tasks, '/dev/sdb', 'mount', delay=0.01)
+        self._add(tasks, '/dev/sdc', 'mount', delay=1)
+        self._add(tasks, '/dev/sdd', 'mount', delay=0.01)
+        with mock.patch('sys.stdout'):
+            results = tasks.run(jobs=1, timeout=0.5)
+        self.assertEqual(['ok', 'timeout', 'timeout'],
+                         [r['status'] for r in results])
+        # The queued task is discarded rather than run after the timeout
+        time.sleep(1)
+        self.assertEqual(['/dev/sdb', '/dev/sdc'],
+                         [device for device, name in self.calls])
+
+    def test_task_device(self):
+        self.assertEqual('/dev/sdb',
+                         drive_provision.task_device(['1', '/dev/sdb1']))
+        self.assertEqual('/dev/sda',
+                         drive_provision.task_device(['1', '/dev/sda10']))
+        self.assertEqual('/dev/hlm-vg/LV_SWFPAC',
+                         drive_provision.task_device(
+                             ['v2', '/dev/hlm-vg/LV_SWFPAC']))
+
+    def test_label_partitions(self):
+        tasks = drive_provision.ProvisionTasks()
+        with mock.patch('sys.stdout'):
+            drive_provision.label_partitions(
+                ['/dev/sda3', '/dev/sda10'], '0a000001', 'xfs', [],
+                [('/dev/sda3', 'disk3'), ('/dev/sda10', 'disk10')], tasks)
+        self.assertEqual(['/dev/sda'], list(tasks.by_device))
+        self.assertEqual(['label /dev/sda3', 'label /dev/sda10'],
+                         [step[0] for step in
+                          tasks.by_device['/dev/sda'].steps])
+
+    def test_label_partition(self):
+        with mock.patch('commands.getstatusoutput',
+                        return_value=(0, 'xfs')) as mock_status, \
+                mock.patch('time.sleep'):
+            drive_provision.label_partition('/dev/sda10', 'label', 'xfs')
+        self.assertEqual('/sbin/parted -s /dev/sda name 10 "label"',
+                         mock_status.call_args_list[0][0][0])
+
+    def test_nothing_to_do(self):
+        self.assertEqual([], drive_provision.ProvisionTasks().run())
+
+    def test_format_drives(self):
+        tasks = drive_provision.ProvisionTasks()
+        with mock.patch('sys.stdout'):
+            blank = drive_provision.format_drives(
+                ['/dev/sdb'], ['/dev/sdc', '/dev/sdd'], 'xfs',
+                [('/dev/sdc', 'disk1')], tasks)
+        self.assertEqual(['/dev/sdb', '/dev/sdc'], blank)
+        self.assertEqual(1, len(tasks))
+        self.assertEqual([('partition', drive_provision.partition_drive,
+                           ('/dev/sdc',)),
+                          ('mkfs', drive_provision.make_filesystem,
+                           ('/dev/sdc', 'xfs'))],
+                         tasks.by_device['/dev/sdc'].steps)
@@ -0,0 +1,135 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+from shutil import rmtree
+import os
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from swiftlm.cli import plugin_index, runner
+from swiftlm.cli.plugin_index import PluginEntryPoint
+
+ENTRY_POINTS = """[console_scripts]
+swiftlm-scan = swiftlm.cli.runner:main
+
+[swiftlm.plugins]
+zz-first = fake_plugin_a:main
+Check-B = fake_plugin_b:main
+"""
+
+PLUGIN = '''
+def main():
+    """{doc}"""
+    return []
+'''
+
+
+class TestPluginEntryPoint(unittest.TestCase):
+
+    def test_parse(self):
+        ep = PluginEntryPoint.parse('ntp', ' swiftlm.systems.ntp:main ')
+        self.assertEqual('swiftlm.systems.ntp', ep.module_name)
+        self.assertEqual(('main',), ep.attrs)
+
+        ep = PluginEntryPoint.parse('x', 'a.b:C.method [extra]')
+        self.assertEqual('a.b', ep.module_name)
+        self.assertEqual(('C', 'method'), ep.attrs)
+
+    def test_load(self):
+        ep = PluginEntryPoint.parse('join', 'os.path:join')
+        self.assertIs(os.path.join, ep.load())
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.package_dir = os.path.join(self.testdir, 'swiftlm')
+        os.makedirs(self.package_dir)
+        for name in ('a', 'b'):
+            path = os.path.join(self.testdir, 'fake_plugin_%s.py' % name)
+            with open(path, 'w') as f:
+                f.write(PLUGIN.format(doc='Check %s.' % name))
+        sys.path.insert(0, self.testdir)
+
+    def tearDown(self):
+        sys.path.remove(self.testdir)
+        for name in ('fake_plugin_a', 'fake_plugin_b'):
+            sys.modules.pop(name, None)
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _write_index(self, metadata_dir='swiftlm.egg-info'):
+        metadata_dir = os.path.join(self.testdir, metadata_dir)
+        os.makedirs(metadata_dir)
+        path = os.path.join(metadata_dir, 'entry_points.txt')
+        with open(path, 'w') as f:
+            f.write(ENTRY_POINTS)
+        return path
+
+    def test_find_entry_points_file(self):
+        self.assertIsNone(
+            plugin_index.find_entry_points_file(self.package_dir))
+        path = self._write_index()
+        self.assertEqual(
+            path, plugin_index.find_entry_points_file(self.package_dir))
+
+        # Several installed versions are ambiguous
+        self._write_index('swiftlm-0.1.0-py2.7.egg-info')
+        self.assertIsNone(
+            plugin_index.find_entry_points_file(self.package_dir))
+
+    def test_read_entry_points(self):
+        path = self._write_index()
+        entry_points = plugin_index.read_entry_points(path)
+        self.assertEqual(['zz-first', 'Check-B'], list(entry_points))
+        self.assertEqual('fake_plugin_b',
+                         entry_points['Check-B'].module_name)
+        self.assertEqual({}, plugin_index.read_entry_points(path, 'missing'))
+
+    def test_pkg_resources_fallback(self):
+        with mock.patch('pkg_resources.get_entry_map',
+                        return_value={'b': 'B', 'a': 'A'}) as mock_map:
+            entry_map = plugin_index.get_entry_map(
+                package_dir=self.package_dir)
+        mock_map.assert_called_once_with('swiftlm', 'swiftlm.plugins')
+        self.assertEqual([('a', 'A'), ('b', 'B')], list(entry_map.items()))
+
+    def test_only_selected_plugins_imported(self):
+        self._write_index()
+        entry_map = plugin_index.get_entry_map(package_dir=self.package_dir)
+        with mock.patch('swiftlm.cli.plugin_index.get_entry_map',
+                        return_value=entry_map):
+            args = runner.parse_args(['--Check-B'])
+
+        self.assertEqual(['Check-B'], [t.name for t in args.selected])
+        self.assertIn('fake_plugin_b', sys.modules)
+        self.assertNotIn('fake_plugin_a', sys.modules)
+
+    def test_help_loads_all_plugins(self):
+        self._write_index()
+        entry_map = plugin_index.get_entry_map(package_dir=self.package_dir)
+        out = StringIO.StringIO()
+        with mock.patch('swiftlm.cli.plugin_index.get_entry_map',
+                        return_value=entry_map):
+            with mock.patch('sys.stdout', out):
+                self.assertRaises(SystemExit, runner.parse_args, ['--help'])
+
+        self.assertIn('Check a.', out.getvalue())
+        self.assertIn('Check b.', out.getvalue())
@@ -0,0 +1,162 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import threading
+import time
+import unittest
+
+import mock
+
+from swiftlm.cli import runner
+from swiftlm.cli.runner import PluginTask
+from swiftlm.utils.metricdata import MetricData
+from swiftlm.utils.values import Severity
+
+
+def make_plugin(name, delay=0.0, log=None, depends=None):
+    def plugin():
+        if log is not None:
+            log.append(('start', name))
+        time.sleep(delay)
+        if log is not None:
+            log.append(('end', name))
+        return MetricData.single(name, Severity.ok, dimensions={})
+    plugin.__name__ = name
+    if depends is not None:
+        plugin.depends = depends
+    return plugin
+
+
+def metric_names(tasks):
+    names = []
+    for task in tasks:
+        names.extend(m['metric'] for m in task.metrics)
+    return names
+
+
+class TestRunPlugin(unittest.TestCase):
+
+    def test_list_result(self):
+        def plugin():
+            return [MetricData.single('a', Severity.ok, dimensions={}),
+                    MetricData.single('b', Severity.ok, dimensions={})]
+        metrics = runner.run_plugin(plugin)
+        self.assertEqual(['swiftlm.a', 'swiftlm.b'],
+                         [m['metric'] for m in metrics])
+
+    def test_exception_is_check_failure(self):
+        def plugin():
+            raise ValueError('broken')
+        metrics = runner.run_plugin(plugin)
+        self.assertEqual(1, len(metrics))
+        self.assertEqual('swiftlm.check.failure', metrics[0]['metric'])
+        self.assertEqual(Severity.fail, metrics[0]['value'])
+        self.assertIn('broken', metrics[0]['value_meta']['msg'])
+
+
+class TestRunParallel(unittest.TestCase):
+
+    def test_order_matches_serial(self):
+        serial = [PluginTask(n, make_plugin(n, d))
+                  for n, d in (('a', 0.2), ('b', 0.0), ('c', 0.1))]
+        parallel = [PluginTask(n, make_plugin(n, d))
+                    for n, d in (('a', 0.2), ('b', 0.0), ('c', 0.1))]
+
+        runner.run_serial(serial)
+        runner.run_parallel(parallel, 3)
+
+        self.assertEqual(metric_names(serial), metric_names(parallel))
+        self.assertEqual(['swiftlm.a', 'swiftlm.b', 'swiftlm.c'],
+                         metric_names(parallel))
+
+    def test_runs_concurrently(self):
+        tasks = [PluginTask(n, make_plugin(n, 0.3)) for n in 'abcd']
+        start = time.time()
+        runner.run_parallel(tasks, 4)
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_job_limit(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def make(name):
+            def plugin():
+                with lock:
+                    active.append(name)
+                    peak.append(len(active))
+                time.sleep(0.05)
+                with lock:
+                    active.remove(name)
+            return plugin
+
+        tasks = [PluginTask(n, make(n)) for n in 'abcdef']
+        runner.run_parallel(tasks, 2)
+        self.assertEqual(2, max(peak))
+        self.assertTrue(all(t.finished for t in tasks))
+
+    def test_timeout(self):
+        tasks = [PluginTask('slow', make_plugin('slow', 2.0)),
+                 PluginTask('fast', make_plugin('fast'))]
+        start = time.time()
+        runner.run_parallel(tasks, 2, timeout=0.2)
+        self.assertLess(time.time() - start, 1.0)
+
+        self.assertTrue(tasks[0].timed_out)
+        self.assertEqual(1, len(tasks[0].metrics))
+        failure = tasks[0].metrics[0]
+        self.assertEqual('swiftlm.check.failure', failure['metric'])
+        self.assertEqual(Severity.fail, failure['value'])
+        self.assertIn('timed out after 0.2s', failure['value_meta']['msg'])
+
+        self.assertFalse(tasks[1].timed_out)
+        self.assertEqual(['swiftlm.fast'], metric_names(tasks[1:]))
+
+    def test_dependencies(self):
+        log = []
+        tasks = [PluginTask('a', make_plugin('a', 0.1, log, ['b'])),
+                 PluginTask('b', make_plugin('b', 0.1, log)),
+                 PluginTask('c', make_plugin('c', 0.0, log, ['missing']))]
+        runner.run_parallel(tasks, 3)
+
+        self.assertLess(log.index(('end', 'b')), log.index(('start', 'a')))
+        self.assertEqual(['swiftlm.a', 'swiftlm.b', 'swiftlm.c'],
+                         metric_names(tasks))
+
+    def test_circular_dependencies(self):
+        tasks = [PluginTask('a', make_plugin('a', depends=['b'])),
+                 PluginTask('b', make_plugin('b', depends=['a']))]
+        runner.run_parallel(tasks, 2)
+        self.assertEqual(['swiftlm.a', 'swiftlm.b'], metric_names(tasks))
+
+
+class TestParseArgs(unittest.TestCase):
+
+    def _parse_args(self, argv):
+        deep = make_plugin('deep')
+        deep.explicit = True
+        entry_map = dict((name, mock.Mock(**{'load.return_value': func}))
+                         for name, func in (('quick', make_plugin('quick')),
+                                            ('deep', deep)))
+        with mock.patch('swiftlm.cli.plugin_index.get_entry_map',
+                        return_value=entry_map):
+            args = runner.parse_args(argv)
+        return sorted(task.name for task in args.selected)
+
+    def test_explicit(self):
+        self.assertEqual(['quick'], self._parse_args([]))
+        self.assertEqual(['deep'], self._parse_args(['--deep']))
+        self.assertEqual(['deep', 'quick'], self._parse_args(['--daemon']))
@@ -0,0 +1,223 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+from shutil import rmtree
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from swiftlm.cli import scan_daemon
+from swiftlm.utils.metricdata import MetricData
+from swiftlm.utils.values import Severity
+
+
+def make_plugin(name, calls, delay=0.0):
+    def plugin():
+        calls.append(name)
+        time.sleep(delay)
+        return MetricData.single(name, Severity.ok, dimensions={})
+    return plugin
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.conf_file = os.path.join(self.testdir, 'swiftlm-scan.conf')
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_defaults(self):
+        options, intervals = scan_daemon.load_daemon_config(self.conf_file)
+        self.assertEqual(scan_daemon.DEFAULT_SOCKET_PATH,
+                         options['socket_path'])
+        self.assertEqual(scan_daemon.DEFAULT_INTERVALS, intervals)
+        self.assertEqual(scan_daemon.DEFAULT_TIMEOUT, options['timeout'])
+
+    def test_overrides(self):
+        with open(self.conf_file, 'w') as f:
+            f.write('[daemon]\n'
+                    'socket_path = /tmp/scan.sock\n'
+                    'timeout = 300\n'
+                    '[daemon-intervals]\n'
+                    'hpssacli = 1200\n'
+                    'connectivity = 15\n')
+        options, intervals = scan_daemon.load_daemon_config(self.conf_file)
+        self.assertEqual('/tmp/scan.sock', options['socket_path'])
+        self.assertEqual(300, options['timeout'])
+        self.assertEqual(1200, intervals['hpssacli'])
+        self.assertEqual(15, intervals['connectivity'])
+        self.assertEqual(30, intervals['swift-services'])
+
+
+class TestScanCache(unittest.TestCase):
+
+    def test_stale(self):
+        cache = scan_daemon.ScanCache()
+        a = MetricData.single('a', Severity.ok, dimensions={}).metric()
+        cache.update('a', [a], ttl=20, now=1000)
+        cache.update('b', [a], now=1000)
+
+        self.assertEqual({'a': [a], 'b': [a]}, cache.get(now=1020))
+
+        results = cache.get(now=1021)
+        self.assertEqual([a], results['b'])
+        self.assertEqual(1, len(results['a']))
+        self.assertEqual('swiftlm.check.failure', results['a'][0]['metric'])
+        self.assertIn('stale', results['a'][0]['value_meta']['msg'])
+
+
+class TestScanScheduler(unittest.TestCase):
+
+    def _wait_for(self, scheduler, now):
+        # Step the scheduler until no plugin is left running
+        with scheduler.cond:
+            scheduler.step(now)
+            while scheduler.running:
+                scheduler.cond.wait(0.1)
+                scheduler.step(now)
+
+    def test_intervals(self):
+        calls = []
+        cache = scan_daemon.ScanCache()
+        plugins = {'fast': make_plugin('fast', calls),
+                   'slow': make_plugin('slow', calls)}
+        scheduler = scan_daemon.ScanScheduler(
+            plugins, cache, {'fast': 10, 'slow': 100}, jobs=2)
+
+        self._wait_for(scheduler, 1000)
+        self.assertEqual(['fast', 'slow'], sorted(calls))
+        self.assertEqual(['swiftlm.fast'],
+                         [m['metric'] for m in cache.get(['fast'])['fast']])
+
+        self._wait_for(scheduler, 1005)
+        self.assertEqual(2, len(calls))
+
+        self._wait_for(scheduler, 1010)
+        self.assertEqual(['fast', 'fast', 'slow'], sorted(calls))
+
+        self._wait_for(scheduler, 1100)
+        self.assertEqual(['fast', 'fast', 'fast', 'slow', 'slow'],
+                         sorted(calls))
+
+    def test_timeout(self):
+        calls = []
+        cache = scan_daemon.ScanCache()
+        plugins = {'hung': make_plugin('hung', calls, 1.0)}
+        scheduler = scan_daemon.ScanScheduler(plugins, cache, jobs=1,
+                                              timeout=0.1)
+        with scheduler.cond:
+            scheduler.step()
+            time.sleep(0.2)
+            scheduler.step()
+
+        metrics = cache.get()['hung']
+        self.assertEqual(1, len(metrics))
+        self.assertEqual('swiftlm.check.failure', metrics[0]['metric'])
+        self.assertIn('timed out', metrics[0]['value_meta']['msg'])
+
+    def test_hung_plugin_not_restarted(self):
+        calls = []
+        release = threading.Event()
+
+        def hung():
+            calls.append('hung')
+            release.wait(5)
+        cache = scan_daemon.ScanCache()
+        scheduler = scan_daemon.ScanScheduler({'hung': hung}, cache,
+                                              {'hung': 10}, timeout=0.1)
+        now = time.time()
+        with scheduler.cond:
+            scheduler.step(now)
+            scheduler.step(now + 1)
+            self.assertIn('hung', scheduler.abandoned)
+            self.assertIn('timed out',
+                          cache.get()['hung'][0]['value_meta']['msg'])
+
+            scheduler.step(now + 10)
+            self.assertFalse(scheduler.running)
+            self.assertIn('still running',
+                          cache.get()['hung'][0]['value_meta']['msg'])
+
+            release.set()
+            while not scheduler.abandoned['hung'].finished:
+                scheduler.cond.wait(0.1)
+            self.assertEqual(['hung'], calls)
+            scheduler.step(now + 20)
+            self.assertFalse(scheduler.abandoned)
+            self.assertIn('hung', scheduler.running)
+
+    def test_run_forever_and_stop(self):
+        calls = []
+        cache = scan_daemon.ScanCache()
+        plugins = {'a': make_plugin('a', calls)}
+        scheduler = scan_daemon.ScanScheduler(plugins, cache)
+        thread = threading.Thread(target=scheduler.run_forever)
+        thread.start()
+        time.sleep(0.3)
+        scheduler.stop()
+        thread.join(2.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(['a'], calls)
+        self.assertIn('a', cache.get())
+
+
+class TestScanServer(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.testdir, 'scan.sock')
+        self.cache = scan_daemon.ScanCache()
+        self.server = scan_daemon.ScanServer(self.socket_path, self.cache)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_query(self):
+        a = MetricData.single('a', Severity.ok, dimensions={}).metric()
+        b = MetricData.single('b', Severity.fail, 'bad',
+                              dimensions={}).metric()
+        self.cache.update('a', [a])
+        self.cache.update('b', [b])
+
+        self.assertEqual({'a': [a], 'b': [b]},
+                         scan_daemon.query(self.socket_path))
+        self.assertEqual({'b': [b]},
+                         scan_daemon.query(self.socket_path, ['b', 'c']))
+
+    def test_socket_removed_on_close(self):
+        self.assertTrue(os.path.exists(self.socket_path))
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_stale_socket_replaced(self):
+        self.server.shutdown()
+        self.server.socket.close()
+        self.assertTrue(os.path.exists(self.socket_path))
+        self.server = scan_daemon.ScanServer(self.socket_path, self.cache)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.assertEqual({}, scan_daemon.query(self.socket_path))
@@ -0,0 +1,109 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import json
+import os
+from shutil import rmtree
+import tempfile
+import unittest
+
+import mock
+import six
+from yaml import safe_dump
+
+from swiftlm.cli import supervisor
+
+from tests.data.ring_padawan import padawan_input_model, padawan_net_hosts, \
+    padawan_swf_rng_consumes, padawan_drive_configurations
+
+
+class TestMakeDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.input_vars = self._write('input-model.yml', padawan_input_model)
+        self.hosts = self._write('hosts.hf', '\n'.join(padawan_net_hosts))
+        self.consumes = self._write('consumes.yml',
+                                    safe_dump(padawan_swf_rng_consumes))
+        self.osconfig = os.path.join(self.testdir, 'osconfig')
+        os.makedirs(os.path.join(self.osconfig, 'padawan-ccp-c1-m1'))
+        self._write(os.path.join('osconfig', 'padawan-ccp-c1-m1',
+                                 'drive_configuration.yml'),
+                    padawan_drive_configurations)
+        self.builder_dir = os.path.join(self.testdir, 'builder_dir')
+        os.makedirs(self.builder_dir)
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.testdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _make_delta(self, *args):
+        ring_delta = os.path.join(self.testdir, 'ring-delta.json')
+        argv = ['swiftlm-ring-supervisor', '--make-delta',
+                '--etc', self.testdir,
+                '--input-vars', self.input_vars,
+                '--swift-ring-builder-consumes', self.consumes,
+                '--osconfig', self.osconfig,
+                '--builder-dir', self.builder_dir,
+                '--ring-delta', ring_delta,
+                '--format', 'json'] + list(args)
+        self.stdout = six.StringIO()
+        with mock.patch('sys.argv', argv), \
+                mock.patch('sys.stdout', self.stdout):
+            supervisor.main()
+        with open(ring_delta) as f:
+            return json.load(f)
+
+    def test_host_ips(self):
+        host_ips = {}
+        for line in padawan_net_hosts:
+            ip_address, hostname = line.split()
+            host_ips[hostname] = ip_address
+        host_ips_file = self._write('host-ips.yml', safe_dump(host_ips))
+
+        delta = self._make_delta('--host-ips', host_ips_file)
+        self.assertTrue(delta['delta_devices'])
+        self.assertEqual(self._make_delta('--hosts', self.hosts), delta)
+
+    def test_host_ips_not_mapping(self):
+        host_ips_file = self._write('host-ips.yml', '- 192.168.245.2\n')
+        self.assertRaises(SystemExit, self._make_delta,
+                          '--host-ips', host_ips_file)
+        self.assertIn('expected a mapping', self.stdout.getvalue())
+
+    def test_host_ips_missing_host(self):
+        host_ips_file = self._write('host-ips.yml',
+                                    'padawan-ccp-c1-m1-mgmt: 192.168.245.4\n')
+        self.assertRaises(SystemExit, self._make_delta,
+                          '--host-ips', host_ips_file)
+        self.assertIn('Cannot find ip address of', self.stdout.getvalue())
+
+    def test_model_error(self):
+        def iter_devices(input_model):
+            raise supervisor.SwiftModelException('Bad device group')
+
+        with mock.patch.object(supervisor.InputModel, 'iter_devices',
+                               iter_devices):
+            self.assertRaises(SystemExit, self._make_delta,
+                              '--hosts', self.hosts)
+        output = self.stdout.getvalue()
+        self.assertIn('Bad device group', output)
+        self.assertIn('errors or mismatches', output)
@@ -14,12 +14,16 @@
 #
 
 
+import os
+from shutil import rmtree
+import tempfile
 import mock
 import unittest
 
 import six
 
 from swiftlm.generic_hardware import network_interface
+from swiftlm.utils.values import Severity
 
 
 if six.PY2:
@@ -29,24 +33,180 @@ else:
     BUILTIN_OPEN = 'builtins.open'
     COMMANDS_MODULE = 'subprocess'
 
+NET_DEV_HEADER = (
+    'Inter-|   Receive                            '
+    '                    |  Transmit\n'
+    ' face |bytes    packets errs drop fifo frame compressed multicast'
+    '|bytes    packets errs drop fifo colls carrier compressed\n')
+
+
+def net_dev_line(name, rx_bytes=0, rx_packets=0, rx_errs=0, tx_bytes=0,
+                 tx_packets=0, tx_errs=0):
+    values = [rx_bytes, rx_packets, rx_errs, 0, 0, 0, 0, 0,
+              tx_bytes, tx_packets, tx_errs, 0, 0, 0, 0, 0]
+    return '%6s: %s\n' % (name, ' '.join(str(v) for v in values))
+
+
+def write_file(path, content):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        f.write(content)
+
 
 class TestNetworkInterface(unittest.TestCase):
 
-    @mock.patch(COMMANDS_MODULE + '.getoutput')
-    def test_get_interface_data(self, mock_command):
-        mock_data = ['0'] * 17
-        mock_data[4] = '123'
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.net_dev = os.path.join(self.testdir, 'net_dev')
+        self.sys_class_net = os.path.join(self.testdir, 'net')
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_get_interface_data(self):
+        mock_data = ['0'] * 16
+        mock_data[3] = '123'
         # float value doesn't make sense in real world but useful
         # to test that a float value would be tolerated if it occurred in
         # any of the output fields
-        mock_data[9] = '1.23'
-        mock_data[15] = '321'
-        mock_command.return_value = ' '.join(mock_data)
+        mock_data[8] = '1.23'
+        mock_data[14] = '321'
+        # Older kernels leave no space after the colon
+        write_file(self.net_dev, NET_DEV_HEADER +
+                   'interface_name:' + ' '.join(mock_data) + '\n' +
+                   net_dev_line('lo', rx_bytes=5) + 'junk\n')
 
-        d = network_interface.get_interface_data('interface_name')
+        counters = network_interface.read_net_dev(self.net_dev)
+        self.assertEqual(['interface_name', 'lo'], sorted(counters))
+        d = network_interface.get_interface_data('interface_name', counters)
 
         self.assertEqual(d['interface'], 'interface_name')
         self.assertEqual(d['rx']['bytes'], 0)
         self.assertEqual(d['rx']['drop'], 123)
         self.assertEqual(d['tx']['bytes'], 1.23)
         self.assertEqual(d['tx']['carrier'], 321)
+        self.assertEqual(5, counters['lo']['rx']['bytes'])
+
+        self.assertEqual({}, network_interface.read_net_dev(
+            os.path.join(self.testdir, 'none')))
+
+    def test_get_link(self):
+        eth0 = os.path.join(self.sys_class_net, 'eth0')
+        write_file(os.path.join(eth0, 'speed'), '10000\n')
+        write_file(os.path.join(eth0, 'duplex'), 'full\n')
+        write_file(os.path.join(eth0, 'operstate'), 'up\n')
+        self.assertEqual(network_interface.Link(10000, 'full', 'up'),
+                         network_interface.get_link('eth0',
+                                                    self.sys_class_net))
+        # A link that is down
+        write_file(os.path.join(self.sys_class_net, 'eth1', 'speed'), '-1\n')
+        self.assertEqual(network_interface.Link(0, 'unknown', 'unknown'),
+                         network_interface.get_link('eth1',
+                                                    self.sys_class_net))
+        # A bridge has no speed
+        self.assertEqual(0, network_interface.get_link(
+            'br-eth1', self.sys_class_net).speed)
+
+        c = network_interface.get_interface_speed(
+            'eth0', network_interface.Link(10000, 'full', 'up'))
+        self.assertEqual(10000, c.value)
+        self.assertEqual({'duplex': 'full', 'operstate': 'up'},
+                         c.metric()['value_meta'])
+
+    def test_get_interface_names(self):
+        self.assertEqual(
+            set(['eth0', 'br-eth1']),
+            network_interface.get_interface_names(
+                {'10.0.0.1': 'eth0', '10.0.0.2': 'eth0:1',
+                 '10.0.1.1': 'br-eth1', '127.0.0.1': 'lo'},
+                ['10.0.0.1', '10.0.0.2', '10.0.1.1']))
+        self.assertRaises(network_interface.UtilityExeception,
+                          network_interface.get_interface_names,
+                          {'10.0.0.1': 'eth0'}, ['10.0.0.9'])
+
+    def test_get_interface_rates(self):
+        data = {'interface': 'eth0',
+                'rx': {'bytes': 25000000, 'packets': 2000, 'errs': 10},
+                'tx': {'bytes': 500, 'packets': 20, 'errs': 0}}
+        previous = {'rx': {'bytes': 0, 'packets': 1000, 'errs': 10},
+                    'tx': {'bytes': 1000, 'packets': 0}}
+        results = network_interface.get_interface_rates(
+            data, previous, 20, network_interface.Link(100, 'full', 'up'))
+        values = dict((r.name, r.value) for r in results)
+        prefix = 'swiftlm.generic_hardware.network_interface.'
+        self.assertEqual({prefix + 'rx.bytes_per_sec': 1250000.0,
+                          prefix + 'rx.utilisation': 10.0,
+                          prefix + 'rx.packets_per_sec': 50.0,
+                          prefix + 'rx.errs_per_sec': 0.0,
+                          # tx bytes went backwards, there are no previous
+                          # tx errs
+                          prefix + 'tx.packets_per_sec': 1.0}, values)
+
+        # No utilisation without a link speed
+        results = network_interface.get_interface_rates(
+            data, previous, 20, network_interface.Link(0, 'unknown', 'up'))
+        self.assertNotIn(prefix + 'rx.utilisation',
+                         [r.name for r in results])
+
+    def test_run_network_interface_check(self):
+        state_file = os.path.join(self.testdir, 'state.json')
+        for name, speed in (('eth0', '1000'), ('eth1', '10000')):
+            path = os.path.join(self.sys_class_net, name)
+            write_file(os.path.join(path, 'speed'), speed)
+            write_file(os.path.join(path, 'operstate'), 'up')
+        write_file(self.net_dev, NET_DEV_HEADER + net_dev_line('lo') +
+                   net_dev_line('eth0', rx_bytes=1000, tx_bytes=1000) +
+                   net_dev_line('eth1', rx_bytes=1000, tx_bytes=1000))
+
+        def run(now):
+            with mock.patch.multiple(network_interface,
+                                     NET_DEV=self.net_dev,
+                                     SYS_CLASS_NET=self.sys_class_net), \
+                    mock.patch.object(network_interface,
+                                      'ip_to_interface',
+                                      return_value={'10.0.0.1': 'eth0',
+                                                    '10.0.1.1': 'eth1:0'}), \
+                    mock.patch.object(network_interface,
+                                      'get_swift_bind_ips',
+                                      return_value=set(['10.0.0.1',
+                                                        '10.0.1.1'])), \
+                    mock.patch('time.time', return_value=now), \
+                    mock.patch(COMMANDS_MODULE + '.getoutput') as mock_cmd:
+                results = network_interface.run_network_interface_check(
+                    state_file)
+            self.assertFalse(mock_cmd.called)
+            return dict(((r.name, r.dimensions['interface']), r.value)
+                        for r in results)
+
+        prefix = 'swiftlm.generic_hardware.network_interface'
+        # No rates on the first scan
+        values = run(1000)
+        self.assertEqual(1000, values[(prefix, 'eth0')])
+        self.assertEqual(10000, values[(prefix, 'eth1')])
+        self.assertEqual(1000, values[(prefix + '.rx.bytes', 'eth0')])
+        self.assertNotIn((prefix + '.rx.bytes_per_sec', 'eth0'), values)
+        self.assertEqual(34, len(values))
+
+        write_file(self.net_dev, NET_DEV_HEADER + net_dev_line('lo') +
+                   net_dev_line('eth0', rx_bytes=1251000, rx_packets=600,
+                                tx_bytes=1000) +
+                   net_dev_line('eth1', rx_bytes=1000, tx_bytes=1000))
+        values = run(1010)
+        self.assertEqual(125000.0,
+                         values[(prefix + '.rx.bytes_per_sec', 'eth0')])
+        self.assertEqual(60.0,
+                         values[(prefix + '.rx.packets_per_sec', 'eth0')])
+        self.assertEqual(0.1, values[(prefix + '.rx.utilisation', 'eth0')])
+        self.assertEqual(0.0, values[(prefix + '.tx.utilisation', 'eth1')])
+        self.assertEqual(34 + 2 * 8, len(values))
+
+    def test_unknown_bind_ip(self):
+        with mock.patch.object(network_interface, 'ip_to_interface',
+                               return_value={'10.0.0.1': 'eth0'}), \
+                mock.patch.object(network_interface, 'get_swift_bind_ips',
+                                  return_value=set(['10.0.0.9'])):
+            results = network_interface.run_network_interface_check()
+        self.assertEqual(1, len(results))
+        self.assertEqual(Severity.fail, results[0].value)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Measure the time taken by generate_delta() on a synthetic input model.
+
+The model has --servers servers each with --drives swift drives that are
+used by the account, container and object-0 rings, i.e. the default of
+200 servers of 17 drives is 10200 devices. The existing rings contain all
+devices except those of the last 10% of servers (which are added) and the
+rings also contain devices from servers that are no longer in the model
+(which are removed)::
+
+    $ python tests/rings/delta_benchmark.py
+    $ python tests/rings/delta_benchmark.py --servers 400 --repeat 1
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from swiftlm.cli.supervisor import generate_delta  # noqa
+from swiftlm.rings.hlm_model import InputModel  # noqa
+from swiftlm.rings.ring_builder import RingBuilder, RingDelta  # noqa
+from swiftlm.rings.ring_model import RingSpecifications, DeviceInfo, \
+    DriveConfiguration, DriveConfigurations  # noqa
+
+RINGS = ('account', 'container', 'object-0')
+PORTS = {'account': 6002, 'container': 6001, 'object-0': 6000}
+DRIVE_BYTES = 4000 * 1024 * 1024 * 1024
+
+
+class Options(object):
+    size_to_weight = float(1024 * 1024 * 1024)
+    allow_partitions = False
+    stop_on_warnings = False
+    weight_step = None
+
+
+def drive_names(drives):
+    return ['/dev/sd%s' % chr(ord('b') + i) for i in range(drives)]
+
+
+def server_name(index):
+    return 'cloud-ccp-swobj%04d' % index
+
+
+def server_ip(index):
+    return '10.%d.%d.%d' % (index // 62500, (index // 250) % 250,
+                            index % 250 + 1)
+
+
+def make_model(servers, drives):
+    all_servers = []
+    for index in range(servers):
+        all_servers.append({
+            'name': server_name(index),
+            'region': 'region1',
+            'rack': None,
+            'disk_model': {
+                'name': 'SWIFT_DISKS',
+                'device_groups': [{
+                    'name': 'swift',
+                    'consumer': {'name': 'swift',
+                                 'attrs': {'rings': list(RINGS)}},
+                    'devices': [{'name': name}
+                                for name in drive_names(drives)]}]}})
+    rings = []
+    for ring_name in RINGS:
+        rings.append({'name': ring_name, 'display_name': ring_name,
+                      'partition_power': 17, 'min_part_time': 24,
+                      'replication_policy': {'replica_count': 3}})
+    return {'global': {'all_servers': all_servers,
+                       'all_ring_specifications': [
+                           {'region_name': 'region1', 'rings': rings}]}}
+
+
+def make_hosts(servers):
+    hosts = []
+    for index in range(servers):
+        hosts.append('%s    %s-mgmt' % (server_ip(index), server_name(index)))
+    return hosts
+
+
+def make_consumes(servers):
+    consumes = {}
+    for key, ring_name in (('consumes_SWF_ACC', 'account'),
+                           ('consumes_SWF_CON', 'container'),
+                           ('consumes_SWF_OBJ', 'object-0')):
+        members = [{'host': '%s-mgmt' % server_name(index),
+                    'port': PORTS[ring_name], 'use_tls': False}
+                   for index in range(servers)]
+        consumes[key] = {'members': {'private': members}}
+    return consumes
+
+
+def make_drive_configurations(servers, drives):
+    drive_configurations = DriveConfigurations()
+    for index in range(servers):
+        drive_configuration = DriveConfiguration()
+        drive_configuration.load_model({
+            'ipaddr': server_ip(index),
+            'hostname': server_name(index),
+            'drives': [{'name': name, 'bytes': DRIVE_BYTES, 'partitions': []}
+                       for name in drive_names(drives)]})
+        drive_configurations.add(drive_configuration)
+    return drive_configurations
+
+
+def make_rings(builder_dir, input_model, servers):
+    rings = RingBuilder(builder_dir, False)
+    for ring_name in RINGS:
+        rings.register_ring('region1', ring_name, 3.0, 0.0)
+    existing = int(servers * 0.9)
+    existing_ips = set(server_ip(index) for index in range(existing))
+    for device_info in input_model.iter_devices():
+        if device_info.server_ip in existing_ips:
+            device_info.weight = '3000.00'
+            rings.flat_device_list.append(device_info)
+    # Devices of servers that have since been removed from the model
+    for device_info in list(rings.flat_device_list[:len(RINGS) * 10]):
+        removed = DeviceInfo(device_info.copy())
+        removed['server_ip'] = '10.255.255.%d' % (len(rings.flat_device_list) %
+                                                  250)
+        rings.flat_device_list.append(removed)
+    return rings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--servers', type=int, default=200)
+    parser.add_argument('--drives', type=int, default=17)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    model = make_model(args.servers, args.drives)
+    hosts = make_hosts(args.servers)
+    consumes = make_consumes(args.servers)
+    drive_configurations = make_drive_configurations(args.servers,
+                                                     args.drives)
+    builder_dir = tempfile.mkdtemp()
+    try:
+        timings = []
+        for _ in range(args.repeat):
+            input_model = InputModel(config=model, hosts_fd=hosts,
+                                     consumes=consumes)
+            ring_model = RingSpecifications(model=model)
+            rings = make_rings(builder_dir, input_model, args.servers)
+            delta = RingDelta()
+            start = time.time()
+            generate_delta(input_model, ring_model, rings,
+                           drive_configurations, Options(), delta)
+            timings.append(time.time() - start)
+    finally:
+        shutil.rmtree(builder_dir, ignore_errors=True)
+
+    presence = {}
+    for device_info in delta.delta_devices:
+        presence[device_info.presence] = presence.get(
+            device_info.presence, 0) + 1
+    print('model devices: %d, ring devices: %d' % (
+        sum(1 for _ in input_model.iter_devices()),
+        len(rings.flat_device_list)))
+    print('delta: %s' % ', '.join('%s %d' % item
+                                  for item in sorted(presence.items())))
+    print('generate_delta: best %.2fs of %d runs'
+          % (min(timings), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Compare the slotted DeviceInfo with the dict based record it replaced.
+
+Measures creating --devices records from a model, reading attributes of
+each record and the memory used per record (the object itself plus the
+dict or slots holding its items)::
+
+    $ python tests/rings/record_benchmark.py
+    $ python tests/rings/record_benchmark.py --devices 100000 --repeat 5
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from swiftlm.rings.ring_model import DeviceInfo  # noqa
+
+
+class DictDeviceInfo(dict):
+    """ The dict based DeviceInfo, as it was """
+
+    keynames = DeviceInfo.keynames
+
+    def __init__(self, model=None):
+        super(DictDeviceInfo, self).__init__()
+        if model:
+            self.load_from_model(model)
+
+    def __getattr__(self, item):
+        if item in DictDeviceInfo.keynames:
+            return self.get(item, None)
+        else:
+            raise AttributeError('No key %s in %s' % (item, self))
+
+    def __setattr__(self, item, value):
+        if item in DictDeviceInfo.keynames:
+            self.update({item: value})
+        else:
+            raise AttributeError('No key %s in %s' % (item, self))
+
+    load_from_model = DeviceInfo.load_from_model.__func__
+
+
+def make_models(devices):
+    models = []
+    for index in range(devices):
+        models.append({'region_name': 'region1',
+                       'region_id': 1,
+                       'zone_id': index % 3 + 1,
+                       'server_name': 'server%d' % (index // 17),
+                       'server_ip': '10.0.%d.%d' % (
+                           index // 4250, index // 17 % 250),
+                       'server_bind_port': 6000,
+                       'swift_drive_name': 'disk%d' % (index % 17),
+                       'device_name': '/dev/sd%s' % chr(ord('b') +
+                                                        index % 17),
+                       'ring_name': 'object-0',
+                       'group_type': 'device',
+                       'presence': 'present',
+                       'weight': '3000.00',
+                       'balance': 0,
+                       'meta': 'server%d:disk%d' % (index // 17, index % 17)})
+    return models
+
+
+def record_size(record):
+    size = sys.getsizeof(record)
+    if hasattr(record, '__dict__'):
+        size += sys.getsizeof(record.__dict__)
+    return size
+
+
+def read_attributes(records):
+    for record in records:
+        (record.region_name, record.ring_name, record.server_ip,
+         record.swift_drive_name, record.weight, record.presence)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--devices', type=int, default=10200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    models = make_models(args.devices)
+    print('devices: %d' % args.devices)
+    print('%-14s | %10s | %10s | %10s' % ('record', 'create', 'read',
+                                          'bytes/dev'))
+    for cls in (DictDeviceInfo, DeviceInfo):
+        records = [cls(model) for model in models]
+        create = min(timeit.repeat(lambda: [cls(model) for model in models],
+                                   number=1, repeat=args.repeat))
+        read = min(timeit.repeat(lambda: read_attributes(records),
+                                 number=1, repeat=args.repeat))
+        size = sum(record_size(record) for record in records)
+        print('%-14s | %9.3fs | %9.3fs | %10d' % (
+            cls.__name__, create, read, size // len(records)))
+
+
+if __name__ == '__main__':
+    main()
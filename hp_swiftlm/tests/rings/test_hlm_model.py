@@ -17,6 +17,8 @@
 import unittest
 from yaml import safe_load
 
+import mock
+
 from swiftlm.rings.hlm_model import InputModel
 from swiftlm.rings.ring_model import DeviceInfo
 
@@ -253,6 +255,41 @@ class TestHlmModel(unittest.TestCase):
                                  lv_devices[i].get(key))
 
 
+class TestDeviceTable(unittest.TestCase):
+
+    def setUp(self):
+        self.input_model = InputModel(config=safe_load(padawan_input_model),
+                                      hosts_fd=padawan_net_hosts,
+                                      consumes=padawan_swf_rng_consumes)
+
+    def test_built_once(self):
+        with mock.patch.object(self.input_model, '_iter_device_groups',
+                               wraps=self.input_model._iter_device_groups) \
+                as mock_iter:
+            devices = list(self.input_model.iter_devices())
+            self.assertEqual(devices, list(self.input_model.iter_devices()))
+        self.assertEqual(1, mock_iter.call_count)
+        self.assertEqual(len(devices), len(self.input_model.device_table()))
+
+        # Same devices as walking the model
+        walked = list(self.input_model._iter_device_groups()) + list(
+            self.input_model._iter_volume_groups())
+        self.assertEqual(walked, devices)
+
+    def test_devices_are_copies(self):
+        device_info = next(self.input_model.iter_devices())
+        device_info.weight = '1.00'
+        device_info.presence = 'add'
+        physicals = list(device_info.block_devices['physicals'])
+        device_info.block_devices['physicals'].append('/dev/junk')
+        device_info.block_devices['percent'] = '0%'
+        copied = next(self.input_model.iter_devices())
+        self.assertEqual(None, copied.weight)
+        self.assertEqual('present', copied.presence)
+        self.assertEqual(physicals, copied.block_devices['physicals'])
+        self.assertNotEqual('0%', copied.block_devices['percent'])
+
+
 class TestLvm(unittest.TestCase):
 
     def test_lvm_numbering(self):
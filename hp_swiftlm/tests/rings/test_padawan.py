@@ -16,10 +16,12 @@
 
 import unittest
 from yaml import safe_load
+import mock
 import os
 import tempfile
 
-from swiftlm.cli.supervisor import generate_delta, rebalance
+from swiftlm.cli.supervisor import generate_delta, rebalance, \
+    run_batch_cmds
 from swiftlm.rings.ring_model import RingSpecifications, RingSpecification,\
     DeviceInfo, DriveConfiguration, DriveConfigurations, SwiftModelException, \
     KeystoneRegionRings
@@ -250,6 +252,42 @@ class TestPadawan(unittest.TestCase):
         # total: 7
         self.assertTrue(len(cmds) == 7)
 
+    def test_remove_devices(self):
+        options = DummyInputOptions()
+        input_model = InputModel(config=safe_load(padawan_input_model),
+                                 hosts_fd=padawan_net_hosts,
+                                 consumes=padawan_swf_rng_consumes)
+        ring_model = RingSpecifications(model=safe_load(
+                                        padawan_input_model))
+        rings = FakeRingBuilder(self.builder_dir, 'regionone',
+                                ['account', 'container', 'object-0',
+                                 'object-1'],
+                                3.0)
+        drive_configurations = dummy_osconfig_load(
+            padawan_drive_configurations)
+        delta = RingDelta()
+        generate_delta(input_model, ring_model, rings,
+                       drive_configurations, options, delta)
+        rings.load_fake_ring_data(delta)
+
+        # A server that has been removed from the input model
+        gone = DeviceInfo(dict(rings.flat_device_list[0]))
+        gone['server_ip'] = '192.168.245.99'
+        rings.flat_device_list.append(gone)
+
+        delta = RingDelta()
+        generate_delta(input_model, ring_model, rings,
+                       drive_configurations, options, delta)
+        removed = [d for d in delta.delta_devices if d.presence == 'remove']
+        self.assertEqual([gone.identity()], [d.identity() for d in removed])
+        self.assertEqual(
+            len(rings.flat_device_list) - 1,
+            len([d for d in delta.delta_devices if d.presence != 'remove']))
+        cmds = rebalance(delta, rings, True)
+        self.assertTrue(verb_ringname_args_in_cmds(
+            'remove', os.path.basename(gone.ring_name) + '.builder',
+            ['192.168.245.99/%s' % gone.swift_drive_name], cmds))
+
     def test_set_weight_no_step(self):
         options = DummyInputOptions()
         input_model = InputModel(config=safe_load(padawan_input_model),
@@ -425,3 +463,94 @@ class TestPadawan(unittest.TestCase):
         self.assertTrue('--device lvm0 --meta'
                         ' padawan-ccp-c1-m2:lvm0:/dev/hlm-vg/LV_SWFAC'
                         ' --weight 10.00' in ' '.join(cmds))
+
+    def _make_delta(self):
+        options = DummyInputOptions()
+        input_model = InputModel(config=safe_load(padawan_input_model),
+                                 hosts_fd=padawan_net_hosts,
+                                 consumes=padawan_swf_rng_consumes)
+        ring_model = RingSpecifications(model=safe_load(
+                                        padawan_input_model))
+        rings = RingBuilder(self.builder_dir, False)
+        drive_configurations = dummy_osconfig_load(
+            padawan_drive_configurations)
+        delta = RingDelta()
+        generate_delta(input_model, ring_model, rings,
+                       drive_configurations, options, delta)
+        return delta, rings
+
+    def test_batch_build_rings(self):
+        delta, rings = self._make_delta()
+        cmds = rebalance(delta, rings, True)
+        batch_cmds = rebalance(delta, rings, True, batch=True)
+
+        # One command per ring and action
+        self.assertEqual(4 * 3, len(batch_cmds))
+        by_ring = {}
+        for cmd in batch_cmds:
+            verb, ringname, args = cmd_parse(cmd)
+            self.assertNotIn((ringname, verb), by_ring)
+            by_ring[(ringname, verb)] = args
+
+        # ...that adds the same devices as the one per device commands
+        expected = {}
+        for cmd in cmds:
+            verb, ringname, args = cmd_parse(cmd)
+            if verb == 'add':
+                opts = dict(zip(args[::2], args[1::2]))
+                expected.setdefault(ringname, []).extend([
+                    'r%(--region)sz%(--zone)s-%(--ip)s:%(--port)s'
+                    'R%(--replication-ip)s:%(--replication-port)s'
+                    '/%(--device)s_%(--meta)s' % opts, opts['--weight']])
+            else:
+                self.assertEqual(by_ring[(ringname, verb)], args)
+        for ringname, args in expected.items():
+            self.assertEqual(args, by_ring[(ringname, 'add')])
+
+    def test_batch_set_weight_and_remove(self):
+        delta, rings = self._make_delta()
+        for device_info in delta.delta_devices:
+            if device_info.ring_name == 'object-1':
+                device_info.presence = 'remove'
+            elif device_info.ring_name == 'object-0':
+                device_info.presence = 'set-weight'
+        delta.delta_ring_actions = dict(
+            (key, ['present']) for key in delta.delta_ring_actions)
+        cmds = rebalance(delta, rings, True, batch=True)
+        verbs = sorted((ringname, verb)
+                       for verb, ringname, _ in map(cmd_parse, cmds))
+        self.assertEqual([('account.builder', 'add'),
+                          ('account.builder', 'rebalance'),
+                          ('container.builder', 'add'),
+                          ('container.builder', 'rebalance'),
+                          ('object-0.builder', 'rebalance'),
+                          ('object-0.builder', 'set_weight'),
+                          ('object-1.builder', 'rebalance'),
+                          ('object-1.builder', 'remove')], verbs)
+        remove_args = [args for verb, _, args in map(cmd_parse, cmds)
+                       if verb == 'remove'][0]
+        self.assertEqual(len([d for d in delta.delta_devices
+                              if d.ring_name == 'object-1']),
+                         len(remove_args))
+
+    def test_run_batch_cmds(self):
+        ring_cmds = {('r', 'a'): ['a-create', 'a-add', 'a-rebalance'],
+                     ('r', 'b'): ['b-add', 'b-rebalance'],
+                     ('r', 'c'): ['c-add', 'c-rebalance']}
+        run = []
+
+        def fake_run_cmd(cmd):
+            run.append(cmd)
+            if cmd == 'b-add':
+                return 2, 'failed'
+            return -1, 'ok'
+
+        rings = RingBuilder(self.builder_dir, False)
+        with mock.patch.object(rings, 'run_cmd', side_effect=fake_run_cmd):
+            with mock.patch('sys.stdout'):
+                with self.assertRaises(SystemExit) as cm:
+                    run_batch_cmds(ring_cmds, rings, jobs=3)
+        self.assertEqual(2, cm.exception.code)
+        # A failure stops the commands of that ring only
+        self.assertEqual(['a-add', 'a-create', 'a-rebalance', 'b-add',
+                          'c-add', 'c-rebalance'], sorted(run))
@@ -0,0 +1,307 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import array
+import os
+import pickle
+from shutil import rmtree
+import subprocess
+import tempfile
+import unittest
+
+import mock
+
+from swiftlm.rings import ring_builder
+from swiftlm.rings.ring_builder import RingBuilder, RingDelta
+from swiftlm.rings.ring_model import DeviceInfo, RingSpecification
+
+PART_POWER = 4
+
+# swift-ring-builder output for the builder written by make_builder()
+BUILDER_OUTPUT = """%(path)s, build version 3
+16 partitions, 3.000000 replicas, 1 regions, 2 zones, 3 devices, 50.00 balance, 0.00 dispersion
+The minimum number of hours before a partition can be reassigned is 1
+
+Devices:    id  region  zone      ip address  port  replication ip  replication port      name weight partitions balance meta
+             0       1     1    192.168.0.1  6000    192.168.1.1              6010     disk0 100.00         16    0.00 m0
+             1       1     2    192.168.0.2  6000    192.168.1.2              6010     disk0 100.00         24   50.00 m1
+             2       1     2    192.168.0.2  6000    192.168.1.2              6010     disk1 100.00          8  -50.00 m2
+"""  # noqa
+
+
+class OldRingBuilder(object):
+    """ Stands in for a builder pickled by an old version of swift """
+    pass
+
+
+def make_builder(parts=(16, 24, 8)):
+    devs = []
+    for dev_id, dev_parts in enumerate(parts):
+        devs.append({'id': dev_id, 'region': 1, 'zone': min(dev_id + 1, 2),
+                     'ip': '192.168.0.%d' % min(dev_id + 1, 2),
+                     'port': 6000,
+                     'replication_ip': '192.168.1.%d' % min(dev_id + 1, 2),
+                     'replication_port': 6010,
+                     'device': 'disk%d' % (dev_id // 2),
+                     'weight': 100.0, 'parts': dev_parts,
+                     'meta': 'm%d' % dev_id,
+                     'parts_wanted': 0})
+    # A removed device
+    devs.append(None)
+    return {'part_power': PART_POWER, 'replicas': 3.0,
+            'min_part_hours': 1, 'parts': 2 ** PART_POWER,
+            'devs': devs, 'devs_changed': False, 'version': 3,
+            '_replica2part2dev': [array.array('H', [0] * 2 ** PART_POWER)
+                                  for _ in range(3)],
+            '_last_part_moves_epoch': 0,
+            '_last_part_moves': array.array('B', [0] * 2 ** PART_POWER),
+            '_remove_devs': []}
+
+
+def write_builder(path, builder):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        pickle.dump(builder, f, protocol=2)
+
+
+class TestReadBuilderFile(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.testdir, 'object-0.builder')
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_read(self):
+        write_builder(self.path, make_builder())
+        replica_count, balance, devices = ring_builder.read_builder_file(
+            self.path)
+        self.assertEqual(3.0, replica_count)
+        self.assertEqual(50.0, balance)
+        self.assertEqual(3, len(devices))
+        self.assertEqual({'ring_name': self.path[:-len('.builder')],
+                          'zone_id': '2',
+                          'region_id': '1',
+                          'server_ip': '192.168.0.2',
+                          'server_bind_port': '6000',
+                          'replication_ip': '192.168.1.2',
+                          'replication_bind_port': '6010',
+                          'swift_drive_name': 'disk1',
+                          'weight': '100.00',
+                          'balance': '-50.00',
+                          'meta': 'm2',
+                          'presence': 'present',
+                          'region_name': 'unknown',
+                          'group_type': 'device'}, devices[2])
+
+    def test_same_as_swift_ring_builder(self):
+        write_builder(self.path, make_builder())
+        with mock.patch('subprocess.check_output',
+                        return_value=BUILDER_OUTPUT % {'path': self.path}):
+            expected = RingBuilder(self.testdir, False)._parse_builder_output(
+                self.path)
+        self.assertEqual(expected, ring_builder.read_builder_file(self.path))
+
+    def test_zero_weight(self):
+        builder = make_builder()
+        builder['devs'][2]['weight'] = 0.0
+        write_builder(self.path, builder)
+        _, balance, devices = ring_builder.read_builder_file(self.path)
+        self.assertEqual(ring_builder.MAX_BALANCE, balance)
+        self.assertEqual('999.99', devices[2].balance)
+
+    def test_unreadable(self):
+        write_builder(self.path, OldRingBuilder())
+        self.assertRaises(ValueError, ring_builder.read_builder_file,
+                          self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'junk')
+        self.assertRaises(ValueError, ring_builder.read_builder_file,
+                          self.path)
+
+
+class TestRingBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _builder_path(self, region_name, ring_name):
+        return os.path.join(self.testdir, 'region-%s' % region_name,
+                            '%s.builder' % ring_name)
+
+    def test_read_builder_dir(self):
+        rings = [('one', 'account'), ('one', 'object-0'), ('two', 'account')]
+        for region_name, ring_name in rings:
+            write_builder(self._builder_path(region_name, ring_name),
+                          make_builder())
+
+        with mock.patch('subprocess.check_output') as mock_check_output:
+            builder = RingBuilder(self.testdir, True)
+        self.assertFalse(mock_check_output.called)
+
+        self.assertEqual(sorted(rings), sorted(builder.builder_rings))
+        ringspec = builder.get_ringspec('two', 'account')
+        self.assertEqual(3.0, ringspec.replica_count)
+        self.assertEqual(50.0, ringspec.balance)
+        self.assertEqual(9, len(builder.flat_device_list))
+        for region_name, ring_name in rings:
+            self.assertEqual(3, builder.device_count(region_name, ring_name))
+
+    def test_fallback_to_swift_ring_builder(self):
+        path = self._builder_path('one', 'account')
+        write_builder(path, OldRingBuilder())
+        write_builder(self._builder_path('one', 'container'), make_builder())
+
+        with mock.patch('subprocess.check_output',
+                        return_value=BUILDER_OUTPUT % {'path': path}) \
+                as mock_check_output:
+            builder = RingBuilder(self.testdir, True)
+        mock_check_output.assert_called_once_with(['swift-ring-builder',
+                                                   path])
+        self.assertEqual(6, len(builder.flat_device_list))
+        self.assertEqual(3, builder.device_count('one', 'account'))
+        self.assertEqual(50.0, builder.get_ringspec('one', 'account').balance)
+
+    def test_swift_ring_builder_fails(self):
+        write_builder(self._builder_path('one', 'account'), OldRingBuilder())
+        err = subprocess.CalledProcessError(1, 'swift-ring-builder')
+        with mock.patch('subprocess.check_output', side_effect=err):
+            self.assertRaises(IOError, RingBuilder, self.testdir, True)
+
+
+class TestRingDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.testdir, 'ring-delta')
+        self.delta = RingDelta()
+        ringspec = RingSpecification(None)
+        ringspec.load_model({'name': 'object-0',
+                             'partition_power': 17,
+                             'min_part_time': 24,
+                             'display_name': 'General',
+                             'replication_policy': {'replica_count': 3}})
+        self.delta.register_ring('region1', 'object-0', ringspec)
+        self.delta.delta_ring_actions[('region1', 'object-0')] = ['add']
+        for index, presence in enumerate(('add', 'remove', 'set-weight')):
+            self.delta.append_device(DeviceInfo({
+                'region_name': 'region1',
+                'ring_name': 'object-0',
+                'region_id': 1,
+                'zone_id': 2,
+                'server_name': 'server%d' % index,
+                'server_ip': '10.0.0.%d' % index,
+                'server_bind_port': 6000,
+                'swift_drive_name': 'disk0',
+                'device_name': '/dev/sdb',
+                'group_type': 'device',
+                'block_devices': {'percent': '100%',
+                                  'physicals': ['/dev/sdb']},
+                'weight': '18.63',
+                'presence': presence}))
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _round_trip(self, fmt):
+        self.delta.write_to_file(open(self.path, 'w'), fmt)
+        delta = RingDelta()
+        delta.read_from_file(open(self.path, 'r'), fmt)
+        return delta
+
+    def test_round_trip(self):
+        for fmt in ('yaml', 'json', 'compact'):
+            delta = self._round_trip(fmt)
+            self.assertEqual(self.delta.dump_model(), delta.dump_model(),
+                             fmt)
+            self.assertEqual(['add'], delta.delta_ring_actions[
+                ('region1', 'object-0')])
+            self.assertEqual(3.0, delta.delta_rings[
+                ('region1', 'object-0')].replica_count)
+
+    def test_round_trip_extra_keys(self):
+        self.delta.delta_devices[1]['future_key'] = {'a': 1}
+        for fmt in ('yaml', 'json', 'compact'):
+            delta = self._round_trip(fmt)
+            self.assertEqual(self.delta.dump_model(), delta.dump_model(),
+                             fmt)
+            self.assertEqual({'future_key': {'a': 1}},
+                             delta.delta_devices[1].extra, fmt)
+            self.assertIsNone(delta.delta_devices[0].extra, fmt)
+
+    def test_compact_format(self):
+        self.delta.write_to_file(open(self.path, 'w'), 'compact')
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(ring_builder.COMPACT_FORMAT, lines[0])
+        # One line per device
+        self.assertEqual(2 + len(self.delta.delta_devices), len(lines))
+
+        with open(self.path, 'w') as f:
+            f.write('delta_rings: []\n')
+        self.assertRaises(ValueError, RingDelta().read_from_file,
+                          open(self.path), 'compact')
+
+
+class TestBatchCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _device(self, server_ip, meta=None):
+        device_info = DeviceInfo({
+            'region_name': 'region1',
+            'ring_name': 'object-0',
+            'region_id': 1,
+            'zone_id': 2,
+            'server_ip': server_ip,
+            'server_bind_port': 6000,
+            'swift_drive_name': 'disk0',
+            'weight': 100.0})
+        device_info.meta = meta
+        return device_info
+
+    def test_devices_add(self):
+        rings = RingBuilder(self.testdir, False)
+        cmd = rings.command_devices_add('region1', 'object-0', [
+            self._device('10.0.0.1', 'server1:disk0:/dev/sdb'),
+            self._device('fd00::1'),
+            self._device('fd00::2', '')])
+        self.assertTrue(cmd.endswith(
+            ' add'
+            ' r1z2-10.0.0.1:6000R10.0.0.1:6000/disk0_server1:disk0:/dev/sdb'
+            ' 100.0'
+            ' r1z2-[fd00::1]:6000R[fd00::1]:6000/disk0 100.0'
+            ' r1z2-[fd00::2]:6000R[fd00::2]:6000/disk0 100.0'))
+
+    def test_devices_set_weight_and_remove(self):
+        rings = RingBuilder(self.testdir, False)
+        devices = [self._device('10.0.0.1'), self._device('fd00::1')]
+        self.assertTrue(rings.command_devices_set_weight(
+            'region1', 'object-0', devices).endswith(
+            ' set_weight 10.0.0.1/disk0 100.0 [fd00::1]/disk0 100.0'))
+        self.assertTrue(rings.command_devices_remove(
+            'region1', 'object-0', devices).endswith(
+            ' remove 10.0.0.1/disk0 [fd00::1]/disk0'))
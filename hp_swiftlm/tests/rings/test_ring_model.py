@@ -121,6 +121,55 @@ class TestDeviceInfo(unittest.TestCase):
         with self.assertRaises(AttributeError):
             device_info.junk = 'junk'
 
+    def test_dict_compatible(self):
+        model = safe_load(device_info_simple)
+        device_info = DeviceInfo(model=model)
+        self.assertFalse(hasattr(device_info, '__dict__'))
+        dumped = device_info.dump_model()
+        self.assertIs(dict, type(dumped))
+        self.assertEqual(dumped, device_info)
+        self.assertEqual(device_info, DeviceInfo(dumped))
+        self.assertEqual(sorted(dumped.keys()), sorted(device_info.keys()))
+        self.assertNotIn('replication_ip', device_info)
+        self.assertIsNone(device_info.get('replication_ip'))
+        self.assertRaises(KeyError, lambda: device_info['replication_ip'])
+
+        device_info['weight'] = '10.00'
+        self.assertEqual('10.00', device_info.weight)
+        self.assertEqual('10.00', device_info.dump_model()['weight'])
+        copied = device_info.copy()
+        copied['weight'] = '20.00'
+        self.assertEqual('10.00', device_info.weight)
+        self.assertNotEqual(copied, device_info)
+
+    def test_extra_keys(self):
+        model = safe_load(device_info_simple)
+        model['junk'] = 'junk'
+        device_info = DeviceInfo(model=model)
+        self.assertEqual({'junk': 'junk'}, device_info.extra)
+        self.assertIn('junk', device_info)
+        self.assertEqual('junk', device_info['junk'])
+        self.assertEqual('junk', device_info.get('junk'))
+        self.assertEqual('junk', device_info.dump_model()['junk'])
+        self.assertEqual(device_info, DeviceInfo(device_info.dump_model()))
+        with self.assertRaises(AttributeError):
+            _ = device_info.junk
+        self.assertIsNone(DeviceInfo(safe_load(device_info_simple)).extra)
+
+    def test_ringspec_extra_keys(self):
+        ringspec = RingSpecification(None)
+        ringspec.load_model({'name': 'account',
+                             'replication_policy': {'replica_count': 3},
+                             'future_key': 1})
+        self.assertEqual({'future_key': 1}, ringspec.extra)
+        dumped = ringspec.dump_model()
+        self.assertEqual(1, dumped['future_key'])
+        loaded = RingSpecification(None)
+        loaded.load_model(dumped)
+        self.assertEqual(dumped, loaded.dump_model())
+        with self.assertRaises(AttributeError):
+            _ = ringspec.future_key
+
 
 class TestDriveConfiguration(unittest.TestCase):
 
@@ -147,7 +196,7 @@ class TestIpAddress(unittest.TestCase):
             '192.168.111.4           padawan-vip']
         self.input_model = InputModel(hosts_fd=hosts)
 
-    def TestMapping(self):
+    def test_mapping(self):
         self.assertEqual(self.input_model.ip_address('192.168.245.2', 'test'),
                          'padawan-ccp-c1-m3-mgmt')
 
@@ -155,11 +204,11 @@ class TestIpAddress(unittest.TestCase):
                                                      'test'),
                          '192.168.245.2')
 
-    def TestNotFound(self):
+    def test_not_found(self):
         self.assertRaises(SwiftModelException, self.input_model.ip_address,
                           'junk', 'test')
 
-    def TestAlias(self):
+    def test_alias(self):
         expect = sorted(['192.168.245.2', '192.168.222.2'])
         alisas = self.input_model.aliases('192.168.245.2')
         self.assertEqual(sorted(alisas), expect)
@@ -169,14 +218,27 @@ class TestIpAddress(unittest.TestCase):
         alisas = self.input_model.aliases('192.168.111.4')
         self.assertEqual(sorted(alisas), expect)
 
-    def TestBadAlias(self):
+    def test_bad_alias(self):
         alisas = self.input_model.aliases('junk')
         self.assertEqual(alisas, [])
 
-    def TestEdgeCase(self):
+    def test_edge_case(self):
         # As specified, the aliases only work for ip addresses -- returning
         # a list of ip addresses. However, given a valid name, it returns that
         # name -- not (by design) a list of names. That might be possible,
         # but not needed for now.
         alisas = self.input_model.aliases('padawan-ccp-c1-m3-mgmt')
         self.assertEqual(alisas, ['padawan-ccp-c1-m3-mgmt'])
+
+    def test_host_ips(self):
+        host_ips = {'padawan-ccp-c1-m3-mgmt': '192.168.245.2',
+                    'padawan-ccp-c1-m3-obj': '192.168.222.2',
+                    'padawan-ccp-c1-m2-mgmt': '192.168.245.3'}
+        input_model = InputModel(host_ips=host_ips)
+        self.assertEqual(
+            input_model.ip_address('padawan-ccp-c1-m3-obj', 'test'),
+            '192.168.222.2')
+        self.assertEqual(sorted(input_model.aliases('192.168.245.2')),
+                         ['192.168.222.2', '192.168.245.2'])
+        self.assertEqual(input_model.aliases('192.168.245.3'),
+                         ['192.168.245.3'])
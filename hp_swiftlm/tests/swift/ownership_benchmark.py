@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Compare the single pass audit of /etc/swift with the two walks it replaced.
+
+Generates a tree of --entries files and directories (ring backups and
+builder archives, one in 50 of them empty) and times checking its ownership
+and empty files both ways. The user running the benchmark stands in for
+swift::
+
+    $ python tests/swift/ownership_benchmark.py
+    $ python tests/swift/ownership_benchmark.py --entries 10000 --repeat 5
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import pwd
+from shutil import rmtree
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from swiftlm.swift import file_ownership  # noqa
+
+
+real_getpwuid = pwd.getpwuid
+
+
+def getpwuid(uid):
+    """ pwd.getpwuid, taking the user running the benchmark for swift """
+    if uid == os.getuid():
+        return pwd.struct_passwd(('swift',) + real_getpwuid(uid)[1:])
+    return real_getpwuid(uid)
+
+
+def os_walk_audit(swift_dir):
+    """ The ownership and empty file checks of /etc/swift, as they were """
+    results = set()
+    for root, dirs, files in os.walk(swift_dir, followlinks=True):
+        for name in dirs + files:
+            p = os.path.join(root, name)
+            owner = pwd.getpwuid(os.stat(p).st_uid).pw_name
+            if owner != 'swift':
+                file_ownership.add_result(results, p, 'ownership')
+    for root, _, files in os.walk(swift_dir, followlinks=True):
+        for name in files:
+            p = os.path.join(root, name)
+            if not os.path.isfile(p):
+                file_ownership.add_result(results, p, 'missing')
+            elif (os.stat(p).st_size == 0 and
+                    name not in file_ownership.ZERO_BYTE_EXCLUDE):
+                file_ownership.add_result(results, p, 'empty')
+    return results
+
+
+def single_pass_audit(swift_dir):
+    results = set()
+    file_ownership.SWIFT_DIR = swift_dir
+    file_ownership.audit_swift_dir(results)
+    return results
+
+
+def make_tree(swift_dir, entries, per_dir=100):
+    """ Create entries files and directories below swift_dir """
+    created = 0
+    index = 0
+    while created < entries:
+        dirname = os.path.join(swift_dir, 'backups', '%04d' % index)
+        os.makedirs(dirname)
+        created += 1
+        for number in range(min(per_dir - 1, entries - created)):
+            with open(os.path.join(dirname, '%d.builder' % number),
+                      'w') as f:
+                if number % 50:
+                    f.write('builder')
+            created += 1
+        index += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pwd.getpwuid = getpwuid
+    testdir = tempfile.mkdtemp()
+    try:
+        swift_dir = os.path.join(testdir, 'swift')
+        make_tree(swift_dir, args.entries)
+        print('entries: %d, scandir: %s' % (
+            args.entries, file_ownership.scandir is not None))
+        print('%-18s | %10s | %8s' % ('audit', 'seconds', 'results'))
+        for func in (os_walk_audit, single_pass_audit):
+            results = func(swift_dir)
+            seconds = min(timeit.repeat(lambda: func(swift_dir), number=1,
+                                        repeat=args.repeat))
+            print('%-18s | %9.3fs | %8d' % (func.__name__, seconds,
+                                            len(results)))
+    finally:
+        rmtree(testdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,51 +14,217 @@
 #
 
 
+import os
+import re
+from shutil import rmtree
 import socket
-import subprocess
+import tempfile
 import unittest
 
-from mock import patch, MagicMock
+from mock import patch
 import time
 
 from swiftlm.swift import drive_audit
 from swiftlm.utils.metricdata import MetricData
 from swiftlm.utils.values import Severity
-from tests.data.drive_audit_data import output1, output2, output3
+
+MOUNTS = """/dev/sda2 / ext4 rw,relatime 0 0
+proc /proc proc rw,nosuid,nodev,noexec,relatime 0 0
+/dev/sdb1 /srv/node/sdb1 xfs rw,noatime 0 0
+/dev/sdc1 /srv/node/sdc1 xfs rw,noatime 0 0
+/dev/sdd1 /srv/node/sdd1 xfs rw,noatime 0 0
+/dev/sde1 /mnt xfs rw,noatime 0 0
+"""
+
+KERN_LOG = """Oct 10 10:00:01 host kernel: [ 1.0] sd 0:0:1:0: [sdb] Attached SCSI disk
+Oct 10 10:00:02 host kernel: [ 2.0] end_request: I/O error, dev sdb, sector 123
+Oct 10 10:00:03 host kernel: [ 3.0] XFS (sdd1): metadata I/O error: block 0x1
+Oct 10 10:00:04 host kernel: [ 4.0] end_request: I/O error, dev sdb, sector 456
+Oct 10 10:00:05 host kernel: [ 5.0] sdz1: error reading partition table
+"""
+# The time of the scan for the timestamps of KERN_LOG
+KERN_LOG_NOW = time.mktime((2015, 10, 10, 10, 5, 0, 0, 0, -1))
+
+
+def make_kern_log(now, age=60):
+    """ KERN_LOG, logged age seconds before now """
+    stamp = time.strftime('%b %d %H:%M:%S', time.localtime(now - age))
+    return ''.join(stamp + line[15:] for line in KERN_LOG.splitlines(True))
+
+
+def write_file(path, content, mode='w'):
+    with open(path, mode) as f:
+        f.write(content)
 
 
 class TestDriveAudit(unittest.TestCase):
 
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.testdir, 'kern.log')
+        self.mounts = os.path.join(self.testdir, 'mounts')
+        self.patterns = [re.compile(p) for p in drive_audit.ERROR_PATTERNS]
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
     def test_get_devices(self):
-        devices = drive_audit.get_devices(output1)
-        self.assertEquals(devices, [{'kernel_device': 'sdc',
-                                     'mount_point': '/srv/node/sdc1'},
-                                    {'kernel_device': 'sdd',
-                                     'mount_point': '/srv/node/sdd1'}])
+        write_file(self.mounts, MOUNTS)
+        devices = drive_audit.get_devices('/srv/node', self.mounts)
+        self.assertEqual([{'kernel_device': 'sdb',
+                           'mount_point': '/srv/node/sdb1'},
+                          {'kernel_device': 'sdc',
+                           'mount_point': '/srv/node/sdc1'},
+                          {'kernel_device': 'sdd',
+                           'mount_point': '/srv/node/sdd1'}], devices)
 
     def test_get_devices_no_devs(self):
-        devices = drive_audit.get_devices(output2)
-        self.assertEquals(devices, [])
-
-    def test_get_devices_err_devs(self):
-        devices = drive_audit.get_devices(output3)
-        self.assertEquals(devices, [{'kernel_device': 'sdb',
-                                     'mount_point': '/srv/node/sdb1'},
-                                    {'kernel_device': 'sdc',
-                                     'mount_point': '/srv/node/sdc1'},
-                                    {'kernel_device': 'sdd',
-                                     'mount_point': '/srv/node/sdd1'}])
-
-    def test_get_error_devices_when_errors(self):
-        devices = drive_audit.get_error_devices(output3)
-        self.assertEquals(devices, {'sdb': 516,
-                                    'sdb1': 20,
-                                    'sdd1': 2,
-                                    'sdd': 3})
-
-    def test_get_error_devices_when_no_errors(self):
-        devices = drive_audit.get_error_devices(output1)
-        self.assertEquals(devices, {})
+        write_file(self.mounts, MOUNTS)
+        self.assertEqual([], drive_audit.get_devices('/srv/none',
+                                                     self.mounts))
+        self.assertEqual([], drive_audit.get_devices(
+            '/srv/node', os.path.join(self.testdir, 'none')))
+
+    def test_log_time(self):
+        self.assertEqual(KERN_LOG_NOW - 298, drive_audit.log_time(
+            KERN_LOG.splitlines()[1], KERN_LOG_NOW))
+        # A single digit day is padded with a space
+        self.assertEqual(
+            time.mktime((2015, 10, 1, 10, 0, 0, 0, 0, -1)),
+            drive_audit.log_time('Oct  1 10:00:00 host kernel: x',
+                                 KERN_LOG_NOW))
+        # Logged last year
+        self.assertEqual(
+            time.mktime((2014, 12, 31, 23, 59, 0, 0, 0, -1)),
+            drive_audit.log_time('Dec 31 23:59:00 host kernel: x',
+                                 KERN_LOG_NOW))
+        self.assertEqual(1444471202, drive_audit.log_time(
+            '2015-10-10T10:00:02.123456+00:00 host kernel: x', KERN_LOG_NOW))
+        self.assertEqual(1444467602, drive_audit.log_time(
+            '2015-10-10T10:00:02+01:00 host kernel: x', KERN_LOG_NOW))
+        self.assertEqual(1444471202, drive_audit.log_time(
+            '2015-10-10T10:00:02Z host kernel: x', KERN_LOG_NOW))
+        self.assertIsNone(drive_audit.log_time('sdb error', KERN_LOG_NOW))
+        self.assertIsNone(drive_audit.log_time('', KERN_LOG_NOW))
+
+    def test_find_errors(self):
+        logged = KERN_LOG_NOW - 298
+        self.assertEqual({'sdb': [[logged, 1], [logged + 2, 1]],
+                          'sdd': [[logged + 1, 1]],
+                          'sdz': [[logged + 3, 1]]},
+                         drive_audit.find_errors(KERN_LOG.splitlines(),
+                                                 self.patterns,
+                                                 KERN_LOG_NOW))
+        self.assertEqual({}, drive_audit.find_errors([], self.patterns,
+                                                     KERN_LOG_NOW))
+        # Errors logged in the same second are counted together
+        self.assertEqual({'sdb': [[logged, 2]]}, drive_audit.find_errors(
+            KERN_LOG.splitlines()[1:2] * 2, self.patterns, KERN_LOG_NOW))
+
+    def test_find_errors_in_window(self):
+        # Only the errors logged in the last 297 seconds
+        self.assertEqual(['sdb', 'sdz'], sorted(drive_audit.find_errors(
+            KERN_LOG.splitlines(), self.patterns, KERN_LOG_NOW, 297)))
+        self.assertEqual({}, drive_audit.find_errors(
+            KERN_LOG.splitlines(), self.patterns, KERN_LOG_NOW + 3600))
+        # An error without a timestamp is skipped
+        self.assertEqual({}, drive_audit.find_errors(
+            ['end_request: I/O error, dev sdb'], self.patterns,
+            KERN_LOG_NOW))
+
+    def test_read_new_lines(self):
+        write_file(self.log_file, KERN_LOG)
+        state = {}
+        self.assertEqual(KERN_LOG.splitlines(),
+                         drive_audit.read_new_lines(self.log_file, state))
+        self.assertEqual(os.stat(self.log_file).st_ino, state['inode'])
+        self.assertEqual(len(KERN_LOG), state['offset'])
+
+        # Nothing new, then a partly written line
+        self.assertEqual([], drive_audit.read_new_lines(self.log_file, state))
+        write_file(self.log_file, 'Oct 10 10:01:00 host kernel: new\nOct',
+                   'a')
+        self.assertEqual(['Oct 10 10:01:00 host kernel: new'],
+                         drive_audit.read_new_lines(self.log_file, state))
+        write_file(self.log_file, ' 10 10:02:00 host kernel: end\n', 'a')
+        self.assertEqual(['Oct 10 10:02:00 host kernel: end'],
+                         drive_audit.read_new_lines(self.log_file, state))
+
+    def test_read_rotated(self):
+        write_file(self.log_file, 'one\n')
+        state = {}
+        drive_audit.read_new_lines(self.log_file, state)
+        write_file(self.log_file, 'two\n', 'a')
+        os.rename(self.log_file, self.log_file + '.1')
+        write_file(self.log_file, 'three\n')
+        self.assertEqual(['two', 'three'],
+                         drive_audit.read_new_lines(self.log_file, state))
+
+        # Truncated
+        write_file(self.log_file, 'four\n')
+        self.assertEqual(['four'],
+                         drive_audit.read_new_lines(self.log_file, state))
+
+    def test_read_first_scan(self):
+        write_file(self.log_file, KERN_LOG)
+        state = {}
+        with patch.object(drive_audit, 'INITIAL_READ_BYTES', 100):
+            lines = drive_audit.read_new_lines(self.log_file, state)
+        self.assertEqual(KERN_LOG.splitlines()[-1:], lines)
+        self.assertEqual(len(KERN_LOG), state['offset'])
+
+    def test_update_error_counts(self):
+        state = {}
+        self.assertEqual({'sdb': 2}, drive_audit.update_error_counts(
+            state, {'sdb': [[990, 2]]}, 1000, 3600))
+        self.assertEqual({'sdb': 3, 'sdc': 1},
+                         drive_audit.update_error_counts(
+                             state, {'sdb': [[1990, 1]], 'sdc': [[1995, 1]]},
+                             2000, 3600))
+        # The errors of the first scan are out of the window
+        self.assertEqual({'sdb': 1, 'sdc': 1},
+                         drive_audit.update_error_counts(state, {}, 4600,
+                                                         3600))
+        self.assertEqual({}, drive_audit.update_error_counts(state, {}, 6000,
+                                                             3600))
+        self.assertEqual({}, state['errors'])
+
+    def test_load_config(self):
+        conf_file = os.path.join(self.testdir, 'swiftlm-scan.conf')
+        swift_conf_file = os.path.join(self.testdir, 'drive-audit.conf')
+        conf = drive_audit.load_config(conf_file, swift_conf_file)
+        self.assertEqual(drive_audit.KERN_LOG, conf['log_file'])
+        self.assertEqual(drive_audit.DEVICE_DIR, conf['device_dir'])
+        self.assertEqual(drive_audit.ERROR_WINDOW, conf['error_window'])
+        self.assertEqual(self.patterns, conf['patterns'])
+
+        # swift's drive-audit.conf
+        write_file(swift_conf_file, '[drive-audit]\n'
+                   'device_dir = /srv/disks\n'
+                   'minutes = 240\n'
+                   'regex_pattern1 = \\berror\\b.*\\b(sd[a-z]){1,2}\\d?\\b\n'
+                   'regex_pattern2 = (vd[a-z]) failed\n')
+        conf = drive_audit.load_config(conf_file, swift_conf_file)
+        self.assertEqual('/srv/disks', conf['device_dir'])
+        self.assertEqual(14400, conf['error_window'])
+        self.assertEqual(['sdb', 'vdb'], sorted(drive_audit.find_errors(
+            ['Oct 10 10:00:00 host kernel: vdb failed',
+             'Oct 10 10:00:01 host kernel: I/O error, dev sdb'],
+            conf['patterns'], KERN_LOG_NOW)))
+
+        # swiftlm-scan.conf takes precedence
+        write_file(conf_file, '[drive-audit]\n'
+                   'log_file = /var/log/syslog\n'
+                   'error_window = 60\n'
+                   'regex_pattern_1 = (vd[a-z]) failed\n')
+        conf = drive_audit.load_config(conf_file, swift_conf_file)
+        self.assertEqual('/var/log/syslog', conf['log_file'])
+        self.assertEqual('/srv/disks', conf['device_dir'])
+        self.assertEqual(60, conf['error_window'])
+        self.assertEqual(['vdb'], list(drive_audit.find_errors(
+            ['Oct 10 10:04:30 host kernel: vdb failed',
+             'Oct 10 10:04:31 host kernel: sdb error'],
+            conf['patterns'], KERN_LOG_NOW, 60)))
 
 
 class TestMain(unittest.TestCase):
@@ -70,61 +236,39 @@ class TestMain(unittest.TestCase):
         self.expected_metric_base = dict(
             metric='swiftlm.swift.drive_audit',
             timestamp=self.fake_time)
+        self.testdir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.testdir, 'kern.log')
+        self.mounts = os.path.join(self.testdir, 'mounts')
+        self.state_file = os.path.join(self.testdir, 'state.json')
+        write_file(self.mounts, MOUNTS)
+        for name, value in (('KERN_LOG', self.log_file),
+                            ('MOUNTS', self.mounts),
+                            ('STATE_FILE', self.state_file),
+                            ('DRIVE_AUDIT_CONF',
+                             os.path.join(self.testdir, 'drive-audit.conf'))):
+            p = patch.object(drive_audit, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        p = patch('swiftlm.utils.metricdata.timestamp',
+                  lambda *args: self.fake_time)
+        p.start()
+        self.addCleanup(p.stop)
 
-    @patch('subprocess.Popen')
-    def test_no_errors_found(self, popen):
-        # Expect no MetricData returned when no errors found
-        popen.return_value = MagicMock(spec=subprocess.Popen,
-                                       communicate=lambda: (None, output1))
-        with patch('swiftlm.utils.metricdata.timestamp',
-                   lambda *args: self.fake_time):
-            results = drive_audit.main()
-
-        scenarios = (({'kernel_device': 'sdc',
-                      'mount_point': '/srv/node/sdc1'}, Severity.ok,
-                      'No errors found on device mounted at: /srv/node/sdc1'),
-                     ({'kernel_device': 'sdd',
-                       'mount_point': '/srv/node/sdd1'}, Severity.ok,
-                      'No errors found on device mounted at: /srv/node/sdd1'))
-        expected = []
-        for scenario in scenarios:
-            expected_dimensions = dict(self.expected_dimensions_base)
-            expected_dimensions.update(scenario[0])
-            expected_value_meta = dict(msg=scenario[2])
-            expected_metric = dict(self.expected_metric_base)
-            expected_metric.update(dict(dimensions=expected_dimensions,
-                                        value=scenario[1],
-                                        value_meta=expected_value_meta))
-            expected.append(expected_metric)
-        self.assertEqual(len(expected), len(results), results)
-        for result in results:
-            self.assertTrue(result.metric() in expected, result.metric())
-            # consume expected result once it has been matched
-            expected.remove(result.metric())
-        self.assertFalse(expected)
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _check(self):
+        return drive_audit.check_errors(
+            os.path.join(self.testdir, 'swiftlm-scan.conf'), self.state_file)
 
-    @patch('subprocess.Popen')
-    def test_errors_found(self, popen):
-        popen.return_value = MagicMock(spec=subprocess.Popen,
-                                       communicate=lambda: (None, output3))
-        with patch('swiftlm.utils.metricdata.timestamp',
-                   lambda *args: self.fake_time):
-            results = drive_audit.main()
-
-        scenarios = (({'kernel_device': 'sdc',
-                       'mount_point': '/srv/node/sdc1'}, Severity.ok,
-                      'No errors found on device mounted at: /srv/node/sdc1'),
-                     ({'kernel_device': 'sdb',
-                       'mount_point': '/srv/node/sdb1'}, Severity.fail,
-                      'Errors found on device mounted at: /srv/node/sdb1'),
-                     ({'kernel_device': 'sdd',
-                       'mount_point': '/srv/node/sdd1'}, Severity.fail,
-                      'Errors found on device mounted at: /srv/node/sdd1'))
+    def _check_results(self, results, scenarios):
         expected = []
         for scenario in scenarios:
             expected_dimensions = dict(self.expected_dimensions_base)
             expected_dimensions.update(scenario[0])
             expected_value_meta = dict(msg=scenario[2])
+            if len(scenario) > 3:
+                expected_value_meta['error_count'] = scenario[3]
             expected_metric = dict(self.expected_metric_base)
             expected_metric.update(dict(dimensions=expected_dimensions,
                                         value=scenario[1],
@@ -137,13 +281,78 @@ class TestMain(unittest.TestCase):
             expected.remove(result.metric())
         self.assertFalse(expected)
 
-    @patch('subprocess.Popen')
-    def test_errors_found_but_not_devices(self, popen):
-        popen.return_value = MagicMock(spec=subprocess.Popen,
-                                       communicate=lambda: (None, output2))
-        with patch('swiftlm.utils.metricdata.timestamp',
-                   lambda *args: self.fake_time):
-            result = drive_audit.main()
+    def test_no_errors_found(self):
+        write_file(self.log_file, make_kern_log(time.time()).splitlines(
+            True)[0])
+        results = drive_audit.main()
+
+        self._check_results(results, (
+            ({'kernel_device': 'sdb', 'mount_point': '/srv/node/sdb1'},
+             Severity.ok,
+             'No errors found on device mounted at: /srv/node/sdb1'),
+            ({'kernel_device': 'sdc', 'mount_point': '/srv/node/sdc1'},
+             Severity.ok,
+             'No errors found on device mounted at: /srv/node/sdc1'),
+            ({'kernel_device': 'sdd', 'mount_point': '/srv/node/sdd1'},
+             Severity.ok,
+             'No errors found on device mounted at: /srv/node/sdd1')))
+
+    def test_errors_found(self):
+        kern_log = make_kern_log(time.time())
+        write_file(self.log_file, kern_log)
+        ok_scenario = (
+            {'kernel_device': 'sdc', 'mount_point': '/srv/node/sdc1'},
+            Severity.ok,
+            'No errors found on device mounted at: /srv/node/sdc1')
+        self._check_results(self._check(), (
+            ok_scenario,
+            ({'kernel_device': 'sdb', 'mount_point': '/srv/node/sdb1'},
+             Severity.fail,
+             'Errors found on device mounted at: /srv/node/sdb1', '2'),
+            ({'kernel_device': 'sdd', 'mount_point': '/srv/node/sdd1'},
+             Severity.fail,
+             'Errors found on device mounted at: /srv/node/sdd1', '1')))
+
+        # Only the new lines are read and the errors add up
+        write_file(self.log_file, kern_log.splitlines(True)[1], 'a')
+        with patch('swiftlm.swift.drive_audit.find_errors',
+                   side_effect=drive_audit.find_errors) as mock_count:
+            results = self._check()
+        self.assertEqual(1, len(mock_count.call_args[0][0]))
+        self._check_results(results, (
+            ok_scenario,
+            ({'kernel_device': 'sdb', 'mount_point': '/srv/node/sdb1'},
+             Severity.fail,
+             'Errors found on device mounted at: /srv/node/sdb1', '3'),
+            ({'kernel_device': 'sdd', 'mount_point': '/srv/node/sdd1'},
+             Severity.fail,
+             'Errors found on device mounted at: /srv/node/sdd1', '1')))
+
+        # Until they are older than the window
+        with patch('time.time', return_value=time.time() + 3601):
+            results = self._check()
+        self.assertEqual([Severity.ok] * 3, [r.value for r in results])
+
+    def test_old_errors_ignored(self):
+        # The first scan reads old errors, and errors in the rotated log
+        write_file(self.log_file, make_kern_log(time.time(), age=7200))
+        results = self._check()
+        self.assertEqual([Severity.ok] * 3, [r.value for r in results])
+
+        write_file(self.log_file, make_kern_log(time.time(), age=7200), 'a')
+        os.rename(self.log_file, self.log_file + '.1')
+        write_file(self.log_file, make_kern_log(time.time(), age=10)
+                   .splitlines(True)[2])
+        results = self._check()
+        self.assertEqual(
+            {'/srv/node/sdb1': Severity.ok, '/srv/node/sdc1': Severity.ok,
+             '/srv/node/sdd1': Severity.fail},
+            dict((r['mount_point'], r.value) for r in results))
+
+    def test_errors_found_but_not_devices(self):
+        write_file(self.log_file, make_kern_log(time.time()))
+        write_file(self.mounts, '')
+        result = self._check()
         self.assertTrue(isinstance(result, MetricData))
         expected_dimensions = dict(self.expected_dimensions_base)
         expected_value_meta = dict(msg='No devices found')
@@ -152,3 +361,8 @@ class TestMain(unittest.TestCase):
                                     value=Severity.warn,
                                     value_meta=expected_value_meta))
         self.assertEquals(expected_metric, result.metric())
+
+    def test_no_log(self):
+        result = self._check()
+        self.assertEqual(Severity.unknown, result.value)
+        self.assertIn('kern.log', result['error'])
@@ -14,10 +14,12 @@
 #
 
 
+import itertools
 import os
 from shutil import rmtree
 import tempfile
 import mock
+import time
 import unittest
 
 from swiftlm.swift import file_ownership as FO
@@ -97,14 +99,12 @@ class TestMain(unittest.TestCase):
             self._test_missing((os.path.join(self.etc_dir, 'rsyncd.conf'),
                                os.path.join(self.etc_dir, 'rsyslog.conf'),
                                os.path.join(self.etc_dir, 'swift'),
-                               os.path.join(self.etc_dir, 'swift'),
                                os.path.join(self.srv_dir, 'node')))
 
     def test_all_missing_proxy(self):
         with mock.patch('swiftlm.swift.file_ownership.server_type',
                         lambda x: x == ServerType.proxy):
             self._test_missing((os.path.join(self.etc_dir, 'rsyslog.conf'),
-                               os.path.join(self.etc_dir, 'swift'),
                                os.path.join(self.etc_dir, 'swift')))
 
     def _create_etc_file(self, name, rel_path=None, content=None):
@@ -280,3 +280,236 @@ class TestMain(unittest.TestCase):
                 mock_pwuid.return_value = mock.Mock(pw_name='swift')
                 results = FO.main()
                 self.assertEqual(0, len(results))
+
+
+class TestAuditSwiftDir(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.swift_dir = os.path.join(self.testdir, 'swift')
+        os.makedirs(os.path.join(self.swift_dir, 'backups', 'old'))
+        for name in ('swift.conf', os.path.join('backups', 'a.builder'),
+                     os.path.join('backups', 'old', 'b.builder')):
+            with open(os.path.join(self.swift_dir, name), 'w') as f:
+                f.write('blah')
+        open(os.path.join(self.swift_dir, 'backups', 'empty.conf'),
+             'w').close()
+        open(os.path.join(self.swift_dir, 'reload-trigger'), 'w').close()
+        os.symlink(os.path.join(self.testdir, 'nowhere'),
+                   os.path.join(self.swift_dir, 'broken.conf'))
+        # A link back up the tree
+        os.symlink(self.swift_dir,
+                   os.path.join(self.swift_dir, 'backups', 'loop'))
+        p = mock.patch('swiftlm.swift.file_ownership.SWIFT_DIR',
+                       self.swift_dir)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _audit(self, pw_name='swift'):
+        results = set()
+        with mock.patch('pwd.getpwuid') as mock_pwuid:
+            mock_pwuid.return_value = mock.Mock(pw_name=pw_name)
+            FO.audit_swift_dir(results)
+        self.assertEqual(1, mock_pwuid.call_count)
+        return sorted(str(r) for r in results)
+
+    def test_single_pass(self):
+        self.assertEqual(
+            ['Path: %s should not be empty' % os.path.join(
+                self.swift_dir, 'backups', 'empty.conf'),
+             'Path: %s is missing' % os.path.join(self.swift_dir,
+                                                  'broken.conf')],
+            self._audit())
+
+        results = self._audit('not-swift')
+        self.assertEqual(10, len(results), results)
+        self.assertIn('Path: %s is not owned by swift' % os.path.join(
+            self.swift_dir, 'backups', 'loop'), results)
+
+    def test_without_scandir(self):
+        expected = self._audit('not-swift')
+        with mock.patch('swiftlm.swift.file_ownership.scandir', None):
+            self.assertEqual(expected, self._audit('not-swift'))
+
+    def test_walk_entries(self):
+        with mock.patch('swiftlm.swift.file_ownership.scandir', None), \
+                mock.patch('os.stat', side_effect=os.stat) as mock_stat:
+            entries = list(FO.walk_entries(self.swift_dir))
+        # Each entry (and the top directory) is stat'ed once
+        self.assertEqual(len(entries) + 1, mock_stat.call_count)
+        self.assertEqual(
+            sorted(['swift.conf', 'backups', 'old', 'a.builder', 'b.builder',
+                    'empty.conf', 'reload-trigger', 'broken.conf', 'loop']),
+            sorted(entry.name for entry, _ in entries))
+        self.assertEqual(['broken.conf'],
+                         [entry.name for entry, st in entries if st is None])
+
+    def test_uid_without_user(self):
+        results = set()
+        with mock.patch('pwd.getpwuid', side_effect=KeyError):
+            FO.audit_swift_dir(results, empty=False)
+        self.assertEqual(8, len(results))
+
+
+class TestDeepAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.node_dir = os.path.join(self.testdir, 'node')
+        self.cursor_file = os.path.join(self.testdir, 'cache', 'cursor.json')
+        self.disk0 = os.path.join(self.node_dir, 'disk0')
+        self.disk1 = os.path.join(self.node_dir, 'disk1')
+        for partition in ('objects/1', 'objects/2', 'objects/10',
+                          'objects-1/3', 'accounts/4'):
+            self._make_partition(self.disk0, partition)
+        self._make_partition(self.disk1, 'containers/5')
+        # Not partitions
+        os.makedirs(os.path.join(self.disk0, 'tmp', '6'))
+        os.makedirs(os.path.join(self.disk0, 'objects', 'auditor_status'))
+        p = mock.patch('swiftlm.swift.file_ownership.NODE_DIR',
+                       self.node_dir)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _make_partition(self, drive_dir, partition):
+        path = os.path.join(drive_dir, partition)
+        os.makedirs(path)
+        with open(os.path.join(path, 'hashes.pkl'), 'w') as f:
+            f.write('blah')
+
+    def test_list_partitions(self):
+        self.assertEqual(['accounts/4', 'objects-1/3', 'objects/1',
+                          'objects/10', 'objects/2'],
+                         FO.list_partitions(self.disk0))
+        self.assertEqual([], FO.list_partitions(
+            os.path.join(self.node_dir, 'none')))
+
+    def test_audit_drive(self):
+        with mock.patch('pwd.getpwuid') as mock_pwuid:
+            mock_pwuid.return_value = mock.Mock(pw_name='not-swift')
+            audit = FO.audit_drive(self.disk0, {}, time.time() + 60,
+                                   max_failures=3)
+        self.assertEqual(5, audit.partitions)
+        # Covered the drive, so the next audit starts again
+        self.assertEqual({}, audit.cursor)
+        # Each partition and its file
+        self.assertEqual(10, audit.failure_count)
+        self.assertEqual([os.path.join(self.disk0, 'accounts', '4'),
+                          os.path.join(self.disk0, 'accounts', '4',
+                                       'hashes.pkl'),
+                          os.path.join(self.disk0, 'objects-1', '3')],
+                         audit.failures)
+
+    def test_audit_drive_in_stages(self):
+        # Each partition takes two ticks: the partition and its file
+        clock = itertools.count()
+        with mock.patch('swiftlm.swift.file_ownership.time.time',
+                        side_effect=lambda: next(clock)):
+            audit = FO.audit_drive(self.disk0, {}, 5)
+        self.assertEqual({'last': 'objects-1/3', 'audited': 2}, audit.cursor)
+
+        clock = itertools.count()
+        with mock.patch('swiftlm.swift.file_ownership.time.time',
+                        side_effect=lambda: next(clock)):
+            audit = FO.audit_drive(self.disk0, audit.cursor, 5)
+        self.assertEqual({'last': 'objects/10', 'audited': 4}, audit.cursor)
+
+        audit = FO.audit_drive(self.disk0, audit.cursor, time.time() + 60)
+        self.assertEqual({}, audit.cursor)
+
+        # Out of time
+        audit = FO.audit_drive(self.disk0, {'last': 'objects/1',
+                                            'audited': 2}, 0)
+        self.assertEqual({'last': 'objects/1', 'audited': 2}, audit.cursor)
+
+    def test_audit_partition_in_stages(self):
+        # A partition that takes longer than the budget to walk
+        disk2 = os.path.join(self.node_dir, 'disk2')
+        self._make_partition(disk2, 'objects/7')
+        for suffix in ('abc', 'def'):
+            path = os.path.join(disk2, 'objects', '7', suffix, 'hash')
+            os.makedirs(path)
+            with open(os.path.join(path, '1.data'), 'w') as f:
+                f.write('blah')
+
+        cursor = {}
+        cursors = []
+        failure_count = 0
+        for _ in range(3):
+            clock = itertools.count()
+            with mock.patch('swiftlm.swift.file_ownership.time.time',
+                            side_effect=lambda: next(clock)), \
+                    mock.patch('pwd.getpwuid') as mock_pwuid:
+                mock_pwuid.return_value = mock.Mock(pw_name='not-swift')
+                audit = FO.audit_drive(disk2, cursor, 1)
+            cursor = audit.cursor
+            cursors.append(cursor)
+            failure_count += audit.failure_count
+
+        # Each run audits one more entry of the partition
+        self.assertEqual([{'last': None, 'audited': 0,
+                           'partial': ['objects/7', 'abc']},
+                          {'last': None, 'audited': 0,
+                           'partial': ['objects/7', 'def']},
+                          {}],
+                         cursors)
+        # The partition and everything in it, each audited once
+        self.assertEqual(8, failure_count)
+
+    def _deep_audit(self, pw_name='swift', budget=60):
+        with mock.patch('pwd.getpwuid') as mock_pwuid:
+            mock_pwuid.return_value = mock.Mock(pw_name=pw_name)
+            results = FO.deep_audit(budget, self.cursor_file)
+        return dict(((r.name, r['path']), r.value) for r in results)
+
+    def test_deep_audit(self):
+        name = 'swiftlm.swift.file_ownership'
+        with mock.patch.object(FO, 'DEEP_AUDIT_MAX_FAILURES', 1):
+            results = self._deep_audit('not-swift')
+        self.assertEqual(
+            {(name + '.deep_audit.coverage', self.disk0): 1.0,
+             (name + '.deep_audit.coverage', self.disk1): 1.0,
+             (name + '.deep_audit.failures', self.disk0): 10,
+             (name + '.deep_audit.failures', self.disk1): 2,
+             (name, os.path.join(self.disk0, 'accounts', '4')):
+             FO.Severity.fail,
+             (name, os.path.join(self.disk1, 'containers', '5')):
+             FO.Severity.fail},
+            results)
+        self.assertEqual({'disk0': {}, 'disk1': {}},
+                         FO.load_cursors(self.cursor_file))
+
+    def test_deep_audit_cursor(self):
+        FO.save_cursors({'disk0': {'last': 'objects-1/3', 'audited': 2},
+                         'gone': {}}, self.cursor_file)
+        # Out of time before starting
+        results = self._deep_audit(budget=0)
+        name = 'swiftlm.swift.file_ownership.deep_audit'
+        self.assertEqual(0.4, results[(name + '.coverage', self.disk0)])
+        self.assertEqual(0.0, results[(name + '.coverage', self.disk1)])
+        self.assertEqual(0, results[(name + '.failures', self.disk0)])
+        self.assertEqual({'disk0': {'last': 'objects-1/3', 'audited': 2},
+                          'disk1': {'last': None, 'audited': 0},
+                          'gone': {}},
+                         FO.load_cursors(self.cursor_file))
+
+    def test_no_drives(self):
+        rmtree(self.node_dir)
+        self.assertEqual({}, self._deep_audit())
+        os.makedirs(self.node_dir)
+        self.assertEqual({}, self._deep_audit())
+
+    def test_bad_cursor_file(self):
+        os.makedirs(os.path.dirname(self.cursor_file))
+        with open(self.cursor_file, 'w') as f:
+            f.write('junk')
+        self.assertEqual({}, FO.load_cursors(self.cursor_file))
+        self._deep_audit()
+        self.assertEqual({'disk0': {}, 'disk1': {}},
+                         FO.load_cursors(self.cursor_file))
@@ -14,6 +14,7 @@
 #
 
 
+import os
 from shutil import rmtree
 import socket
 import tempfile
@@ -220,3 +221,30 @@ class TestMain(unittest.TestCase):
                                     value=Severity.unknown,
                                     value_meta=expected_value_meta))
         self.assertEqual(expected_metric, metric)
+
+    def test_process_stats(self):
+        server_types = dict(proxy=True)
+        create_fake_process_entries(self.testdir, ['proxy-server'])
+        with open(os.path.join(self.testdir, '0', 'stat'), 'w') as f:
+            f.write('0 (swift-proxy-s) S ' + ' '.join(
+                ['0'] * 10 + ['300', '100'] + ['0'] * 8 + ['25']) + '\n')
+        with mock.patch('swiftlm.utils.metricdata.timestamp',
+                        lambda *args: self.fake_time), \
+                mock.patch('swiftlm.swift.swift_services.server_type',
+                           lambda *args: server_types), \
+                mock.patch('swiftlm.swift.swift_services.PROC_DIR',
+                           self.testdir), \
+                mock.patch.multiple('swiftlm.utils.proc_table',
+                                    CLOCK_TICKS=100, PAGE_SIZE=4096):
+            results = swift_services.process_stats_main()
+
+        expected_dimensions = dict(self.expected_dimensions_base)
+        expected_dimensions['component'] = 'proxy-server'
+        self.assertEqual(
+            [dict(metric='swiftlm.swift.swift_services.rss_bytes',
+                  timestamp=self.fake_time, value=25 * 4096,
+                  dimensions=expected_dimensions),
+             dict(metric='swiftlm.swift.swift_services.cpu_seconds',
+                  timestamp=self.fake_time, value=4.0,
+                  dimensions=expected_dimensions)],
+            [r.metric() for r in results])
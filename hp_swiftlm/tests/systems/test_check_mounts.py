@@ -20,6 +20,7 @@ import socket
 import tempfile
 import unittest
 import json
+import threading
 import time
 
 import six
@@ -29,6 +30,7 @@ from mock import patch
 
 from swiftlm.systems import check_mounts
 from swiftlm.utils.metricdata import MetricData
+from swiftlm.utils.utility import load_json_state
 from swiftlm.utils.values import Severity
 
 if six.PY2:
@@ -39,18 +41,17 @@ else:
     COMMANDS_MODULE = 'subprocess'
 
 
+real_os_stat = os.stat
+
+
 def make_fake_os_stat(fake_returns):
     def fake_os_stat(path):
+        if path not in fake_returns:
+            return real_os_stat(path)
         return Mock(**fake_returns[path])
     return fake_os_stat
 
 
-def make_fake_is_mount(mounts):
-    def fake_ismount(mount_path):
-        return mounts.get(mount_path, False)
-    return fake_ismount
-
-
 def make_fake_getpwuid(names):
     def fake_getpwuid(uid):
         return Mock(pw_name=names[uid])
@@ -156,6 +157,167 @@ class TestCheckMounts(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+MOUNTINFO = r"""19 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw,errors=remount-ro
+36 19 8:17 / /srv/node/disk0 rw,noatime shared:20 - xfs /dev/sdb1 rw,attr2
+37 19 8:33 / /srv/node/disk1 ro,noatime - xfs /dev/sdc1 ro,attr2
+38 19 252:0 / /srv/node/disk\040two rw - xfs /dev/mapper/vg-lv rw
+39 19 8:49 / /srv/node/disk3 rw master:1 propagate_from:2 - ext4 /dev/sdd1 rw
+40 19 0:5 / /srv/node/disk3 rw - tmpfs tmpfs rw
+junk
+"""
+
+
+class TestMountTable(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.mountinfo = os.path.join(self.testdir, 'mountinfo')
+        with open(self.mountinfo, 'w') as f:
+            f.write(MOUNTINFO)
+        self.by_label = os.path.join(self.testdir, 'by-label')
+        os.makedirs(self.by_label)
+        os.symlink('../../sdb1', os.path.join(self.by_label, '0a000001h000'))
+        os.symlink('../../dm-0', os.path.join(self.by_label, 'my\\x20lv'))
+        self.mounts = check_mounts.MountTable.load(self.mountinfo,
+                                                   self.by_label)
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_load(self):
+        self.assertEqual(5, len(self.mounts.mounts))
+        self.assertEqual(
+            check_mounts.Mount('/dev/sdb1', 'xfs', ['rw', 'noatime']),
+            self.mounts.find('/srv/node/disk0/'))
+        self.assertEqual('/dev/mapper/vg-lv',
+                         self.mounts.find('/srv/node/disk two').source)
+        # The filesystem mounted last hides the one below it
+        self.assertEqual('tmpfs', self.mounts.find('/srv/node/disk3').fs_type)
+        self.assertIsNone(self.mounts.find('/srv/node/disk9'))
+
+        self.assertEqual('0a000001h000', self.mounts.label('/dev/sdb1'))
+        self.assertIsNone(self.mounts.label('/dev/sdc1'))
+
+    def test_no_mountinfo(self):
+        mounts = check_mounts.MountTable.load(
+            os.path.join(self.testdir, 'none'), self.by_label)
+        self.assertEqual({}, mounts.mounts)
+        self.assertIsNone(mounts.find('/'))
+
+    def test_checks(self):
+        d = check_mounts.Device('/dev/sdb1', '/srv/node/disk0',
+                                '0a000001h000')
+        for check in (check_mounts.is_mounted, check_mounts.is_valid_label,
+                      check_mounts.is_xfs, check_mounts.is_read_write):
+            self.assertTrue(check(d, {}, self.mounts), check.__name__)
+        self.assertFalse(check_mounts.is_valid_label(
+            d._replace(label='0a000001h001'), {}, self.mounts))
+
+        d = check_mounts.Device('/dev/sdc1', '/srv/node/disk1',
+                                check_mounts.LABEL_CHECK_DISABLED)
+        self.assertTrue(check_mounts.is_valid_label(d, {}, self.mounts))
+        self.assertFalse(check_mounts.is_read_write(d, {}, self.mounts))
+
+        d = check_mounts.Device('/dev/sdd1', '/srv/node/disk3', 'disk3')
+        self.assertFalse(check_mounts.is_xfs(d, {}, self.mounts))
+        self.assertFalse(check_mounts.is_valid_label(d, {}, self.mounts))
+
+        d = check_mounts.Device('/dev/sde1', '/srv/node/disk4', 'disk4')
+        self.assertFalse(check_mounts.is_mounted(d, {}, self.mounts))
+
+
+class TestProbeXfs(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.testdir, 'xfs_info.json')
+        self.devices = [
+            check_mounts.Device('/dev/sd%s1' % c, '/srv/node/disk%d' % n,
+                                check_mounts.LABEL_CHECK_DISABLED)
+            for n, c in enumerate('bcd')]
+        self.mounts = check_mounts.MountTable(
+            dict((d.mount, check_mounts.Mount(d.device, 'xfs', ['rw']))
+                 for d in self.devices), {})
+        self.failing = set(['/srv/node/disk1'])
+        self.calls = []
+        p = patch('swiftlm.systems.check_mounts.run_xfs_info',
+                  side_effect=self._fake_xfs_info)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _fake_xfs_info(self, mount_point):
+        self.calls.append(mount_point)
+        return mount_point not in self.failing
+
+    def _probe(self, devices, now):
+        return check_mounts.probe_xfs(devices, self.mounts, self.state_file,
+                                      now)
+
+    def test_probe_schedule(self):
+        expected = {'/srv/node/disk0': True, '/srv/node/disk1': False,
+                    '/srv/node/disk2': True}
+        self.assertEqual(expected, self._probe(self.devices, 1000))
+        self.assertEqual(sorted(expected), sorted(self.calls))
+
+        # Only the filesystem that failed is probed again
+        self.calls = []
+        self.assertEqual(expected, self._probe(self.devices, 1060))
+        self.assertEqual(['/srv/node/disk1'], self.calls)
+
+        # A different device mounted in place of another is probed
+        self.calls = []
+        self.mounts.mounts['/srv/node/disk2'] = check_mounts.Mount(
+            '/dev/sde1', 'xfs', ['rw'])
+        self._probe(self.devices, 1120)
+        self.assertEqual(['/srv/node/disk1', '/srv/node/disk2'],
+                         sorted(self.calls))
+
+        # Everything is probed once the interval has passed
+        self.calls = []
+        self.failing = set()
+        self._probe(self.devices, 1000 + check_mounts.XFS_INFO_INTERVAL)
+        self.assertEqual(['/srv/node/disk0', '/srv/node/disk1'],
+                         sorted(self.calls))
+
+        # A drive no longer checked is forgotten
+        self._probe(self.devices[:1], 1000 + check_mounts.XFS_INFO_INTERVAL)
+        self.assertEqual(['/srv/node/disk0'],
+                         list(load_json_state(self.state_file)))
+
+    def test_probes_run_in_parallel(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def slow_xfs_info(mount_point):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return True
+
+        devices = [check_mounts.Device('/dev/sdx', '/srv/node/disk%d' % n,
+                                       check_mounts.LABEL_CHECK_DISABLED)
+                   for n in range(12)]
+        with patch('swiftlm.systems.check_mounts.run_xfs_info',
+                   side_effect=slow_xfs_info), \
+                patch('swiftlm.systems.check_mounts.XFS_INFO_WORKERS', 4):
+            results = self._probe(devices, 1000)
+        self.assertEqual(12, len(results))
+        self.assertEqual(4, running[1])
+
+    def test_unwritable_state(self):
+        # The state directory is a file
+        cache = os.path.join(self.testdir, 'cache')
+        open(cache, 'w').close()
+        self.state_file = os.path.join(cache, 'xfs_info.json')
+        self.assertEqual(3, len(self._probe(self.devices, 1000)))
+
+
 class TestMain(unittest.TestCase):
     # In addition to validating individual failure modes, these tests
     # also validate the order in which checks are applied.
@@ -175,6 +337,12 @@ class TestMain(unittest.TestCase):
         self.p('swiftlm.utils.metricdata.get_base_dimensions', lambda: {})
         self.p('swiftlm.systems.check_mounts.BASE_RESULT.dimensions', {})
         self.p('swiftlm.systems.check_mounts.MOUNT_PATH', '')
+        self.fake_mountinfo = os.path.join(self.testdir, 'mountinfo')
+        self.p('swiftlm.systems.check_mounts.MOUNTINFO', self.fake_mountinfo)
+        self.p('swiftlm.systems.check_mounts.BY_LABEL',
+               os.path.join(self.testdir, 'by-label'))
+        self.p('swiftlm.systems.check_mounts.XFS_INFO_STATE_FILE',
+               os.path.join(self.testdir, 'xfs_info.json'))
 
         self.expected_metric_base = {
             'metric': 'swiftlm.systems.check_mounts',
@@ -207,6 +375,14 @@ class TestMain(unittest.TestCase):
             json.dump(j, f)
         return results
 
+    def _mount(self, mounts, options='rw,noatime'):
+        """ Write a mountinfo with an xfs filesystem at each mount point """
+        with open(self.fake_mountinfo, 'w') as f:
+            for number, mount_point in enumerate(sorted(mounts)):
+                f.write('%d 25 8:%d / %s %s shared:1 - xfs /dev/sd%s1 '
+                        'rw,attr2\n' % (40 + number, number, mount_point,
+                                        options, 'bcdef'[number]))
+
     def test_no_devices_found(self):
         actual = check_mounts.main()
 
@@ -243,7 +419,7 @@ class TestMain(unittest.TestCase):
         dev_info = self._make_devices(('sdd', 'sde'))
         # sdd is not mounted,
         # sde is mounted but has wrong perms
-        fake_is_mount = make_fake_is_mount(
+        self._mount(
             {dev_info['sde']['mount']: True})
         # oct(16804) = 040644
         fake_os_stat = make_fake_os_stat(
@@ -269,7 +445,6 @@ class TestMain(unittest.TestCase):
         expected.append(expected_metric)
 
         # avoid ridiculous nesting...
-        @mock.patch('os.path.ismount', fake_is_mount)
         @mock.patch('os.stat', fake_os_stat)
         def do_it(*args):
             actual = check_mounts.main()
@@ -289,7 +464,7 @@ class TestMain(unittest.TestCase):
         dev_info = self._make_devices(('sdd', 'sde'))
         # sdd is mounted, correct perms but wrong user group
         # sde is mounted but has wrong perms
-        fake_is_mount = make_fake_is_mount(
+        self._mount(
             {dev_info['sdd']['mount']: True,
              dev_info['sde']['mount']: True})
         fake_os_stat = make_fake_os_stat(
@@ -323,7 +498,6 @@ class TestMain(unittest.TestCase):
         expected.append(expected_metric)
 
         # avoid ridiculous nesting...
-        @mock.patch('os.path.ismount', fake_is_mount)
         @mock.patch('os.stat', fake_os_stat)
         @mock.patch('pwd.getpwuid', fake_getpwuid)
         @mock.patch('grp.getgrgid', fake_getgrgid)
@@ -342,7 +516,7 @@ class TestMain(unittest.TestCase):
 
     def test_not_valid_label(self):
         dev_info = self._make_devices(('sdd',))
-        fake_is_mount = make_fake_is_mount(
+        self._mount(
             {dev_info['sdd']['mount']: True})
         fake_os_stat = make_fake_os_stat(
             # oct(16877) = 040775, oct(16804) = 040644
@@ -361,7 +535,6 @@ class TestMain(unittest.TestCase):
                                     value_meta=expected_value_meta))
 
         # avoid ridiculous nesting...
-        @mock.patch('os.path.ismount', fake_is_mount)
         @mock.patch('os.stat', fake_os_stat)
         @mock.patch('pwd.getpwuid', fake_getpwuid)
         @mock.patch('grp.getgrgid', fake_getgrgid)
@@ -378,7 +551,7 @@ class TestMain(unittest.TestCase):
 
     def test_not_xfs(self):
         dev_info = self._make_devices(('sdd',))
-        fake_is_mount = make_fake_is_mount(
+        self._mount(
             {dev_info['sdd']['mount']: True})
         fake_os_stat = make_fake_os_stat(
             # oct(16877) = 040775, oct(16804) = 040644
@@ -397,7 +570,6 @@ class TestMain(unittest.TestCase):
                                     value_meta=expected_value_meta))
 
         # avoid ridiculous nesting...
-        @mock.patch('os.path.ismount', fake_is_mount)
         @mock.patch('os.stat', fake_os_stat)
         @mock.patch('pwd.getpwuid', fake_getpwuid)
         @mock.patch('grp.getgrgid', fake_getgrgid)
@@ -416,7 +588,7 @@ class TestMain(unittest.TestCase):
 
     def test_not_valid_xfs(self):
         dev_info = self._make_devices(('sdd',))
-        fake_is_mount = make_fake_is_mount(
+        self._mount(
             {dev_info['sdd']['mount']: True})
         fake_os_stat = make_fake_os_stat(
             # oct(16877) = 040775, oct(16804) = 040644
@@ -435,7 +607,6 @@ class TestMain(unittest.TestCase):
                                     value_meta=expected_value_meta))
 
         # avoid ridiculous nesting...
-        @mock.patch('os.path.ismount', fake_is_mount)
         @mock.patch('os.stat', fake_os_stat)
         @mock.patch('pwd.getpwuid', fake_getpwuid)
         @mock.patch('grp.getgrgid', fake_getgrgid)
@@ -458,7 +629,7 @@ class TestMain(unittest.TestCase):
         dev_info = self._make_devices(('sdd', 'sde'))
         # sdd is mounted, correct perms but wrong user group
         # sde is OK
-        fake_is_mount = make_fake_is_mount(
+        self._mount(
             {dev_info['sdd']['mount']: True,
              dev_info['sde']['mount']: True})
         fake_os_stat = make_fake_os_stat(
@@ -493,7 +664,6 @@ class TestMain(unittest.TestCase):
         expected.append(expected_metric)
 
         # avoid ridiculous nesting...
-        @mock.patch('os.path.ismount', fake_is_mount)
         @mock.patch('os.stat', fake_os_stat)
         @mock.patch('pwd.getpwuid', fake_getpwuid)
         @mock.patch('grp.getgrgid', fake_getgrgid)
@@ -514,3 +684,33 @@ class TestMain(unittest.TestCase):
                 expected.remove(metric)
             self.assertFalse(expected)
         do_it()
+
+    def test_read_only(self):
+        dev_info = self._make_devices(('sdd',))
+        self._mount({dev_info['sdd']['mount']: True}, options='ro,noatime')
+        fake_os_stat = make_fake_os_stat(
+            {dev_info['sdd']['mount']: dict(st_mode=16877,
+                                            st_uid=1000,
+                                            st_gid=1001)})
+
+        expected_value_meta = dict(
+            msg='{device} mounted at {mount} is read-only'
+            .format(**dev_info['sdd']))
+        expected_metric = dict(self.expected_metric_base)
+        expected_metric.update(dict(dimensions=dev_info['sdd'],
+                                    value=Severity.fail,
+                                    value_meta=expected_value_meta))
+
+        with mock.patch('os.stat', fake_os_stat), \
+                mock.patch('pwd.getpwuid',
+                           make_fake_getpwuid({1000: 'swift'})), \
+                mock.patch('grp.getgrgid',
+                           make_fake_getgrgid({1001: 'swift'})), \
+                mock.patch('swiftlm.systems.check_mounts.run_cmd') as \
+                mock_run_cmd:
+            actual = check_mounts.main()
+
+        self.assertEqual(1, len(actual))
+        self.assertEqual(expected_metric, actual[0].metric())
+        # Only xfs_info runs a command, and only on writable filesystems
+        self.assertFalse(mock_run_cmd.called)
@@ -17,6 +17,7 @@
 from shutil import rmtree
 import socket
 import tempfile
+import threading
 import unittest
 import mock
 import time
@@ -40,12 +41,12 @@ class TestConnectivity(unittest.TestCase):
         results = connectivity.main()
 
         mock_server_type.assert_called_with(ServerType.proxy)
-        # mock_get_hosts.assert_called_with(ring_type=None)
+        mock_get_hosts.assert_called_with(ring_type=None)
         self.assertTrue(mock_read.called)
 
-        self.assertEqual(2, len(results))
-        # for r in results:
-        #    self.assertEqual('No hosts to check', str(r))
+        self.assertEqual(3, len(results))
+        for r in results:
+            self.assertEqual('No hosts to check', str(r))
 
 
 class TestHostPort(unittest.TestCase):
@@ -68,8 +69,8 @@ class TestHostPort(unittest.TestCase):
 
 
 def fake_get_ring_hosts(ring_type):
-    results = [RingDeviceEntry('1.2.3.4', '6001', '/dev/sdb'),
-               RingDeviceEntry('1.2.3.5', '6001', '/dev/sdb')]
+    results = [RingDeviceEntry('1.2.3.4', '6001', '/dev/sdb', 10),
+               RingDeviceEntry('1.2.3.5', '6001', '/dev/sdb', 10)]
     return results
 
 
@@ -98,6 +99,30 @@ def make_fake_create_connection(connection_status, sendall_status):
     return fake_create_connection
 
 
+FAKE_LATENCY = 0.25
+
+
+def blocking_probe(targets, **kwargs):
+    """
+    Stands in for connectivity.probe(), using the blocking checks so that
+    socket.create_connection can be faked
+    """
+    results = {}
+    for hostport, kind in targets:
+        if kind == connectivity.MEMCACHE_PROBE:
+            check_result = connectivity.memcache_check(hostport)
+        else:
+            check_result = connectivity.connect_check(hostport)
+        if check_result[0]:
+            probe_result = connectivity.ProbeResult(True, [FAKE_LATENCY],
+                                                    None)
+        else:
+            probe_result = connectivity.ProbeResult(False, [],
+                                                    check_result[1])
+        results[(hostport, kind)] = probe_result
+    return results
+
+
 class TestMain(unittest.TestCase):
 
     def p(self, name, mock):
@@ -235,13 +260,18 @@ class TestMain(unittest.TestCase):
     #
         # fake memcache connections, one ok, one fails.
         # fake keystone connection succeeds
+        # fake ring host connections, one ok, one fails.
         connection_status = {('10.2.3.4', '5000'): 0,
                              ('1.2.3.4', '9998'): 0,
-                             ('1.2.3.5', '9999'): 0}
+                             ('1.2.3.5', '9999'): 0,
+                             ('1.2.3.4', '6001'): 0,
+                             ('1.2.3.5', '6001'): 1}
         sendall_returns = {('10.2.3.4', '5000'): 0,
                            ('1.2.3.4', '9998'): 0,
                            ('1.2.3.5', '9999'):
-                           socket.error('connection refused')}
+                           socket.error('connection refused'),
+                           ('1.2.3.4', '6001'): 0,
+                           ('1.2.3.5', '6001'): 0}
         fake_create_connection = make_fake_create_connection(
             connection_status=connection_status,
             sendall_status=sendall_returns)
@@ -264,11 +294,17 @@ class TestMain(unittest.TestCase):
                                         value_meta=expected_value_meta))
             expected.append(expected_metric)
 
-        scenarios = (('10.2.3.4', '5000', Severity.ok, '10.2.3.4:5000 ok'),)
+        scenarios = (('10.2.3.4', '5000', Severity.ok, '10.2.3.4:5000 ok'),
+                     ('1.2.3.4', '6001', Severity.ok, '1.2.3.4:6001 ok'),
+                     ('1.2.3.5', '6001', Severity.fail,
+                      '1.2.3.5:6001 connection refused'))
         for scenario in scenarios:
             expected_dimensions = dict(self.expected_dimensions_base)
             expected_dimensions.update({'hostname': scenario[0],
                                         'target_port': scenario[1]})
+            if scenario[2] == Severity.fail:
+                expected_dimensions.update({'fail_message':
+                                            'connection refused'})
             expected_value_meta = dict(msg=scenario[3])
             expected_metric = dict(self.expected_metric_base)
             expected_metric['metric'] += '.connect_check'
@@ -277,9 +313,28 @@ class TestMain(unittest.TestCase):
                                         value_meta=expected_value_meta))
             expected.append(expected_metric)
 
+        # latency of the targets connected to, and of this observer
+        for name, hostname, target_port in (
+                ('.memcache_check', '1.2.3.4', '9998'),
+                ('.connect_check', '10.2.3.4', '5000'),
+                ('.connect_check', '1.2.3.4', '6001'),
+                ('', None, None)):
+            for statistic in ('p50', 'p95', 'max'):
+                expected_dimensions = dict(self.expected_dimensions_base)
+                expected_dimensions['statistic'] = statistic
+                if hostname:
+                    expected_dimensions.update({'hostname': hostname,
+                                                'target_port': target_port})
+                expected_metric = dict(self.expected_metric_base)
+                expected_metric['metric'] += name + '.latency'
+                expected_metric.update(dict(dimensions=expected_dimensions,
+                                            value=FAKE_LATENCY))
+                expected.append(expected_metric)
+
         @patch(self.module + 'get_ring_hosts', fake_get_ring_hosts)
         @patch(self.module + 'server_type', lambda x: x == ServerType.proxy)
         # @patch(self.module + 'run_cmd', fake_ping)
+        @patch(self.module + 'probe', blocking_probe)
         @patch(self.module + 'socket.create_connection',
                fake_create_connection)
         def do_it():
@@ -327,7 +382,7 @@ class TestMain(unittest.TestCase):
             expected.append(expected_metric)
 
         # deal with missing targets...
-        for check in ['.memcache_check']:
+        for check in ['.memcache_check', '.connect_check']:
             expected_dimensions = dict(self.expected_dimensions_base)
             expected_value_meta = dict(msg='No hosts to check')
             expected_metric = dict(self.expected_metric_base)
@@ -338,7 +393,8 @@ class TestMain(unittest.TestCase):
             expected.append(expected_metric)
 
         @patch(self.module + 'server_type', lambda x: x == ServerType.proxy)
-        # @patch(self.module + 'get_ring_hosts', lambda *args: [])
+        @patch(self.module + 'get_ring_hosts', lambda *args, **kwargs: [])
+        @patch(self.module + 'probe', blocking_probe)
         @patch(self.module + 'socket.create_connection',
                fake_create_connection)
         def do_it():
@@ -351,3 +407,321 @@ class TestMain(unittest.TestCase):
                 expected.remove(metric_dict)
             self.assertFalse(expected, expected)
         do_it()
+
+
+class TestCheckAll(unittest.TestCase):
+
+    def setUp(self):
+        p = patch('swiftlm.systems.connectivity.BASE_RESULT.dimensions', {})
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_duplicate_targets_checked_once(self):
+        calls = []
+
+        def fake_check(hp):
+            calls.append(hp)
+            return (hp.port == '6001', 'connection refused')
+
+        targets = [connectivity.HostPort('1.2.3.4', '6001'),
+                   connectivity.HostPort('1.2.3.4', '6002'),
+                   connectivity.HostPort('1.2.3.4', '6001')]
+        results = []
+        connectivity.check_all([(targets, fake_check),
+                                (targets[:1], fake_check)], results)
+
+        self.assertEqual(2, len(calls))
+        self.assertEqual(['1.2.3.4:6001 ok',
+                          '1.2.3.4:6002 connection refused',
+                          '1.2.3.4:6001 ok'], [str(r) for r in results])
+
+    def test_deadline(self):
+        def slow_check(hp):
+            time.sleep(float(hp.port))
+            return (True,)
+
+        def broken_check(hp):
+            raise ValueError('broken')
+
+        # Many more slow targets than workers
+        slow = [connectivity.HostPort('10.0.0.%d' % i, '2')
+                for i in range(connectivity.MAX_THREAD_LIMIT * 10)]
+        fast = [connectivity.HostPort('10.0.1.1', '0')]
+        results = []
+        start = time.time()
+        connectivity.check_all([(fast, slow_check), (fast, broken_check),
+                                (slow, slow_check)],
+                               results, deadline=0.5)
+        self.assertLess(time.time() - start, 1.5)
+
+        self.assertEqual(len(slow) + 2, len(results))
+        self.assertEqual(Severity.ok, results[0].value)
+        self.assertEqual('10.0.1.1:0 broken', str(results[1]))
+        for r in results[2:]:
+            self.assertEqual(Severity.fail, r.value)
+            self.assertTrue(str(r).endswith(':2 timed out'), str(r))
+
+    def test_pool_workers(self):
+        pool = connectivity.CheckPool(workers=3)
+        running = []
+        most = []
+
+        def check(hp):
+            running.append(hp)
+            most.append(len(running))
+            time.sleep(0.02)
+            running.remove(hp)
+            return (True,)
+
+        for i in range(12):
+            pool.add(connectivity.HostPort('10.0.0.%d' % i, '6000'), check)
+        results = pool.run()
+        self.assertEqual(12, len(results))
+        self.assertTrue(all(r == (True,) for r in results.values()))
+        self.assertEqual(3, max(most))
+
+    def test_get_ring_targets(self):
+        with patch('swiftlm.systems.connectivity.get_ring_hosts',
+                   lambda ring_type: [
+                       RingDeviceEntry('1.2.3.4', 6001, 'a', 10),
+                       RingDeviceEntry('1.2.3.4', 6001, 'b', 10),
+                       RingDeviceEntry('1.2.3.4', 6002, 'a', 10),
+                       # No partitions assigned yet, still checked
+                       RingDeviceEntry('1.2.3.5', 6001, 'a', 0)]):
+            self.assertEqual([('1.2.3.4', '6001'), ('1.2.3.4', '6002'),
+                              ('1.2.3.5', '6001')],
+                             connectivity.get_ring_targets())
+
+        with patch('swiftlm.systems.connectivity.get_ring_hosts',
+                   side_effect=IOError('bad ring')):
+            self.assertEqual([], connectivity.get_ring_targets())
+
+
+class FakeMemcache(threading.Thread):
+    """ Accepts connections and replies to stats (unless silent) """
+    def __init__(self, silent=False):
+        super(FakeMemcache, self).__init__()
+        self.daemon = True
+        self.silent = silent
+        self.listener = socket.socket()
+        self.listener.bind(('0.0.0.0', 0))
+        self.listener.listen(128)
+        self.port = str(self.listener.getsockname()[1])
+        self.connections = []
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            self.connections.append(conn)
+            if not self.silent and conn.recv(1024) == b'stats\n':
+                conn.sendall(b'STAT pid 1\r\nEND\r\n')
+
+    def close(self):
+        self.listener.close()
+        for conn in self.connections:
+            conn.close()
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = str(sock.getsockname()[1])
+    sock.close()
+    return port
+
+
+class TestProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeMemcache()
+        self.server.start()
+        self.addCleanup(self.server.close)
+        self.target = connectivity.HostPort('127.0.0.1', self.server.port)
+
+    def test_connect(self):
+        refused = connectivity.HostPort('127.0.0.1', closed_port())
+        results = connectivity.probe(
+            [(self.target, connectivity.CONNECT_PROBE),
+             (refused, connectivity.CONNECT_PROBE),
+             (self.target, connectivity.CONNECT_PROBE)])
+
+        self.assertEqual(2, len(results))
+        ok = results[(self.target, connectivity.CONNECT_PROBE)]
+        self.assertTrue(ok.ok)
+        self.assertEqual(1, len(ok.latencies))
+        self.assertTrue(0 <= ok.latencies[0] < 1, ok.latencies)
+        self.assertIsNone(ok.reason)
+
+        # The reason is the same as the blocking check's
+        fail = results[(refused, connectivity.CONNECT_PROBE)]
+        self.assertEqual((False, []), fail[:2])
+        self.assertEqual(connectivity.connect_check(refused)[1], fail.reason)
+
+    def test_memcache(self):
+        results = connectivity.probe(
+            [(self.target, connectivity.MEMCACHE_PROBE)])
+        self.assertTrue(results[(self.target,
+                                 connectivity.MEMCACHE_PROBE)].ok)
+
+        silent = FakeMemcache(silent=True)
+        silent.start()
+        self.addCleanup(silent.close)
+        target = connectivity.HostPort('127.0.0.1', silent.port)
+        start = time.time()
+        results = connectivity.probe(
+            [(target, connectivity.MEMCACHE_PROBE),
+             (target, connectivity.CONNECT_PROBE)], timeout=0.3)
+        self.assertLess(time.time() - start, 2)
+        result = results[(target, connectivity.MEMCACHE_PROBE)]
+        self.assertEqual((False, 'timed out'), (result.ok, result.reason))
+        self.assertEqual([], result.latencies)
+        self.assertTrue(results[(target, connectivity.CONNECT_PROBE)].ok)
+
+    def test_many_targets(self):
+        # More targets than sockets allowed at once, from one thread
+        targets = [(connectivity.HostPort('127.0.0.1', self.server.port),
+                    connectivity.MEMCACHE_PROBE)]
+        for i in range(300):
+            port = self.server.port if i % 2 else closed_port()
+            targets.append((connectivity.HostPort('127.0.0.%d' % (i % 3 + 1),
+                                                  port),
+                            connectivity.CONNECT_PROBE))
+        results = connectivity.probe(targets, max_sockets=16)
+        self.assertEqual(len(set(targets)), len(results))
+        for (hostport, kind), result in results.items():
+            self.assertEqual(hostport.port == self.server.port, result.ok,
+                             (hostport, result))
+
+    def test_resolved_once(self):
+        lookups = []
+        real_getaddrinfo = socket.getaddrinfo
+
+        def getaddrinfo(host, *args):
+            lookups.append(host)
+            if host == 'unknown.example.com':
+                raise socket.gaierror(socket.EAI_NONAME, 'Name unknown')
+            return real_getaddrinfo(host, *args)
+
+        unknown = connectivity.HostPort('unknown.example.com', '11211')
+        targets = [(self.target, connectivity.MEMCACHE_PROBE),
+                   (self.target, connectivity.CONNECT_PROBE),
+                   (unknown, connectivity.MEMCACHE_PROBE),
+                   (unknown, connectivity.CONNECT_PROBE)]
+        with patch('swiftlm.systems.connectivity.socket.getaddrinfo',
+                   getaddrinfo):
+            results = connectivity.probe(targets, samples=3)
+        self.assertEqual(['127.0.0.1', 'unknown.example.com'], lookups)
+        for target in targets[:2]:
+            self.assertTrue(results[target].ok)
+            self.assertEqual(3, len(results[target].latencies))
+        for target in targets[2:]:
+            self.assertEqual((False, [], '[Errno %d] Name unknown' %
+                              socket.EAI_NONAME), results[target])
+
+    def test_latency_from_connect(self):
+        real_socket = socket.socket
+
+        def slow_socket(*args):
+            time.sleep(0.2)
+            return real_socket(*args)
+
+        targets = [(self.target, connectivity.CONNECT_PROBE),
+                   (self.target, connectivity.MEMCACHE_PROBE)]
+        with patch('swiftlm.systems.connectivity.socket.socket',
+                   slow_socket):
+            results = connectivity.probe(targets, max_sockets=1)
+        # Not including the time taken to set up the socket
+        for target in targets:
+            self.assertTrue(results[target].ok)
+            self.assertLess(results[target].latencies[0], 0.2)
+
+    def test_deadline(self):
+        silent = FakeMemcache(silent=True)
+        silent.start()
+        self.addCleanup(silent.close)
+        targets = [(connectivity.HostPort('127.0.0.1', silent.port),
+                    connectivity.MEMCACHE_PROBE),
+                   (self.target, connectivity.CONNECT_PROBE)]
+        results = connectivity.probe(targets, deadline=0.2, max_sockets=1)
+        self.assertEqual([(False, 'timed out')] * 2,
+                         [(results[t].ok, results[t].reason)
+                          for t in targets])
+
+    def test_samples(self):
+        refused = connectivity.HostPort('127.0.0.1', closed_port())
+        results = connectivity.probe(
+            [(self.target, connectivity.MEMCACHE_PROBE),
+             (self.target, connectivity.CONNECT_PROBE),
+             (refused, connectivity.CONNECT_PROBE)], samples=5)
+        for kind in (connectivity.MEMCACHE_PROBE, connectivity.CONNECT_PROBE):
+            result = results[(self.target, kind)]
+            self.assertTrue(result.ok)
+            self.assertEqual(5, len(result.latencies))
+        result = results[(refused, connectivity.CONNECT_PROBE)]
+        self.assertEqual((False, []), result[:2])
+
+    def test_samples_deadline(self):
+        silent = FakeMemcache(silent=True)
+        silent.start()
+        self.addCleanup(silent.close)
+        slow = connectivity.HostPort('127.0.0.1', silent.port)
+        targets = [(self.target, connectivity.CONNECT_PROBE),
+                   (slow, connectivity.MEMCACHE_PROBE)]
+        results = connectivity.probe(targets, deadline=0.3, samples=10 ** 6)
+        # Ok with the samples taken before the deadline
+        result = results[targets[0]]
+        self.assertTrue(result.ok)
+        self.assertTrue(0 < len(result.latencies) < 10 ** 6)
+        self.assertEqual((False, [], 'timed out'), results[targets[1]])
+
+    def test_latency_results(self):
+        self.assertEqual(1, connectivity.percentile([1], 50))
+        values = list(range(1, 101))
+        self.assertEqual(50, connectivity.percentile(values, 50))
+        self.assertEqual(95, connectivity.percentile(values, 95))
+        self.assertEqual(1, connectivity.percentile(values, 0))
+
+        with patch('swiftlm.systems.connectivity.BASE_RESULT.dimensions', {}):
+            results = connectivity.latency_results(
+                'connect_check.latency', [0.3, 0.1, 0.2, 0.5],
+                {'hostname': 'host'})
+        self.assertEqual(
+            [('swiftlm.systems.connectivity.connect_check.latency',
+              {'hostname': 'host', 'statistic': statistic}, value)
+             for statistic, value in (('p50', 0.2), ('p95', 0.5),
+                                      ('max', 0.5))],
+            [(r.name, r.dimensions, r.value) for r in results])
+
+    def test_check_all(self):
+        with patch('swiftlm.systems.connectivity.BASE_RESULT.dimensions', {}):
+            results = []
+            connectivity.check_all([([self.target],
+                                     connectivity.memcache_check),
+                                    ([self.target],
+                                     connectivity.connect_check)], results)
+        name = 'swiftlm.systems.connectivity.'
+        self.assertEqual([name + 'memcache_check'] +
+                         [name + 'memcache_check.latency'] * 3 +
+                         [name + 'connect_check'] +
+                         [name + 'connect_check.latency'] * 3 +
+                         [name + 'latency'] * 3,
+                         [r.name for r in results])
+        self.assertEqual('127.0.0.1:%s ok' % self.server.port,
+                         str(results[0]))
+        self.assertEqual(Severity.ok, results[4].value)
+        self.assertEqual({'hostname': '127.0.0.1',
+                          'target_port': self.server.port,
+                          'statistic': 'p50'},
+                         results[1].dimensions)
+        self.assertEqual(['p50', 'p95', 'max'] * 3,
+                         [r['statistic'] for r in results
+                          if r.name.endswith('latency')])
+        for r in results[1:4] + results[5:]:
+            self.assertIsInstance(r.value, float)
+        # The observer summary covers all the samples
+        self.assertEqual(max(results[3].value, results[7].value),
+                         results[10].value)
+        self.assertEqual({'statistic': 'max'}, results[10].dimensions)
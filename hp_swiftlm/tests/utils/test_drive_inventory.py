@@ -0,0 +1,143 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import os
+from shutil import rmtree
+import tempfile
+import unittest
+
+from swiftlm.utils import drive_inventory
+from swiftlm.utils.drive_inventory import DriveInventory
+
+
+def write_file(path, content):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def make_device(sys_block, name, size, dev, number=None, parent=None):
+    path = os.path.join(sys_block, parent or '', name)
+    write_file(os.path.join(path, 'size'), '%d\n' % size)
+    write_file(os.path.join(path, 'dev'), '%s\n' % dev)
+    if number is not None:
+        write_file(os.path.join(path, 'partition'), '%d\n' % number)
+    # A sub-directory that is not a partition
+    write_file(os.path.join(path, 'queue', 'rotational'), '1\n')
+
+
+def make_udev(udev_data, dev, **properties):
+    lines = ['S:disk/by-id/fake', 'W:1']
+    lines.extend('E:%s=%s' % item for item in sorted(properties.items()))
+    write_file(os.path.join(udev_data, 'b' + dev), '\n'.join(lines) + '\n')
+
+
+class TestDriveInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.sys_block = os.path.join(self.testdir, 'sys', 'block')
+        self.udev_data = os.path.join(self.testdir, 'udev')
+        self.by_label = os.path.join(self.testdir, 'by-label')
+        os.makedirs(self.by_label)
+
+        # A gpt drive with an xfs partition and a boot partition
+        make_device(self.sys_block, 'sda', 7814037168, '8:0')
+        make_device(self.sys_block, 'sda1', 2048, '8:1', 1, 'sda')
+        make_device(self.sys_block, 'sda2', 7814033072, '8:2', 2, 'sda')
+        make_udev(self.udev_data, '8:0', ID_PART_TABLE_TYPE='gpt')
+        make_udev(self.udev_data, '8:1', ID_PART_ENTRY_NAME='primary',
+                  ID_PART_ENTRY_TYPE=drive_inventory.BIOS_GRUB_TYPE)
+        make_udev(self.udev_data, '8:2', ID_FS_TYPE='xfs',
+                  ID_FS_LABEL='0a000001h000', ID_PART_ENTRY_NAME='swift')
+        # A blank drive
+        make_device(self.sys_block, 'sdb', 7814037168, '8:16')
+        make_udev(self.udev_data, '8:16')
+        # A drive udev knows nothing about, labelled through by-label
+        make_device(self.sys_block, 'sdc', 1024, '8:32')
+        os.symlink('../../sdc', os.path.join(self.by_label, 'my\\x20label'))
+        # An lvm volume
+        make_device(self.sys_block, 'dm-0', 4096, '252:0')
+        make_udev(self.udev_data, '252:0', ID_FS_TYPE='xfs',
+                  ID_FS_LABEL='0a000001v0')
+        # Not a device
+        write_file(os.path.join(self.sys_block, 'junk', 'size'), 'junk')
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _load(self):
+        return DriveInventory.load(self.sys_block, self.udev_data,
+                                   self.by_label)
+
+    def test_load(self):
+        inventory = self._load()
+        self.assertEqual(['dm-0', 'sda', 'sda1', 'sda2', 'sdb', 'sdc'],
+                         sorted(d.name for d in inventory.devices))
+
+        sda = inventory.find('/dev/sda')
+        self.assertEqual('/dev/sda', sda.path)
+        self.assertEqual(7814037168 * 512, sda.size_bytes)
+        self.assertTrue(sda.udev)
+        self.assertTrue(sda.has_label)
+        self.assertEqual([1, 2], [p.number for p in sda.partitions])
+        self.assertEqual(['bios_grub'], sda.partitions[0].flags())
+        sda2 = inventory.find('/dev/sda2')
+        self.assertIs(sda.partitions[1], sda2)
+        self.assertIs(sda, sda2.parent)
+        self.assertEqual(('xfs', '0a000001h000', 'swift'),
+                         (sda2.fs_type, sda2.fs_label, sda2.part_name))
+        self.assertEqual([], sda2.flags())
+
+        sdb = inventory.find('/dev/sdb')
+        self.assertTrue(sdb.udev)
+        self.assertFalse(sdb.has_label)
+
+        sdc = inventory.find('/dev/sdc')
+        self.assertFalse(sdc.udev)
+        self.assertEqual('my label', sdc.fs_label)
+        self.assertEqual(1024 * 512, sdc.size_bytes)
+
+        self.assertIsNone(inventory.find('/dev/sdz'))
+
+    def test_find_link(self):
+        inventory = self._load()
+        volume = os.path.join(self.testdir, 'vg', 'lv')
+        os.makedirs(os.path.dirname(volume))
+        os.symlink('/dev/dm-0', volume)
+        self.assertEqual('0a000001v0', inventory.find(volume).fs_label)
+
+    def test_forget(self):
+        inventory = self._load()
+        inventory.forget('/dev/sda')
+        self.assertIsNone(inventory.find('/dev/sda'))
+        self.assertIsNone(inventory.find('/dev/sda2'))
+        self.assertIsNotNone(inventory.find('/dev/sdb'))
+
+    def test_no_sysfs(self):
+        inventory = DriveInventory.load(os.path.join(self.testdir, 'none'),
+                                        self.udev_data, self.by_label)
+        self.assertEqual(0, len(inventory))
+        self.assertIsNone(inventory.find('/dev/sda'))
+
+    def test_product_name(self):
+        path = os.path.join(self.testdir, 'product_name')
+        self.assertIsNone(drive_inventory.get_product_name(path))
+        write_file(path, 'ProLiant SL4540 Gen8\n')
+        self.assertEqual('ProLiant SL4540 Gen8',
+                         drive_inventory.get_product_name(path))
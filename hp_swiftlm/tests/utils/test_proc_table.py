@@ -0,0 +1,144 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import ast
+import os
+from shutil import rmtree
+import tempfile
+import unittest
+
+import mock
+
+from swiftlm.utils import proc_table
+from swiftlm.utils.proc_table import ProcessTable
+
+
+def make_process(proc_dir, pid, cmdline, utime=0, stime=0, rss=0,
+                 comm='python'):
+    pid_dir = os.path.join(proc_dir, str(pid))
+    os.makedirs(pid_dir)
+    with open(os.path.join(pid_dir, 'cmdline'), 'wb') as f:
+        f.write(cmdline.encode('utf-8'))
+    # pid (comm) state ppid ... utime stime ... rss
+    fields = ['S'] + ['0'] * 40
+    fields[proc_table.STAT_UTIME] = str(utime)
+    fields[proc_table.STAT_STIME] = str(stime)
+    fields[proc_table.STAT_RSS] = str(rss)
+    with open(os.path.join(pid_dir, 'stat'), 'w') as f:
+        f.write('%d (%s) %s\n' % (pid, comm, ' '.join(fields)))
+
+
+class TestProcessTable(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        make_process(self.testdir, 100,
+                     '/usr/bin/python\0/usr/bin/swift-object-server\0'
+                     '/etc/swift/object-server.conf\0',
+                     utime=150, stime=50, rss=1000)
+        make_process(self.testdir, 101,
+                     '/usr/bin/python\0/usr/bin/swift-object-server\0'
+                     '/etc/swift/object-server.conf\0',
+                     utime=100, rss=500, comm='swift (object) server')
+        make_process(self.testdir, 20, '/usr/bin/swift-proxy-server\0')
+        make_process(self.testdir, 30, 'nginx: master process')
+        make_process(self.testdir, 40,
+                     'tail\0-f\0/var/log/swift/swift-object-server.log\0')
+        make_process(self.testdir, 50, '/usr/bin/python\0-m\0swift\0')
+        # A kernel thread
+        make_process(self.testdir, 2, '')
+        # Not a process
+        os.makedirs(os.path.join(self.testdir, 'net'))
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_command_names(self):
+        self.assertEqual(['python', 'swift-object-server'],
+                         proc_table.command_names(
+                             '/usr/bin/python\0/usr/bin/swift-object-server'
+                             '\0/etc/swift/object-server.conf\0'))
+        self.assertEqual(['python', 'swift-object-server'],
+                         proc_table.command_names(
+                             'python\0-u\0-W\0ignore\0'
+                             '/usr/bin/swift-object-server\0'))
+        self.assertEqual(['python2.7', 'swift'],
+                         proc_table.command_names('python2.7\0-m\0swift\0'))
+        self.assertEqual(['python'],
+                         proc_table.command_names('python\0-c\0import\0'))
+        self.assertEqual(['tail'],
+                         proc_table.command_names('tail\0-f\0a.log\0'))
+        self.assertEqual(['nginx:', 'master'],
+                         proc_table.command_names('nginx: master process'))
+        self.assertEqual([], proc_table.command_names(''))
+
+    def test_load(self):
+        with mock.patch('os.listdir', side_effect=os.listdir) as listdir:
+            processes = ProcessTable.load(self.testdir)
+        listdir.assert_called_once_with(self.testdir)
+
+        self.assertEqual(6, len(processes))
+        self.assertEqual([100, 101], processes.pids('swift-object-server'))
+        self.assertEqual(2, processes.count('swift-object-server'))
+        self.assertTrue(processes.is_running('swift-proxy-server'))
+        self.assertFalse(processes.is_running('swift-account-server'))
+        self.assertEqual([], processes.pids('swift-account-server'))
+        # Only the command, not its arguments
+        self.assertEqual([40], processes.pids('tail'))
+        self.assertFalse(processes.is_running('swift-object-server.log'))
+        self.assertEqual('/usr/bin/swift-proxy-server', processes.cmdlines[20])
+
+    def test_no_proc(self):
+        processes = ProcessTable.load(os.path.join(self.testdir, 'none'))
+        self.assertEqual(0, len(processes))
+        self.assertFalse(processes.is_running('swift-object-server'))
+
+    def test_stats(self):
+        processes = ProcessTable.load(self.testdir)
+        with mock.patch.multiple(proc_table, CLOCK_TICKS=100,
+                                 PAGE_SIZE=4096):
+            stats = processes.stats(processes.pids('swift-object-server'))
+            self.assertEqual((1500 * 4096, 3.0), stats)
+            # A process that has exited is left out
+            rmtree(os.path.join(self.testdir, '101'))
+            self.assertEqual((1000 * 4096, 2.0),
+                             processes.stats([100, 101]))
+
+
+class TestCinderlmCopy(unittest.TestCase):
+
+    cinderlm_copy = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                                 'hp_cinderlm', 'cinderlm', 'proc_table.py')
+
+    def _code(self, path):
+        # The module, less its docstrings
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if (isinstance(node, (ast.Module, ast.ClassDef,
+                                  ast.FunctionDef)) and
+                    isinstance(node.body[0], ast.Expr) and
+                    isinstance(node.body[0].value, ast.Str)):
+                node.body = node.body[1:]
+        return ast.dump(tree)
+
+    def test_same_code(self):
+        if not os.path.exists(self.cinderlm_copy):
+            raise unittest.SkipTest('no cinderlm source')
+        self.assertEqual(self._code(proc_table.__file__.rstrip('c')),
+                         self._code(self.cinderlm_copy),
+                         'cinderlm.proc_table differs from '
+                         'swiftlm.utils.proc_table')
@@ -0,0 +1,328 @@
+# (c) Copyright 2015 Hewlett Packard Enterprise Development Company LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+
+import array
+from collections import Counter
+from gzip import GzipFile
+import json
+from shutil import rmtree
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+import mock
+
+from swiftlm.utils import ringdata
+from swiftlm.utils.ringdata import RingData, RingIndex
+
+
+PART_POWER = 6
+PART_COUNT = 1 << PART_POWER
+
+
+def make_devs():
+    devs = []
+    for region in (1, 2):
+        for zone in (1, 2):
+            for server in (1, 2):
+                for disk in range(2):
+                    devs.append({
+                        'id': len(devs),
+                        'region': region,
+                        'zone': zone,
+                        'ip': '10.%d.%d.%d' % (region, zone, server),
+                        'port': 6000,
+                        'device': 'disk%d' % disk,
+                        'weight': 100.0 if region == 1 else 50.0,
+                    })
+    # A removed device
+    devs.append(None)
+    return devs
+
+
+def make_ring(replicas=3, fraction=0, seed=1):
+    rnd = random.Random(seed)
+    devs = make_devs()
+    ids = [d['id'] for d in devs if d]
+    tables = []
+    for r in range(replicas):
+        tables.append(array.array(
+            'H', [rnd.choice(ids) for _ in range(PART_COUNT)]))
+    if fraction:
+        tables.append(array.array(
+            'H', [rnd.choice(ids) for _ in range(fraction)]))
+    return RingData(tables, devs, 32 - PART_POWER)
+
+
+def write_ring(path, ring):
+    devs = ring.devs
+    meta = json.dumps({'devs': devs, 'part_shift': ring._part_shift,
+                       'replica_count': len(ring._replica2part2dev_id)})
+    with GzipFile(path, 'wb') as f:
+        f.write(b'R1NG')
+        f.write(struct.pack('!H', 1))
+        f.write(struct.pack('!I', len(meta)))
+        f.write(meta.encode('utf-8'))
+        for p2d in ring._replica2part2dev_id:
+            f.write(p2d.tostring())
+
+
+class TestRingData(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_load_v1(self):
+        ring = make_ring()
+        path = os.path.join(self.testdir, 'object.ring.gz')
+        write_ring(path, ring)
+        loaded = RingData.load(path)
+        self.assertEqual(ring.devs, loaded.devs)
+        self.assertEqual(ring._part_shift, loaded._part_shift)
+        self.assertEqual(ring._replica2part2dev_id,
+                         loaded._replica2part2dev_id)
+
+
+class TestRingCache(unittest.TestCase):
+    use_numpy = False
+
+    def setUp(self):
+        if self.use_numpy:
+            if ringdata.numpy is None:
+                self.skipTest('numpy is not installed')
+        else:
+            p = mock.patch('swiftlm.utils.ringdata.numpy', None)
+            p.start()
+            self.addCleanup(p.stop)
+        self.testdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.testdir, 'cache')
+        self.ring = make_ring()
+        self.path = os.path.join(self.testdir, 'object.ring.gz')
+        write_ring(self.path, self.ring)
+        self.cache_path = os.path.join(self.cache_dir, 'object.ring.raw')
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _assert_ring_equal(self, expected, actual):
+        self.assertEqual(expected.devs, actual.devs)
+        self.assertEqual(expected._part_shift, actual._part_shift)
+        self.assertEqual(
+            [list(t) for t in expected._replica2part2dev_id],
+            [list(t) for t in actual._replica2part2dev_id])
+
+    def test_cache_written_and_used(self):
+        loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+        self._assert_ring_equal(self.ring, loaded)
+        self.assertTrue(os.path.isfile(self.cache_path))
+        self.assertEqual(['object.ring.raw'], os.listdir(self.cache_dir))
+
+        with mock.patch('swiftlm.utils.ringdata.GzipFile') as mock_gzip:
+            loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+        self.assertFalse(mock_gzip.called)
+        self._assert_ring_equal(self.ring, loaded)
+
+        # the ring can be queried from the cache
+        self.assertEqual(RingIndex(self.ring).dev_part_counts(),
+                         RingIndex(loaded).dev_part_counts())
+        self.assertEqual(RingIndex(self.ring).dispersion('server'),
+                         RingIndex(loaded).dispersion('server'))
+
+    def test_cache_rebuilt_when_ring_changes(self):
+        RingData.load(self.path, cache_dir=self.cache_dir)
+        ring = make_ring(seed=2)
+        write_ring(self.path, ring)
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+
+        loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+        self._assert_ring_equal(ring, loaded)
+        with mock.patch('swiftlm.utils.ringdata.GzipFile') as mock_gzip:
+            loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+        self.assertFalse(mock_gzip.called)
+        self._assert_ring_equal(ring, loaded)
+
+    def test_bad_cache_ignored(self):
+        os.makedirs(self.cache_dir)
+        for content in (b'', b'junk', ringdata.CACHE_MAGIC + b'\0\0\0\xff'):
+            with open(self.cache_path, 'wb') as f:
+                f.write(content)
+            loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+            self._assert_ring_equal(self.ring, loaded)
+
+    def test_truncated_cache_ignored(self):
+        RingData.load(self.path, cache_dir=self.cache_dir)
+        with open(self.cache_path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.cache_path) - 2)
+        loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+        self._assert_ring_equal(self.ring, loaded)
+
+    def test_unused_cache_closed(self):
+        mapped = []
+        real_mmap = ringdata.mmap.mmap
+
+        def record_mmap(*args, **kwargs):
+            mapped.append(real_mmap(*args, **kwargs))
+            return mapped[-1]
+
+        def load():
+            del mapped[:]
+            with mock.patch.object(ringdata.mmap, 'mmap', record_mmap):
+                return RingData.load(self.path, cache_dir=self.cache_dir)
+
+        RingData.load(self.path, cache_dir=self.cache_dir)
+        self._assert_ring_equal(self.ring, load())
+        self.assertEqual(1, len(mapped))
+        # still mapped by the loaded tables
+        self.assertEqual(ringdata.CACHE_MAGIC,
+                         mapped[0][:len(ringdata.CACHE_MAGIC)])
+
+        # stale
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+        self._assert_ring_equal(self.ring, load())
+        self.assertEqual(1, len(mapped))
+        self.assertRaises(ValueError, lambda: mapped[0][:1])
+
+        # truncated
+        with open(self.cache_path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.cache_path) - 2)
+        self._assert_ring_equal(self.ring, load())
+        self.assertEqual(1, len(mapped))
+        self.assertRaises(ValueError, lambda: mapped[0][:1])
+
+    def test_unwritable_cache_dir(self):
+        # a file where the cache dir should be
+        with open(self.cache_dir, 'wb'):
+            pass
+        loaded = RingData.load(self.path, cache_dir=self.cache_dir)
+        self._assert_ring_equal(self.ring, loaded)
+
+
+class TestRingCacheNumpy(TestRingCache):
+    use_numpy = True
+
+
+class TestRingIndex(unittest.TestCase):
+    use_numpy = False
+
+    def setUp(self):
+        if self.use_numpy:
+            if ringdata.numpy is None:
+                self.skipTest('numpy is not installed')
+        else:
+            p = mock.patch('swiftlm.utils.ringdata.numpy', None)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _assignments(self, ring):
+        # (part, replica, dev_id) for every assignment, the slow way
+        for r, p2d in enumerate(ring._replica2part2dev_id):
+            for part, dev_id in enumerate(p2d):
+                yield part, r, dev_id
+
+    def test_replica_count(self):
+        self.assertEqual(3, RingIndex(make_ring()).replica_count)
+        self.assertEqual(
+            2.5, RingIndex(make_ring(2, PART_COUNT // 2)).replica_count)
+
+    def test_get_part_devices(self):
+        ring = make_ring(2, 10)
+        index = RingIndex(ring)
+        r2p2d = ring._replica2part2dev_id
+        self.assertEqual([ring.devs[r2p2d[0][5]], ring.devs[r2p2d[1][5]],
+                          ring.devs[r2p2d[2][5]]],
+                         index.get_part_devices(5))
+        self.assertEqual([ring.devs[r2p2d[0][20]], ring.devs[r2p2d[1][20]]],
+                         index.get_part_devices(20))
+
+    def test_dev_part_counts(self):
+        for ring in (make_ring(), make_ring(2, 7)):
+            expected = Counter(d for _, _, d in self._assignments(ring))
+            counts = RingIndex(ring).dev_part_counts()
+            self.assertEqual(len(ring.devs), len(counts))
+            for dev_id, count in enumerate(counts):
+                self.assertEqual(expected[dev_id], count)
+            self.assertEqual(0, counts[-1])
+
+    def test_dev_balance(self):
+        ring = make_ring()
+        index = RingIndex(ring)
+        counts = index.dev_part_counts()
+        balance = index.dev_balance()
+        total_weight = sum(d['weight'] for d in ring.devs if d)
+        for dev in ring.devs[:-1]:
+            desired = 3 * PART_COUNT * dev['weight'] / total_weight
+            self.assertAlmostEqual(
+                100.0 * (counts[dev['id']] - desired) / desired,
+                balance[dev['id']])
+        self.assertEqual(len(ring.devs) - 1, len(balance))
+
+    def test_tier_part_counts(self):
+        ring = make_ring()
+        index = RingIndex(ring)
+        expected = Counter()
+        for _, _, dev_id in self._assignments(ring):
+            dev = ring.devs[dev_id]
+            expected[(dev['region'], dev['zone'])] += 1
+        self.assertEqual(dict(expected), index.tier_part_counts('zone'))
+        regions = index.tier_part_counts('region')
+        self.assertEqual(3 * PART_COUNT, sum(regions.values()))
+        self.assertEqual([(1,), (2,)], sorted(regions))
+
+    def test_tier_balance(self):
+        ring = make_ring()
+        index = RingIndex(ring)
+        counts = index.tier_part_counts('region')
+        balance = index.tier_balance('region')
+        # region 1 has two thirds of the weight
+        desired = 3 * PART_COUNT * 2 / 3.0
+        self.assertAlmostEqual(100.0 * (counts[(1,)] - desired) / desired,
+                               balance[(1,)])
+
+    def test_dispersion(self):
+        for ring in (make_ring(), make_ring(2, 9)):
+            index = RingIndex(ring)
+            for tier, key in ringdata.TIERS:
+                by_part = {}
+                for part, _, dev_id in self._assignments(ring):
+                    by_part.setdefault(part, []).append(
+                        key(ring.devs[dev_id]))
+                expected = sum(1 for tiers in by_part.values()
+                               if len(set(tiers)) < len(tiers))
+                count, percent = index.dispersion(tier)
+                self.assertEqual(expected, count, tier)
+                self.assertAlmostEqual(100.0 * expected / PART_COUNT,
+                                       percent)
+
+    def test_fully_dispersed(self):
+        devs = make_devs()
+        tables = [array.array('H', [r * 4 + (p % 2)
+                                    for p in range(PART_COUNT)])
+                  for r in range(3)]
+        index = RingIndex(RingData(tables, devs, 32 - PART_POWER))
+        # devices 0/1, 4/5 and 8/9 are in different zones of region 1 and 2
+        self.assertEqual((0, 0.0), index.dispersion('zone'))
+        self.assertEqual((PART_COUNT, 100.0), index.dispersion('region'))
+
+
+class TestRingIndexNumpy(TestRingIndex):
+    use_numpy = True
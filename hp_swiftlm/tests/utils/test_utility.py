@@ -14,6 +14,7 @@
 #
 
 
+import array
 import json
 import os
 import tempfile
@@ -24,6 +25,7 @@ import six
 from shutil import rmtree
 
 from swiftlm.utils import utility
+from swiftlm.utils.ringdata import RingData
 from swiftlm.utils.utility import RingDeviceEntry
 from swiftlm.utils.values import Severity, ServerType
 
@@ -64,60 +66,38 @@ class TestUtility(unittest.TestCase):
         with self.assertRaisesRegexp(ValueError, 'ServerType'):
             utility.server_type('test')
 
-    @mock.patch(COMMANDS_MODULE + '.getoutput')
-    def test_ip_to_interface(self, mock_command):
-
-        # testing:
-        # duplicate interfaces/variable lines and whitespace/no inet addr
-        mock_data = 'Kernel Interface table\n'\
-            'br-eth1 Link encap:Ethernet HWaddr 46:5f:ab:d2:ed:47\n'\
-            '  inet addr:192.168.245.4 Bcast:192.168.245.15 '\
-            'Mask:255.255.255.240\n'\
-            '  inet6 addr: fe80::445f:abff:fed2:ed47/64 Scope:Link\n'\
-            '  UP BROADCAST RUNNING MULTICAST MTU:1500 Metric:1\n'\
-            '  RX packets:56610907 errors:0 dropped:0 overruns:0 frame:0\n'\
-            '  TX packets:54015961 errors:0 dropped:0 overruns:0 carrier:0\n'\
-            '  collisions:0 txqueuelen:0\n'\
-            '  RX bytes:29151178698 (27.1 GiB) TX '\
-            'bytes:29647366952 (27.6 GiB)\n'\
-            '\n'\
-            'eth0 Link encap:Ethernet HWaddr 52:54:00:ba:5a:30\n'\
-            '  inet addr:192.168.121.67 Bcast:192.168.121.255 '\
-            'Mask:255.255.255.0\n'\
-            '  inet6 addr: fe80::5054:ff:feba:5a30/64 Scope:Link\n'\
-            '  UP BROADCAST RUNNING MULTICAST MTU:1500 Metric:1\n'\
-            '  RX packets:338611 errors:0 dropped:0 overruns:0 frame:0\n'\
-            '  TX packets:79717 errors:0 dropped:0 overruns:0 carrier:0\n'\
-            '  collisions:0 txqueuelen:1000\n'\
-            '  RX bytes:19263289 (18.3 MiB) TX bytes:5722887 (5.4 MiB)\n'\
-            '\n'\
-            'eth0 Link encap:Ethernet HWaddr 52:54:00:ba:5a:30\n'\
-            '       inet addr:192.168.120.66 Bcast:192.168.121.255 '\
-            'Mask:255.255.255.0\n'\
-            '  inet6 addr: fe80::5054:ff:feba:5a30/64 Scope:Link\n'\
-            '  UP BROADCAST RUNNING MULTICAST MTU:1500 Metric:1\n'\
-            '  RX packets:338611 errors:0 dropped:0 overruns:0 frame:0\n'\
-            '  TX packets:79717 errors:0 dropped:0 overruns:0 carrier:0\n'\
-            '  collisions:0 txqueuelen:1000\n'\
-            '  RX bytes:19263289 (18.3 MiB) TX bytes:5722887 (5.4 MiB)\n'\
-            '\n'\
-            'eth2 Link encap:Ethernet HWaddr 52:54:00:ba:5a:30\n'\
-            '  inet6 addr: fe80::5054:ff:feba:5a30/64 Scope:Link\n'\
-            '  UP BROADCAST RUNNING MULTICAST MTU:1500 Metric:1\n'\
-            '\n'\
-            'eth3 Link encap:Ethernet HWaddr 52:54:00:ba:5a:30\n'\
-            '\n'\
-            'eth4 Link encap:Ethernet HWaddr 52:54:00:ba:5a:30\n'\
-            '  inet6 addr: fe80::5054:ff:feba:5a30/64 Scope:Link\n'\
-            '  UP BROADCAST RUNNING MULTICAST MTU:1500 Metric:1\n'\
-
-        mock_command.return_value = mock_data
-
-        d = utility.ip_to_interface()
-
-        self.assertEqual(d, {'192.168.245.4': 'br-eth1',
+    def test_ip_to_interface(self):
+        testdir = tempfile.mkdtemp()
+        self.addCleanup(rmtree, testdir)
+        if_inet6 = os.path.join(testdir, 'if_inet6')
+        with open(if_inet6, 'w') as f:
+            f.write('00000000000000000000000000000001 01 80 10 80       lo\n'
+                    'fd000000000000000000000000000002 04 40 00 82  br-eth1\n'
+                    'fe80000000000000445fabfffed2ed47 04 40 20 80  br-eth1\n'
+                    'junk\n')
+        ipv4 = [('lo', '127.0.0.1'),
+                ('br-eth1', '192.168.245.4'),
+                ('eth0', '192.168.121.67'),
+                ('eth0:1', '192.168.120.66')]
+
+        with mock.patch('swiftlm.utils.utility._ipv4_addresses',
+                        return_value=ipv4), \
+                mock.patch('swiftlm.utils.utility.IF_INET6', if_inet6), \
+                mock.patch(COMMANDS_MODULE + '.getoutput') as mock_command:
+            d = utility.ip_to_interface()
+
+        self.assertFalse(mock_command.called)
+        self.assertEqual(d, {'127.0.0.1': 'lo',
+                             '192.168.245.4': 'br-eth1',
                              '192.168.121.67': 'eth0',
-                             '192.168.120.66': 'eth0'})
+                             '192.168.120.66': 'eth0:1',
+                             '::1': 'lo',
+                             'fd00::2': 'br-eth1',
+                             'fe80::445f:abff:fed2:ed47': 'br-eth1'})
+
+    def test_ipv4_addresses(self):
+        # The loopback interface is always there
+        self.assertIn(('lo', '127.0.0.1'), utility._ipv4_addresses())
 
 
 class TestDumpUptimeStatsFile(unittest.TestCase):
@@ -151,6 +131,11 @@ class TestGetRingHosts(unittest.TestCase):
     def tearDown(self):
         rmtree(self.testdir, ignore_errors=True)
 
+    def _ring_data(self, devices):
+        # Two replicas of a ring with two partitions
+        return RingData([array.array('H', [0, 0]), array.array('H', [1, 0])],
+                        devices, 31)
+
     def test_finds_object_ring_files(self):
         devices = [dict(ip='1.2.3.4', port='6001', device='/sdb',
                         replication_port='6021', replication_ip='1.2.3.4'),
@@ -162,12 +147,13 @@ class TestGetRingHosts(unittest.TestCase):
             open(os.path.join(self.testdir, f), 'wb')
         with mock.patch('swiftlm.utils.utility.RingData.load') as mock_load:
             with mock.patch('swiftlm.utils.utility.SWIFT_PATH', self.testdir):
-                mock_load.return_value = mock.MagicMock(devs=devices)
+                mock_load.return_value = self._ring_data(devices)
                 results = utility.get_ring_hosts(ServerType.object)
         self.assertEqual(4, len(results))
         # 2 devs per ring file
-        expected = [RingDeviceEntry(dev['ip'], dev['port'], dev['device'])
-                    for dev in devices] * 2
+        expected = [RingDeviceEntry(dev['ip'], dev['port'], dev['device'],
+                                    parts)
+                    for dev, parts in zip(devices, (3, 1))] * 2
         self.assertEqual(expected, results, results)
 
     def test_finds_all_ring_files(self):
@@ -181,12 +167,13 @@ class TestGetRingHosts(unittest.TestCase):
             open(os.path.join(self.testdir, f), 'wb')
         with mock.patch('swiftlm.utils.utility.RingData.load') as mock_load:
             with mock.patch('swiftlm.utils.utility.SWIFT_PATH', self.testdir):
-                mock_load.return_value = mock.MagicMock(devs=devices)
+                mock_load.return_value = self._ring_data(devices)
                 results = utility.get_ring_hosts()
         self.assertEqual(8, len(results))
         # 2 devs per ring file
-        expected = [RingDeviceEntry(dev['ip'], dev['port'], dev['device'])
-                    for dev in devices] * 4
+        expected = [RingDeviceEntry(dev['ip'], dev['port'], dev['device'],
+                                    parts)
+                    for dev, parts in zip(devices, (3, 1))] * 4
         self.assertEqual(expected, results, results)
 
     def test_no_ring_files(self):